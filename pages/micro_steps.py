@@ -6,70 +6,200 @@ micro_steps.py - 微步骤执行页面
 import streamlit as st
 import time
 
+from utils.theme import apply_theme
+from utils.history_store import current_user_id
+from utils.session_backend import session_state_synced, synced_fragment
+from utils.session_budget import enforce_session_budget, get_session_budget
+from utils.maintenance import start_maintenance_scheduler
+from utils.result_store import get_result_store
+from utils.resume_store import restore_resume_point, save_resume_point
+from utils.view_model import build_execution_view, completed_steps_html
+from utils.event_log import get_event_log, new_run_id
+from utils.stats_store import get_stats_store
+
 st.set_page_config(
     page_title="任务执行 | TaskSpark",
     page_icon="🚀",
     layout="wide"
 )
 
-# 复用app.py中的CSS样式
-st.markdown("""
-<style>
-    :root {
-        --primary: #FF9A8B; --primary-light: #FFD6D0;
-        --secondary: #93C5FD; --accent: #A78BFA;
-        --background: #FAFAFA; --surface: #FFFFFF;
-        --text-primary: #374151; --text-secondary: #6B7280;
-        --border: #E5E7EB; --radius-lg: 20px; --radius-md: 14px;
-    }
-    .current-step-card {
-        background: linear-gradient(135deg, var(--primary) 0%, var(--accent) 100%);
-        color: white;
-        border-radius: var(--radius-lg);
-        padding: 2rem;
-        margin: 1rem 0;
-        text-align: center;
-    }
-    .completed-step {
-        background: var(--surface);
-        border-radius: var(--radius-md);
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-left: 4px solid var(--primary);
-        opacity: 0.8;
+# 全局主题样式（static/taskspark.css）
+apply_theme()
+
+# 用户标识保存在Cookie中，不放进URL（链接可以放心分享）
+current_user_id()
+
+# 统计会话状态大小，超出预算时把最旧的记录移出会话
+enforce_session_budget()
+
+# 定期维护在后台线程中执行；直接打开或刷新本页（不经过app.py）时也要启动，每个进程只启动一次
+start_maintenance_scheduler()
+
+# 暂停休息时长（秒）
+BREAK_SECONDS = 5 * 60
+
+# ==================== 步骤事件 ====================
+def log_step_event(event, step_index, seconds=0.0):
+    """记录一条步骤事件（开始/完成/暂停/放弃），附带这次执行的任务类型、心情和难度"""
+    run = st.session_state.get('step_run')
+    if not run:
+        return
+    get_event_log().append(event, step_index, run['total_steps'], run['task_type'], run['mood'],
+                           run['difficulty'], run['id'], seconds)
+
+def analysis_inputs(analysis):
+    """分析结果对应的心情和难度（没有记下的旧结果从 perceived_difficulty 的“N/10”取难度）"""
+    task_analysis = analysis.get('task_analysis', {})
+    difficulty = task_analysis.get('difficulty')
+    if not difficulty:
+        perceived = str(task_analysis.get('perceived_difficulty', '')).split('/')[0]
+        difficulty = int(perceived) if perceived.isdigit() else 0
+    return task_analysis.get('mood') or '', difficulty
+
+def current_run(analysis_id, analysis, view, current_step):
+    """
+    当前这次执行；换了分析结果时，上一次没做完的执行记为放弃，开始新的一次执行
+
+    执行保存在会话中并随会话持久化，从恢复链接打开时继续快照里的那一次执行；
+    开始记录按（用户, 执行）去重，刷新页面或在另一个副本上恢复都不会重复计数。
+    """
+    run = st.session_state.get('step_run')
+    resumed_id = st.session_state.pop('resume_run_id', None)
+    if run and run['analysis_id'] == analysis_id and resumed_id in (None, run['id']):
+        return run
+    if run and not run['finished']:
+        log_step_event('abandoned', st.session_state.get('step_timer', {}).get('step', 0))
+    mood, difficulty = analysis_inputs(analysis)
+    run = {
+        'id': resumed_id or new_run_id(),
+        'analysis_id': analysis_id,
+        'task_type': view['task_type'],
+        'total_steps': view['total_steps'],
+        'mood': mood,
+        'difficulty': difficulty,
+        'finished': current_step >= view['total_steps']
     }
-    .fade-in { animation: fadeIn 0.6s ease-out; }
-    @keyframes fadeIn { from { opacity: 0; transform: translateY(10px); } to { opacity: 1; transform: translateY(0); } }
-    .celebration { animation: pulse 2s infinite; }
-    @keyframes pulse { 0% { transform: scale(1); } 50% { transform: scale(1.05); } 100% { transform: scale(1); } }
-</style>
-""", unsafe_allow_html=True)
+    st.session_state.step_run = run
+    # 统计页的汇总在每次开始和完成时累加，打开统计页时不再扫描记录
+    get_stats_store().record_started(st.session_state.user_id, run)
+    return run
+
+# ==================== 计时器 ====================
+def format_seconds(seconds):
+    """格式化为 mm:ss"""
+    seconds = max(int(seconds), 0)
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+def get_step_timer(step_index):
+    """获取当前步骤的计时状态，切换到新步骤时重新开始计时"""
+    timer = st.session_state.get('step_timer')
+    if not timer or timer['step'] != step_index:
+        timer = {
+            'step': step_index,
+            'started_at': time.time(),
+            'paused_total': 0.0,
+            'break_started_at': None
+        }
+        st.session_state.step_timer = timer
+        log_step_event('started', step_index)
+    return timer
+
+def end_break(timer, now=None):
+    """结束休息，把休息时长计入暂停时间"""
+    if timer['break_started_at'] is not None:
+        now = now or time.time()
+        timer['paused_total'] += min(now - timer['break_started_at'], BREAK_SECONDS)
+        timer['break_started_at'] = None
+
+@st.fragment(run_every=1)
+@synced_fragment
+def timer_panel(step_seconds):
+    """步骤倒计时和休息倒计时，每秒只重新渲染这一块"""
+    timer = st.session_state.step_timer
+    now = time.time()
+    
+    if timer['break_started_at'] is not None:
+        break_remaining = BREAK_SECONDS - (now - timer['break_started_at'])
+        if break_remaining <= 0:
+            end_break(timer, now)
+            st.toast("☀️ 休息结束，继续当前步骤吧！")
+        else:
+            st.info(f"☕ 休息中，还剩 {format_seconds(break_remaining)}（步骤计时已暂停）")
+            if st.button("▶️ 结束休息", key="end_break"):
+                end_break(timer, now)
+                st.rerun(scope="fragment")
+            return
+    
+    elapsed = now - timer['started_at'] - timer['paused_total']
+    remaining = step_seconds - elapsed
+    if remaining > 0:
+        st.progress(min(elapsed / step_seconds, 1.0), text=f"⏳ 本步骤剩余 {format_seconds(remaining)}")
+    else:
+        st.progress(1.0, text=f"⏰ 已超出预计时间 {format_seconds(-remaining)}，完成后点击下方按钮即可")
+
+# ==================== 按钮回调 ====================
+def complete_step(step_index):
+    """完成当前步骤，记录这一步实际用了多少时间（不含休息）；同一步的重复点击不再计数"""
+    if st.session_state.get('current_step', 0) != step_index:
+        return
+    timer = st.session_state.get('step_timer')
+    seconds = 0.0
+    if timer and timer['step'] == step_index:
+        now = time.time()
+        end_break(timer, now)
+        seconds = now - timer['started_at'] - timer['paused_total']
+    log_step_event('completed', step_index, seconds)
+    run = st.session_state.get('step_run')
+    if run and not run['finished']:
+        get_stats_store().record_step_completed(st.session_state.user_id, run, step_index)
+        if step_index + 1 >= run['total_steps']:
+            run['finished'] = True
+    st.session_state.current_step = step_index + 1
+    st.session_state.flash_message = "🎉 完成！"
+
+def start_break():
+    """开始休息，步骤计时暂停"""
+    timer = st.session_state.get('step_timer')
+    if timer and timer['break_started_at'] is None:
+        timer['break_started_at'] = time.time()
+        log_step_event('paused', timer['step'])
+    st.session_state.flash_message = "☕ 休息5分钟，放松一下"
+
+# ==================== 视图模型 ====================
+@st.cache_resource(max_entries=256, show_spinner=False)
+def execution_view(analysis_id, _analysis):
+    """按分析结果的内容标识缓存每一步的卡片和已完成列表片段（各会话共享）"""
+    return build_execution_view(_analysis)
 
 def main():
     st.title("🚀 任务执行中...")
     
-    # 检查是否有分析结果
-    if 'task_analysis' not in st.session_state:
+    # 上一次点击留下的提示（不再用sleep让消息停留）
+    flash = st.session_state.pop('flash_message', None)
+    if flash:
+        st.toast(flash)
+    
+    # URL中带有恢复令牌（刷新页面或在另一台设备上打开）时，直接恢复分析结果和执行进度
+    restore_resume_point()
+    
+    # 检查是否有分析结果（会话中只保存结果的内容标识）
+    analysis_id = st.session_state.get('analysis_id')
+    analysis = get_result_store().get(analysis_id)
+    if analysis is None:
         st.warning("请先进行任务分析")
         if st.button("返回分析页面"):
             st.switch_page("task_analysis.py")
         return
     
-    analysis = st.session_state.task_analysis
     current_step = st.session_state.get('current_step', 0)
     
-    # 获取步骤列表
-    micro_steps = analysis.get('micro_steps', [])
-    if not micro_steps:
-        # 备用步骤
-        micro_steps = [
-            {"step": "准备好必要的工具", "time": "2分钟", "tip": "只是准备，不需要开始"},
-            {"step": "设置5分钟倒计时", "time": "1分钟", "tip": "告诉自己只需坚持5分钟"},
-            {"step": "从最简单的部分开始", "time": "5分钟", "tip": "完成后可以随时停止"},
-            {"step": "完成后给自己奖励", "time": "2分钟", "tip": "庆祝小成就"}
-        ]
+    # 每一步的片段在第一次打开时就已构建好，点击后只取用当前步骤对应的部分
+    view = execution_view(analysis_id, analysis)
+    total_steps = view['total_steps']
+    run = current_run(analysis_id, analysis, view, current_step)
     
-    total_steps = len(micro_steps)
+    # 进度变化时更新恢复令牌指向的快照（带上这次执行），令牌写在URL中
+    save_resume_point(analysis_id, current_step, run['id'])
     
     # 进度显示
     progress = (current_step / total_steps) if total_steps > 0 else 0
@@ -77,27 +207,16 @@ def main():
     
     # 显示当前步骤
     if current_step < total_steps:
-        current_task = micro_steps[current_step]
-        
-        st.markdown(f"""
-        <div class='current-step-card fade-in'>
-            <h2>当前步骤: {current_step + 1}/{total_steps}</h2>
-            <h3 style='margin: 1rem 0;'>📌 {current_task.get('step', '步骤')}</h3>
-            <p style='font-size: 1.2rem;'>⏱️ 预计时间: {current_task.get('time', '')}</p>
-            {f"<p style='margin-top: 1rem; opacity: 0.9;'>💡 {current_task.get('tip', '')}</p>" if current_task.get('tip') else ""}
-        </div>
-        """, unsafe_allow_html=True)
+        step_view = view['steps'][current_step]
+        st.markdown(step_view['card_html'], unsafe_allow_html=True)
+        
+        # 步骤倒计时
+        get_step_timer(current_step)
+        timer_panel(step_view['seconds'])
         
         # 能量提示
-        energy = current_task.get('energy', '')
-        if energy:
-            energy_messages = {
-                "低": "这个步骤能量需求低，容易完成",
-                "中": "中等能量需求，保持专注",
-                "高": "这个步骤需要较多能量，完成后可以休息"
-            }
-            if energy in energy_messages:
-                st.info(f"⚡ 能量提示: {energy_messages[energy]}")
+        if step_view['energy_info']:
+            st.info(step_view['energy_info'])
         
         # 操作按钮
         st.markdown("<div style='margin-top: 2rem;'>", unsafe_allow_html=True)
@@ -105,20 +224,20 @@ def main():
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            if st.button("✅ 完成这一步", type="primary", use_container_width=True):
-                st.session_state.current_step = current_step + 1
-                st.success("🎉 完成！")
-                time.sleep(1)
-                st.rerun()
+            # 按钮逻辑放在回调里，点击后只触发一次重新运行
+            st.button("✅ 完成这一步", type="primary", use_container_width=True,
+                      on_click=complete_step, args=(current_step,))
         
         with col2:
-            if st.button("⏸️ 暂停休息", type="secondary", use_container_width=True):
-                st.info("休息5分钟，放松一下")
-                # 这里可以添加计时器逻辑
-                time.sleep(1)
+            st.button("⏸️ 暂停休息", type="secondary", use_container_width=True,
+                      on_click=start_break)
         
         with col3:
             if st.button("🔄 重新开始", type="secondary", use_container_width=True):
+                # 这一次执行记为放弃，从第一步重新开始新的一次执行
+                log_step_event('abandoned', current_step)
+                st.session_state.pop('step_run', None)
+                st.session_state.pop('step_timer', None)
                 st.session_state.current_step = 0
                 st.rerun()
         
@@ -126,16 +245,8 @@ def main():
         if current_step > 0:
             st.markdown("---")
             st.subheader("✅ 已完成步骤")
-            for i in range(current_step):
-                step = micro_steps[i]
-                st.markdown(f"""
-                <div class='completed-step'>
-                    <strong>步骤 {i+1}:</strong> {step.get('step', '')}
-                    <div style='font-size: 0.9rem; color: var(--text-secondary);'>
-                        ⏱️ {step.get('time', '')} · ✅ 已完成
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+            # 已完成的步骤合并成一段HTML输出，不再每步一个元素
+            st.markdown(completed_steps_html(view, current_step), unsafe_allow_html=True)
     
     else:
         # 所有步骤完成
@@ -149,15 +260,12 @@ def main():
         """, unsafe_allow_html=True)
         
         # 显示鼓励语
-        encouragement = analysis.get('encouragement', '你太棒了！')
-        st.markdown(f"### 💬 {encouragement}")
+        st.markdown(view['encouragement'])
         
         # 显示奖励建议
-        reward_ideas = analysis.get('adhd_specific', {}).get('reward_ideas', [])
-        if reward_ideas:
+        if view['rewards_md']:
             st.markdown("### 🏆 奖励时间")
-            for reward in reward_ideas[:3]:
-                st.markdown(f"- 🎁 {reward}")
+            st.markdown(view['rewards_md'])
         
         # 庆祝选项
         st.markdown("---")
@@ -167,29 +275,27 @@ def main():
         
         with col1:
             if st.button("📊 查看统计", use_container_width=True):
-                st.info("统计功能开发中...")
+                st.switch_page("pages/statistics.py")
         
         with col2:
             if st.button("💾 保存记录", use_container_width=True):
-                # 保存到历史记录
-                if 'completed_tasks' not in st.session_state:
-                    st.session_state.completed_tasks = []
-                
-                st.session_state.completed_tasks.append({
-                    'task': analysis.get('task_analysis', {}).get('task_type', '任务'),
+                # 保存到会话中的环形缓冲（只保留最近的记录，更早的转存到数据库）
+                get_session_budget().append(st.session_state, 'completed_tasks', {
+                    'task': view['task_type'],
                     'time': time.strftime("%Y-%m-%d %H:%M"),
                     'steps': total_steps
-                })
+                }, st.session_state.user_id)
                 
                 st.success("记录已保存！")
         
         with col3:
             if st.button("🔄 新任务", use_container_width=True):
                 # 清理状态
-                if 'task_analysis' in st.session_state:
-                    del st.session_state.task_analysis
+                if 'analysis_id' in st.session_state:
+                    del st.session_state.analysis_id
                 if 'current_step' in st.session_state:
                     del st.session_state.current_step
+                st.session_state.pop('step_run', None)
                 
                 st.switch_page("pages/task_spark_home.py")
         
@@ -205,4 +311,6 @@ def main():
         """)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # 会话状态在运行前后与外部存储同步，刷新或换到其他副本时都能恢复进度
+    with session_state_synced():
+        main()
\ No newline at end of file
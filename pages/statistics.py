@@ -0,0 +1,138 @@
+"""
+statistics.py - 统计页面
+每天完成的任务、按任务类型/心情/难度的完成率和平均每个任务的步骤数
+数据来自按用户累加的汇总表，打开页面的耗时与记录数无关；pandas只用来整理表格和图表
+"""
+
+import streamlit as st
+import pandas as pd
+
+from utils.theme import apply_theme
+from utils.history_store import current_user_id
+from utils.session_backend import session_state_synced
+from utils.session_budget import enforce_session_budget
+from utils.maintenance import start_maintenance_scheduler
+from utils.stats_store import get_stats_store, STATS_DAYS
+
+st.set_page_config(
+    page_title="我的统计 | TaskSpark",
+    page_icon="📊",
+    layout="wide"
+)
+
+# 全局主题样式（static/taskspark.css）
+apply_theme()
+
+# 用户标识保存在Cookie中，不放进URL（链接可以放心分享）
+current_user_id()
+
+# 统计会话状态大小，超出预算时把最旧的记录移出会话
+enforce_session_budget()
+
+# 定期维护在后台线程中执行；直接打开或刷新本页（不经过app.py）时也要启动，每个进程只启动一次
+start_maintenance_scheduler()
+
+# 与首页的情绪选项一致
+MOOD_LABELS = {
+    "energetic": "⚡ 精力充沛",
+    "neutral": "😐 平稳中性",
+    "tired": "😴 有些疲惫",
+    "anxious": "😰 焦虑不安",
+    "procrastinating": "🌀 拖延回避",
+    "overwhelmed": "😫 压力很大"
+}
+
+# ==================== 表格和图表 ====================
+def daily_frame(daily, days=STATS_DAYS):
+    """最近days天每天完成的任务数（没有记录的日期补0）"""
+    dates = pd.date_range(end=pd.Timestamp.now().normalize(), periods=days, freq="D")
+    frame = pd.DataFrame(daily, columns=["day", "tasks_completed", "steps_completed"])
+    frame.index = pd.to_datetime(frame.pop("day"))
+    frame = frame.reindex(dates, fill_value=0)
+    return frame.rename(columns={"tasks_completed": "完成的任务", "steps_completed": "完成的步骤"})
+
+def category_label(dimension, value):
+    """分类的显示名称"""
+    if dimension == "mood":
+        return MOOD_LABELS.get(value, value) or "未记录"
+    if dimension == "difficulty":
+        return f"{value}/10" if value != "0" else "未记录"
+    return value or "未知"
+
+def breakdown_frame(dimension, rows):
+    """一个维度下各分类的开始、完成数、完成率和平均步骤数"""
+    frame = pd.DataFrame([
+        {
+            "分类": category_label(dimension, value),
+            "开始": counts["tasks_started"],
+            "完成": counts["tasks_completed"],
+            "完成率": (counts["completion_rate"] or 0) * 100,
+            "平均步骤": counts["avg_steps_per_task"],
+            "_order": int(value) if dimension == "difficulty" else -counts["tasks_started"]
+        }
+        for value, counts in rows.items()
+    ])
+    if frame.empty:
+        return frame
+    return frame.sort_values("_order").drop(columns="_order")
+
+def show_breakdown(dimension, rows):
+    """显示一个维度的完成率表格"""
+    frame = breakdown_frame(dimension, rows)
+    if frame.empty:
+        st.caption("暂无记录")
+        return
+    st.dataframe(frame, hide_index=True, use_container_width=True, column_config={
+        "完成率": st.column_config.ProgressColumn("完成率", min_value=0, max_value=100, format="%.0f%%"),
+        "平均步骤": st.column_config.NumberColumn("平均步骤", format="%.1f")
+    })
+
+def main():
+    st.title("📊 我的统计")
+
+    # 只读取汇总行（每天一行、每个分类一行）
+    summary = get_stats_store().summary(st.session_state.user_id)
+    totals = summary['totals']
+
+    if not totals['tasks_started']:
+        st.info("还没有统计记录，完成一个任务后再来看看吧！")
+        if st.button("✨ 开始一个任务", type="primary"):
+            st.switch_page("pages/task_spark_home.py")
+        return
+
+    # 总览
+    metrics = [
+        ("🚀 开始的任务", totals['tasks_started']),
+        ("🎉 完成的任务", totals['tasks_completed']),
+        ("📈 完成率", f"{(totals['completion_rate'] or 0) * 100:.0f}%"),
+        ("👣 平均每个任务", f"{totals['avg_steps_per_task'] or 0} 步")
+    ]
+    for col, (label, value) in zip(st.columns(4), metrics):
+        with col:
+            st.metric(label, value)
+
+    st.markdown("<hr>", unsafe_allow_html=True)
+
+    # 每天完成的任务
+    st.subheader(f"📅 最近{STATS_DAYS}天每天完成的任务")
+    st.bar_chart(daily_frame(summary['daily'])[["完成的任务"]], color="#10B981")
+
+    # 各分类的完成率
+    st.subheader("🎯 完成率")
+    for tab, dimension in zip(st.tabs(["任务类型", "心情", "难度"]), ("task_type", "mood", "difficulty")):
+        with tab:
+            show_breakdown(dimension, summary[dimension])
+
+    st.markdown("---")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.session_state.get('analysis_id') and st.button("🚀 返回任务执行", use_container_width=True):
+            st.switch_page("pages/micro_steps.py")
+    with col2:
+        if st.button("🔄 新任务", use_container_width=True):
+            st.switch_page("pages/task_spark_home.py")
+
+if __name__ == "__main__":
+    # 会话状态在运行前后与外部存储同步，刷新或换到其他副本时都能恢复进度
+    with session_state_synced():
+        main()
@@ -4,10 +4,15 @@ task_analysis.py - AI分析结果页面
 """
 
 import streamlit as st
-import time
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from utils.theme import apply_theme
+from utils.history_store import current_user_id
+from utils.session_backend import session_state_synced
+from utils.session_budget import enforce_session_budget
+from utils.maintenance import start_maintenance_scheduler
+from utils.result_store import get_result_store
+from utils.plan_store import get_plan_store, PLAN_PARAM, PLAN_TTL_DAYS
+from utils.view_model import build_analysis_view
 
 st.set_page_config(
     page_title="任务分析 | TaskSpark",
@@ -15,64 +20,142 @@ st.set_page_config(
     layout="wide"
 )
 
-# 复用app.py中的CSS样式
-st.markdown("""
-<style>
-    /* 复用app.py中的所有CSS样式 */
-    :root {
-        --primary: #FF9A8B; --primary-light: #FFD6D0;
-        --secondary: #93C5FD; --accent: #A78BFA;
-        --background: #FAFAFA; --surface: #FFFFFF;
-        --text-primary: #374151; --text-secondary: #6B7280;
-        --border: #E5E7EB; --shadow: 0 10px 25px -5px rgba(0, 0, 0, 0.05);
-        --radius-lg: 20px; --radius-md: 14px; --radius-sm: 10px;
-    }
-    .stApp { background: linear-gradient(135deg, var(--background) 0%, #FEF3C7 100%); min-height: 100vh; }
-    h1 { font-weight: 700; font-size: 2.8rem; background: linear-gradient(135deg, var(--primary) 0%, var(--accent) 100%); -webkit-background-clip: text; -webkit-text-fill-color: transparent; margin-bottom: 1rem; }
-    .ins-card { background: var(--surface); border-radius: var(--radius-lg); padding: 1.8rem; margin: 1rem 0; box-shadow: var(--shadow); border: 1px solid var(--border); }
-    .step-card { background: linear-gradient(135deg, var(--primary-light) 0%, var(--secondary) 100%); color: white; border-radius: var(--radius-md); padding: 1rem; margin: 0.5rem 0; }
-    .fade-in { animation: fadeIn 0.6s ease-out; }
-    @keyframes fadeIn { from { opacity: 0; transform: translateY(10px); } to { opacity: 1; transform: translateY(0); } }
-</style>
-""", unsafe_allow_html=True)
+# 全局主题样式（static/taskspark.css）
+apply_theme()
 
-def main():
-    st.title("🔍 AI任务分析结果")
-    st.markdown("基于你的状态和目标，这是为你定制的智能启动方案")
-    
-    # 检查是否有分析结果
-    if 'task_analysis' not in st.session_state:
-        st.warning("请先回到首页进行任务分析")
-        if st.button("返回首页"):
-            st.switch_page("../task_spark_home.py")
-        return
+# 用户标识保存在Cookie中，不放进URL（链接可以放心分享）
+current_user_id()
+
+# 统计会话状态大小，超出预算时把最旧的记录移出会话
+enforce_session_budget()
+
+# 定期维护在后台线程中执行；直接打开或刷新本页（不经过app.py）时也要启动，每个进程只启动一次
+start_maintenance_scheduler()
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def analysis_view(analysis_id, _analysis=None):
+    """按分析结果的内容标识缓存页面片段，同一份结果只构建一次（各会话共享）"""
+    # 分享链接的304响应不带计划内容，缓存未命中时才从结果存储读取
+    return build_analysis_view(_analysis if _analysis is not None else get_result_store().get(analysis_id))
+
+# ==================== 分享的计划 ====================
+def open_shared_plan(plan_id):
+    """
+    按分享链接中的计划ID读取（只读），返回 (结果标识, 计划内容)
     
-    analysis = st.session_state.task_analysis
+    会话中记住已显示计划的ETag，页面重新运行时带上If-None-Match，
+    304时不再读取计划内容，直接使用缓存的页面片段
+    """
+    shared = st.session_state.get('shared_plan')
+    etag = shared['etag'] if shared and shared['plan_id'] == plan_id else None
+    response = get_plan_store().fetch(plan_id, if_none_match=etag)
+    if response['status'] in (200, 304):
+        st.session_state.shared_plan = {'plan_id': plan_id, 'etag': response['etag']}
+        return response['analysis_hash'], response['analysis']
     
-    # 显示AI模型信息
-    ai_model = analysis.get('_meta', {}).get('ai_model', '智能AI')
-    offline_mode = analysis.get('_meta', {}).get('offline_mode', True)
+    if response['status'] == 410:
+        st.warning("这个分享链接已过期，请让对方重新分享")
+    else:
+        st.warning("找不到这个计划，请检查链接是否完整")
+    return None, None
+
+def share_link(plan_id):
+    """当前页面地址加上计划ID"""
+    base = (st.context.url or "").split("?")[0]
+    return f"{base}?{PLAN_PARAM}={plan_id}" if base else f"task_analysis?{PLAN_PARAM}={plan_id}"
+
+def show_share_button(analysis_id):
+    """分享给监督伙伴"""
+    if st.button("🔗 分享给监督伙伴", use_container_width=True):
+        plan_id = get_plan_store().share(analysis_id)
+        if plan_id:
+            st.code(share_link(plan_id), language=None)
+            st.caption(f"链接 {PLAN_TTL_DAYS:g} 天内有效，对方打开后只能查看，计划内容不会改变")
+        else:
+            st.error("分享失败，请稍后重试")
+
+def show_shared_plan_actions(analysis_id):
+    """只读计划页的操作：用这个计划开始自己的执行"""
+    st.subheader("🚀 一起行动")
+    col1, col2 = st.columns(2)
     
-    st.caption(f"🤖 {ai_model} · {'完全离线运行' if offline_mode else '在线模式'}")
+    with col1:
+        if st.button("✅ 我也用这个计划开始", type="primary", use_container_width=True):
+            st.session_state.analysis_id = analysis_id
+            st.session_state.current_step = 0
+            st.switch_page("pages/micro_steps.py")
     
-    # 任务概览卡片
-    st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
+    with col2:
+        if st.button("📝 分析我自己的任务", type="secondary", use_container_width=True):
+            st.switch_page("pages/task_spark_home.py")
+
+def show_actions(analysis_id):
+    """开始执行、重新分析、返回首页和分享"""
+    st.subheader("🚀 开始执行")
     
-    col1, col2, col3, col4 = st.columns(4)
+    col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("任务类型", analysis.get('task_analysis', {}).get('task_type', '未知'))
+        if st.button("✅ 开始执行第一步", type="primary", use_container_width=True):
+            st.session_state.current_step = 0
+            try:
+            # 尝试多种路径
+                import os
+                if os.path.exists("pages/micro_steps.py"):
+                    st.switch_page("pages/micro_steps.py")
+                elif os.path.exists("micro_steps.py"):
+                    st.switch_page("micro_steps.py")
+                else:
+                    # 如果文件都不存在，显示错误
+                    st.error("找不到执行页面，请检查文件结构")
+            except Exception as e:
+                st.error(f"页面跳转失败: {e}")
     
     with col2:
-        st.metric("难度级别", analysis.get('task_analysis', {}).get('difficulty_level', '未知'))
+        if st.button("🔄 重新分析", type="secondary", use_container_width=True):
+            st.switch_page("pages/task_spark_home.py")
     
     with col3:
-        time_estimate = analysis.get('task_analysis', {}).get('estimated_time', '未知')
-        st.metric("预计时间", time_estimate)
+        if st.button("🏠 返回首页", type="secondary", use_container_width=True):
+            st.switch_page("app.py")
     
-    with col4:
-        step_count = len(analysis.get('micro_steps', []))
-        st.metric("步骤数量", f"{step_count}个")
+    show_share_button(analysis_id)
+
+def main():
+    # 分享链接打开时只读显示对方的计划，不读取也不修改自己的分析结果
+    plan_id = st.query_params.get(PLAN_PARAM)
+    if plan_id:
+        st.title("📋 分享的启动计划")
+        st.markdown("这是朋友分享给你的计划（只读），你可以作为监督伙伴查看，或者用它开始自己的执行")
+        analysis_id, analysis = open_shared_plan(plan_id)
+        if analysis_id is None:
+            if st.button("去分析我自己的任务"):
+                st.switch_page("pages/task_spark_home.py")
+            return
+    else:
+        st.title("🔍 AI任务分析结果")
+        st.markdown("基于你的状态和目标，这是为你定制的智能启动方案")
+        
+        # 检查是否有分析结果（会话中只保存结果的内容标识，结果本身在共享的结果存储中）
+        analysis_id = st.session_state.get('analysis_id')
+        analysis = get_result_store().get(analysis_id)
+        if analysis is None:
+            st.warning("请先回到首页进行任务分析")
+            if st.button("返回首页"):
+                st.switch_page("../task_spark_home.py")
+            return
+    
+    view = analysis_view(analysis_id, analysis)
+    
+    # 显示AI模型信息
+    st.caption(view['caption'])
+    
+    # 任务概览卡片
+    st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
+    
+    for col, (label, value) in zip(st.columns(4), view['metrics']):
+        with col:
+            st.metric(label, value)
     
     st.markdown("</div>", unsafe_allow_html=True)
     
@@ -85,71 +168,38 @@ def main():
     with col1:
         st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
         st.subheader("🎯 推荐策略")
-        
-        strategy = analysis.get('strategy', {})
-        st.markdown(f"""
-        <div class='ins-card'>
-            <h3 style='color: var(--primary); margin-top: 0;'>{strategy.get('name', '微步骤启动法')}</h3>
-            <p>{strategy.get('description', '')}</p>
-            <div style='background: rgba(255, 154, 139, 0.1); padding: 1rem; border-radius: var(--radius-md); margin-top: 1rem;'>
-                <strong>✨ 关键原则:</strong> {strategy.get('key_principle', '完成比完美重要')}
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(view['strategy_html'], unsafe_allow_html=True)
         
         st.subheader("💡 核心洞察")
-        key_insight = analysis.get('task_analysis', {}).get('key_insight', '')
-        st.info(f"✨ {key_insight}")
+        st.info(view['key_insight'])
         st.markdown("</div>", unsafe_allow_html=True)
     
     with col2:
         st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
         st.subheader("🧠 心理障碍分析")
-        
-        mental_blocks = analysis.get('task_analysis', {}).get('mental_blocks', [])
-        if mental_blocks:
-            for block in mental_blocks:
-                st.markdown(f"- 🔍 {block}")
+        if view['mental_blocks_md']:
+            st.markdown(view['mental_blocks_md'])
         else:
             st.write("未识别到明显的心理障碍")
         
         st.subheader("💬 AI鼓励")
-        encouragement = analysis.get('encouragement', '你可以做到的！')
-        st.success(f"💖 {encouragement}")
+        st.success(view['encouragement'])
         
         st.subheader("🏆 完成奖励")
-        reward_ideas = analysis.get('adhd_specific', {}).get('reward_ideas', [])
-        if reward_ideas:
-            for reward in reward_ideas[:3]:
-                st.markdown(f"- 🎁 {reward}")
+        if view['rewards_md']:
+            st.markdown(view['rewards_md'])
         st.markdown("</div>", unsafe_allow_html=True)
     
     # 分隔线
     st.markdown("<hr>", unsafe_allow_html=True)
     
-    # 微步骤执行计划
+    # 微步骤执行计划（整张列表是一段HTML，元素数量不随步骤数增长）
     st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
     st.subheader("📝 分步执行计划")
     st.markdown("<p style='color: var(--text-secondary);'>按照以下步骤开始，每个步骤都很小，容易完成</p>", unsafe_allow_html=True)
     
-    micro_steps = analysis.get('micro_steps', [])
-    if micro_steps:
-        for i, step_info in enumerate(micro_steps, 1):
-            with st.container():
-                col_a, col_b, col_c = st.columns([1, 6, 2])
-                with col_a:
-                    st.markdown(f"### {i}")
-                with col_b:
-                    st.markdown(f"**{step_info.get('step', '步骤')}**")
-                    if step_info.get('tip'):
-                        st.markdown(f"<small style='color: var(--text-secondary);'>💡 {step_info.get('tip')}</small>", unsafe_allow_html=True)
-                with col_c:
-                    st.markdown(f"⏱️ {step_info.get('time', '')}")
-                    energy = step_info.get('energy', '')
-                    if energy:
-                        energy_emoji = "⚡" if energy == "高" else "🔋" if energy == "中" else "🔋"
-                        st.markdown(f"<small>{energy_emoji} {energy}能量</small>", unsafe_allow_html=True)
-                st.markdown("---")
+    if view['steps_html']:
+        st.markdown(view['steps_html'], unsafe_allow_html=True)
     else:
         st.info("未生成微步骤，请返回重新分析")
     
@@ -159,39 +209,32 @@ def main():
     st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
     st.subheader("💡 个性化建议")
     
-    suggestions = analysis.get('personalized_suggestions', [])
-    if suggestions:
-        cols = st.columns(2)
-        for i, suggestion in enumerate(suggestions):
-            col_idx = i % 2
-            with cols[col_idx]:
-                st.markdown(f"- ✅ {suggestion}")
+    if view['suggestion_columns']:
+        for col, column_md in zip(st.columns(2), view['suggestion_columns']):
+            if column_md:
+                with col:
+                    st.markdown(column_md)
     else:
         st.write("暂无个性化建议")
     
     st.markdown("</div>", unsafe_allow_html=True)
     
     # ADHD特定建议
-    adhd_tips = analysis.get('adhd_specific', {})
-    if adhd_tips:
+    if view['has_adhd_tips']:
         st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
         st.subheader("🌟 ADHD友好建议")
         
         col1, col2 = st.columns(2)
         
         with col1:
-            focus_tips = adhd_tips.get('focus_tips', [])
-            if focus_tips:
+            if view['focus_tips_md']:
                 st.markdown("**专注技巧:**")
-                for tip in focus_tips[:3]:
-                    st.markdown(f"- 🎯 {tip}")
+                st.markdown(view['focus_tips_md'])
         
         with col2:
-            env_tips = adhd_tips.get('environment_tips', [])
-            if env_tips:
+            if view['env_tips_md']:
                 st.markdown("**环境调整:**")
-                for tip in env_tips[:3]:
-                    st.markdown(f"🏠 {tip}")
+                st.markdown(view['env_tips_md'])
         
         st.markdown("</div>", unsafe_allow_html=True)
     
@@ -200,35 +243,10 @@ def main():
     
     # 行动按钮
     st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
-    st.subheader("🚀 开始执行")
-    
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        if st.button("✅ 开始执行第一步", type="primary", use_container_width=True):
-            st.session_state.current_step = 0
-            st.success("🎯 准备开始执行！")
-            time.sleep(1)
-            try:
-            # 尝试多种路径
-                import os
-                if os.path.exists("pages/micro_steps.py"):
-                    st.switch_page("pages/micro_steps.py")
-                elif os.path.exists("micro_steps.py"):
-                    st.switch_page("micro_steps.py")
-                else:
-                    # 如果文件都不存在，显示错误
-                    st.error("找不到执行页面，请检查文件结构")
-            except Exception as e:
-                st.error(f"页面跳转失败: {e}")
-    
-    with col2:
-        if st.button("🔄 重新分析", type="secondary", use_container_width=True):
-            st.switch_page("pages/task_spark_home.py")
-    
-    with col3:
-        if st.button("🏠 返回首页", type="secondary", use_container_width=True):
-            st.switch_page("app.py")
+    if plan_id:
+        show_shared_plan_actions(analysis_id)
+    else:
+        show_actions(analysis_id)
     
     # 底部信息
     st.markdown("<hr>", unsafe_allow_html=True)
@@ -246,4 +264,6 @@ def main():
     st.markdown("</div>", unsafe_allow_html=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # 会话状态在运行前后与外部存储同步，刷新或换到其他副本时都能恢复进度
+    with session_state_synced():
+        main()
\ No newline at end of file
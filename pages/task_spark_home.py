@@ -4,12 +4,17 @@ TaskSpark 首页 - 用户任务输入界面
 """
 
 import streamlit as st
-import sys
-import os
-import time
+import uuid
 
-# 添加utils到路径
-sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+# utils 作为包导入（streamlit run app.py 时项目根目录已在导入路径中）
+from utils.ai_engine import warm_up_analyzer, get_readiness, get_analyzer
+from utils.presets import QUICK_PRESETS
+from utils.history_store import get_history_store, current_user_id
+from utils.session_backend import session_state_synced, synced_fragment
+from utils.session_budget import enforce_session_budget
+from utils.maintenance import start_maintenance_scheduler
+from utils.result_store import get_result_store
+from utils.theme import apply_theme
 
 # ==================== 页面配置 ====================
 st.set_page_config(
@@ -19,37 +24,20 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# 复用app.py中的CSS样式
-st.markdown("""
-<style>
-    /* 复用app.py中的所有CSS样式 */
-    .main { padding: 1rem 2rem; max-width: 1200px; margin: 0 auto; }
-    :root {
-        --primary: #FF9A8B; --primary-light: #FFD6D0;
-        --secondary: #93C5FD; --accent: #A78BFA;
-        --background: #FAFAFA; --surface: #FFFFFF;
-        --text-primary: #374151; --text-secondary: #6B7280;
-        --border: #E5E7EB; --shadow: 0 10px 25px -5px rgba(0, 0, 0, 0.05), 0 10px 10px -5px rgba(0, 0, 0, 0.02);
-        --radius-lg: 20px; --radius-md: 14px; --radius-sm: 10px;
-    }
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
-    html, body, [class*="css"] { font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif; }
-    .stApp { background: linear-gradient(135deg, var(--background) 0%, #FEF3C7 100%); min-height: 100vh; }
-    h1 { font-weight: 700; font-size: 2.8rem; background: linear-gradient(135deg, var(--primary) 0%, var(--accent) 100%); -webkit-background-clip: text; -webkit-text-fill-color: transparent; margin-bottom: 1rem; letter-spacing: -0.02em; }
-    .ins-card { background: var(--surface); border-radius: var(--radius-lg); padding: 1.8rem; margin: 1rem 0; box-shadow: var(--shadow); border: 1px solid var(--border); transition: all 0.3s ease; }
-    .stButton > button { background: linear-gradient(135deg, var(--primary) 0%, var(--accent) 100%); color: white; border: none; border-radius: var(--radius-md); padding: 0.8rem 2rem; font-weight: 500; font-size: 1rem; transition: all 0.3s ease; box-shadow: 0 4px 15px rgba(255, 154, 139, 0.3); width: 100%; }
-    .stButton > button:hover { transform: translateY(-2px); box-shadow: 0 8px 25px rgba(255, 154, 139, 0.4); }
-    .stTextInput > div > div > input, .stSelectbox > div > div > select, .stSlider > div { border-radius: var(--radius-md); border: 2px solid var(--border); background: var(--surface); color: var(--text-primary); padding: 0.8rem; font-size: 1rem; }
-    .stTextInput > div > div > input:focus, .stSelectbox > div > div > select:focus { border-color: var(--primary); box-shadow: 0 0 0 3px rgba(255, 154, 139, 0.1); }
-    .mood-option { text-align: center; padding: 1rem; border-radius: var(--radius-md); border: 2px solid transparent; cursor: pointer; transition: all 0.3s ease; background: var(--surface); margin: 0.2rem; }
-    .mood-option:hover { border-color: var(--primary-light); transform: scale(1.02); }
-    .mood-option.selected { border-color: var(--primary); background: linear-gradient(135deg, rgba(255, 154, 139, 0.1) 0%, rgba(147, 197, 253, 0.1) 100%); }
-    @keyframes pulse { 0% { transform: scale(1); } 50% { transform: scale(1.05); } 100% { transform: scale(1); } }
-    .pulse { animation: pulse 2s infinite; }
-    .fade-in { animation: fadeIn 0.6s ease-out; }
-    @keyframes fadeIn { from { opacity: 0; transform: translateY(10px); } to { opacity: 1; transform: translateY(0); } }
-</style>
-""", unsafe_allow_html=True)
+# 全局主题样式（static/taskspark.css）
+apply_theme()
+
+# 用户标识保存在Cookie中，不放进URL（链接可以放心分享）
+current_user_id()
+
+# 统计会话状态大小，超出预算时把最旧的记录移出会话
+enforce_session_budget()
+
+# 定期维护在后台线程中执行；直接打开或刷新本页（不经过app.py）时也要启动，每个进程只启动一次
+start_maintenance_scheduler()
+
+# 直接打开本页时也能触发分析器预热（进程内只执行一次）
+warm_up_analyzer()
 
 # ==================== 初始化session state ====================
 def init_session_state():
@@ -59,156 +47,270 @@ def init_session_state():
             'current_activity': '',
             'target_task': '',
             'mood': '',
-            'difficulty': 5,
-            'history': []
+            'difficulty': 5
         }
     
-    if 'task_analysis' not in st.session_state:
-        st.session_state.task_analysis = None
-    
     # 处理快捷启动
     if 'quick_start' in st.session_state and st.session_state.quick_start:
         handle_quick_start(st.session_state.quick_start)
         st.session_state.quick_start = None
 
 def handle_quick_start(quick_type):
-    """处理快捷启动"""
-    quick_presets = {
-        'study': {
-            'current_activity': '刷手机/看视频',
-            'target_task': '学习/复习考试',
-            'mood': 'procrastinating',  # 改为英文ID
-            'difficulty': 7
-        },
-        'clean': {
-            'current_activity': '躺在床上',
-            'target_task': '整理房间/打扫卫生',
-            'mood': 'tired',  # 改为英文ID
-            'difficulty': 6
-        },
-        'work': {
-            'current_activity': '坐在桌前发呆',
-            'target_task': '写报告/完成工作',
-            'mood': 'anxious',  # 改为英文ID
-            'difficulty': 8
-        }
-    }
-    
-    if quick_type in quick_presets:
-        preset = quick_presets[quick_type]
-        st.session_state.user_state.update(preset)
+    """处理快捷启动（预设的分析结果已在进程启动时预先计算）"""
+    if quick_type in QUICK_PRESETS:
+        fill_form(QUICK_PRESETS[quick_type])
+
+# ==================== 表单控件 ====================
+# 表单控件的key；user_state是唯一的数据来源，控件的值在渲染前从user_state同步
+FORM_KEYS = {
+    'current_activity': 'form_current_activity',
+    'target_task': 'form_target_task',
+    'mood': 'form_mood',
+    'difficulty': 'form_difficulty'
+}
+
+MOODS = [
+    {"id": "energetic", "emoji": "⚡", "name": "精力充沛", "color": "#10B981"},
+    {"id": "neutral", "emoji": "😐", "name": "平稳中性", "color": "#6B7280"},
+    {"id": "tired", "emoji": "😴", "name": "有些疲惫", "color": "#F59E0B"},
+    {"id": "anxious", "emoji": "😰", "name": "焦虑不安", "color": "#EF4444"},
+    {"id": "procrastinating", "emoji": "🌀", "name": "拖延回避", "color": "#8B5CF6"},
+    {"id": "overwhelmed", "emoji": "😫", "name": "压力很大", "color": "#DC2626"}
+]
+MOOD_LABELS = {mood["id"]: f"{mood['emoji']} {mood['name']}" for mood in MOODS}
+
+# 点击分析时，推测分析仍在进行的最长等待时间（秒），超时后直接重新分析
+SPECULATION_WAIT_SECONDS = 20
+
+def widget_value(field, value):
+    """user_state中的值转换为控件的值（未选择情绪时分段控件的值是None）"""
+    if field == 'mood':
+        return value or None
+    return value
+
+def fill_form(values):
+    """
+    预填表单（快捷启动、快速重试、重置）
+
+    控件的值只能在控件渲染之前修改，所以只能在页面开头或按钮回调中调用
+    """
+    st.session_state.user_state.update(values)
+    for field, key in FORM_KEYS.items():
+        if field in values:
+            st.session_state[key] = widget_value(field, values[field])
+
+def sync_form_state():
+    """控件的值在离开本页后会被清掉，回到本页时从user_state恢复"""
+    user_state = st.session_state.user_state
+    for field, key in FORM_KEYS.items():
+        if key not in st.session_state:
+            default = 5 if field == 'difficulty' else ''
+            st.session_state[key] = widget_value(field, user_state.get(field, default))
 
 # ==================== 情绪选择器 ====================
-def mood_selector(selected_mood):
+def mood_selector():
     """创建情绪选择器"""
-    moods = [
-        {"id": "energetic", "emoji": "⚡", "name": "精力充沛", "color": "#10B981"},
-        {"id": "neutral", "emoji": "😐", "name": "平稳中性", "color": "#6B7280"},
-        {"id": "tired", "emoji": "😴", "name": "有些疲惫", "color": "#F59E0B"},
-        {"id": "anxious", "emoji": "😰", "name": "焦虑不安", "color": "#EF4444"},
-        {"id": "procrastinating", "emoji": "🌀", "name": "拖延回避", "color": "#8B5CF6"},
-        {"id": "overwhelmed", "emoji": "😫", "name": "压力很大", "color": "#DC2626"}
-    ]
-    
-    st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
     st.markdown("#### 🎭 选择当前情绪")
     st.markdown("<p style='color: var(--text-secondary); margin-bottom: 1rem;'>选择最符合你现在感受的情绪</p>", unsafe_allow_html=True)
     
-    # 创建3列布局
-    cols = st.columns(3)
-    
-    for idx, mood in enumerate(moods):
-        col_idx = idx % 3
-        is_selected = selected_mood == mood["id"]
-        
-        with cols[col_idx]:
-            button_html = f"""
-            <div class='mood-option {'selected' if is_selected else ''}' 
-                 onclick="this.parentNode.querySelector('button').click()"
-                 style='border-color: {mood['color'] if is_selected else 'transparent'};'>
-                <div style='font-size: 2rem; margin-bottom: 0.5rem;'>{mood['emoji']}</div>
-                <div style='font-weight: {'600' if is_selected else '400'}; color: var(--text-primary);'>
-                    {mood['name']}
-                </div>
-            </div>
-            """
-            
-            # 创建隐藏的按钮
-            if st.button(mood["name"], key=f"mood_{mood['id']}", 
-                        use_container_width=True, 
-                        type="primary" if is_selected else "secondary",
-                        help=f"选择 {mood['name']}"):
-                st.session_state.user_state['mood'] = mood['id']
-                st.rerun()
-    
-    st.markdown("</div>", unsafe_allow_html=True)
-    return selected_mood
+    return st.segmented_control(
+        "选择当前情绪",
+        options=list(MOOD_LABELS.keys()),
+        format_func=MOOD_LABELS.get,
+        key=FORM_KEYS['mood'],
+        label_visibility="collapsed"
+    )
 
 # ==================== 难度选择器 ====================
 def difficulty_selector():
     """创建难度选择器"""
-    current_difficulty = st.session_state.user_state.get('difficulty', 5)
-    st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
     st.markdown("#### 🎯 评估任务难度")
     st.markdown("<p style='color: var(--text-secondary); margin-bottom: 1rem;'>你觉得开始这个任务有多困难？</p>", unsafe_allow_html=True)
     
-    # 难度描述
-    difficulty_descriptions = {
-        1: {"label": "很简单", "desc": "有信心轻松开始"},
-        3: {"label": "有点挑战", "desc": "需要一点努力"},
-        5: {"label": "中等难度", "desc": "需要一些决心"},
-        7: {"label": "相当困难", "desc": "需要很大动力"},
-        10: {"label": "极其困难", "desc": "感觉几乎不可能开始"}
-    }
-
-    # 创建滑块
+    # 表单提交前不会重新运行，难度说明以刻度的形式一次显示
     difficulty = st.slider(
         "难度评分 (1-10)",
         min_value=1,
         max_value=10,
-        value=current_difficulty,
         step=1,
+        format="%d/10",
+        key=FORM_KEYS['difficulty'],
         label_visibility="collapsed",
     )
+    st.caption("1 很简单 · 3 有点挑战 · 5 中等难度 · 7 相当困难 · 10 极其困难")
+    
+    return difficulty
+
+def can_analyze(user_state):
+    """当前、目标和情绪都填写后才能开始分析"""
+    return bool(user_state.get('current_activity') and user_state.get('target_task') and user_state.get('mood'))
+
+# ==================== 推测分析 ====================
+def speculation_session_id():
+    """当前会话在推测执行器中的标识"""
+    if 'speculation_id' not in st.session_state:
+        st.session_state.speculation_id = uuid.uuid4().hex
+    return st.session_state.speculation_id
+
+def form_inputs():
+    """表单控件当前的值，按analyze_task的参数组织"""
+    return {
+        'current_state': st.session_state[FORM_KEYS['current_activity']],
+        'target_task': st.session_state[FORM_KEYS['target_task']],
+        'mood': st.session_state[FORM_KEYS['mood']] or '',
+        'difficulty': st.session_state[FORM_KEYS['difficulty']]
+    }
+
+def speculate_if_ready():
+    """
+    表单内容齐全时（快捷启动、快速重试或从分析页返回）提前在后台开始分析
 
-    # 更新 user_state
-    if difficulty != current_difficulty:
-        st.session_state.user_state['difficulty'] = difficulty
+    输入和上一次推测相同时不会重复安排；输入变化后旧的推测由执行器取消或丢弃
+    """
+    inputs = form_inputs()
+    analyzer = get_analyzer()
+    if analyzer.speculation_enabled and inputs['current_state'] and inputs['target_task'] and inputs['mood']:
+        analyzer.speculator.speculate(speculation_session_id(), inputs)
 
-    # 显示难度描述
-    closest = min(difficulty_descriptions.keys(), key=lambda x: abs(x - difficulty))
-    desc = difficulty_descriptions[closest]
+# ==================== 任务表单 ====================
+@st.fragment
+@synced_fragment
+def task_form():
+    """
+    任务输入表单
+
+    四项输入只在点击“开始分析”时一起提交，提交只产生一次重新运行和一次分析；
+    表单放在fragment中，信息不全时只重新运行表单本身
+    """
+    sync_form_state()
     
-    st.markdown(f"""
-    <div style='text-align: center; margin-top: 1rem;'>
-        <div style='font-size: 2rem; font-weight: 700; color: var(--primary);'>{difficulty}/10</div>
-        <div style='font-weight: 600; color: var(--text-primary); margin-top: 0.5rem;'>{desc['label']}</div>
-        <div style='color: var(--text-secondary); font-size: 0.9rem;'>{desc['desc']}</div>
-    </div>
-    """, unsafe_allow_html=True)
+    with st.form("task_form", border=False):
+        st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
+        
+        # 当前状态输入
+        st.markdown("#### 📱 你现在在做什么？")
+        current_activity = st.text_input(
+            "描述你当前的活动状态",
+            key=FORM_KEYS['current_activity'],
+            placeholder="例如：躺在床上刷手机、坐在桌前发呆、刚睡醒...",
+            help="如实描述你现在在做什么，这有助于AI理解你的启动困难"
+        )
+        
+        # 目标任务输入
+        st.markdown("#### 🎯 你想要做什么？")
+        target_task = st.text_input(
+            "描述你想要开始的任务",
+            key=FORM_KEYS['target_task'],
+            placeholder="例如：整理房间、复习期末考试、写工作报告...",
+            help="明确描述你想要开始的任务，越具体越好"
+        )
+        
+        # 分隔线
+        st.markdown("<hr style='margin: 2rem 0;'>", unsafe_allow_html=True)
+        
+        # 情绪选择
+        selected_mood = mood_selector()
+        
+        # 难度选择
+        difficulty = difficulty_selector()
+        
+        st.markdown("</div>", unsafe_allow_html=True)
+        
+        # 分析按钮
+        st.markdown("<div style='margin-top: 3rem;'>", unsafe_allow_html=True)
+        
+        if not get_readiness()["ready"]:
+            st.caption("⏳ AI引擎正在预热，首次分析可能稍慢")
+        
+        submitted = st.form_submit_button("🚀 开始AI智能分析", 
+                                          type="primary", 
+                                          use_container_width=True,
+                                          help="请填写所有必要信息")
+        
+        st.markdown("</div>", unsafe_allow_html=True)
     
-    st.markdown("</div>", unsafe_allow_html=True)
+    if not submitted:
+        speculate_if_ready()
+        return
     
-    return difficulty
+    # 提交时一次性更新user_state
+    st.session_state.user_state.update({
+        'current_activity': current_activity,
+        'target_task': target_task,
+        'mood': selected_mood or '',
+        'difficulty': difficulty
+    })
+    
+    if not can_analyze(st.session_state.user_state):
+        st.warning("请填写所有必要信息")
+        return
+    
+    # 调用AI分析
+    analysis_result = analyze_with_ai(
+        current_state=current_activity,
+        target_task=target_task,
+        mood=selected_mood,
+        difficulty=difficulty
+    )
+    
+    if analysis_result:
+        # 分析结果存入共享的结果存储，会话中只保存内容标识
+        st.session_state.analysis_id = get_result_store().put(analysis_result)
+        
+        # 保存到历史记录
+        save_to_history(st.session_state.user_state, st.session_state.analysis_id)
+        
+        # 跳转到分析页面
+        st.switch_page("pages/task_analysis.py")
+    else:
+        st.error("AI分析失败，请稍后重试或检查配置")
+
+# ==================== 预填回调 ====================
+def retry_record(record):
+    """用历史记录预填表单"""
+    # 处理情绪ID映射（从显示文本映射回ID）
+    mood_id = record.get('mood', '')
+    
+    # 如果mood是中文（来自预设），需要映射回ID
+    chinese_to_english = {mood["name"]: mood["id"] for mood in MOODS}
+    if mood_id in chinese_to_english:
+        mood_id = chinese_to_english[mood_id]
+    
+    fill_form({
+        'current_activity': record['from'],
+        'target_task': record['to'],
+        'mood': mood_id,
+        'difficulty': record.get('difficulty', 5)
+    })
+
+def reset_form():
+    """清空表单，保留历史记录"""
+    fill_form({
+        'current_activity': '',
+        'target_task': '',
+        'mood': '',
+        'difficulty': 5
+    })
 
 # ==================== AI分析函数 ====================
 def analyze_with_ai(current_state, target_task, mood, difficulty):
     """调用智能AI分析任务"""
     try:
-        from utils.ai_engine import get_analyzer
-        
         analyzer = get_analyzer()
+        inputs = {
+            'current_state': current_state,
+            'target_task': target_task,
+            'mood': mood,
+            'difficulty': difficulty
+        }
         
         with st.spinner("🤖 AI正在分析你的任务..."):
-            time.sleep(1)
+            # 输入与推测一致时直接使用后台已完成（或正在进行）的分析
+            analysis = analyzer.take_speculative(speculation_session_id(), inputs, timeout=SPECULATION_WAIT_SECONDS)
             
             # 调用AI分析
-            analysis = analyzer.analyze_task(
-                current_state=current_state,
-                target_task=target_task,
-                mood=mood,
-                difficulty=difficulty
-            )
+            if analysis is None:
+                analysis = analyzer.analyze_task(**inputs)
             
             # 检查分析结果
             if not analysis:
@@ -232,26 +334,80 @@ def analyze_with_ai(current_state, target_task, mood, difficulty):
         traceback.print_exc()
         return None
 
-# ==================== 保存历史记录 ====================
-def save_to_history(user_state, analysis_result):
-    """保存任务到历史记录"""
-    if 'history' not in st.session_state.user_state:
-        st.session_state.user_state['history'] = []
-    
-    history_entry = {
-        'timestamp': time.strftime("%Y-%m-%d %H:%M"),
+# ==================== 历史记录 ====================
+# 每页显示的历史记录条数
+HISTORY_PAGE_SIZE = 5
+
+def save_to_history(user_state, analysis_id):
+    """保存任务到历史记录（SQLite后台批量写入，只保存分析结果的内容标识）"""
+    get_history_store().enqueue(current_user_id(), {
         'from': user_state['current_activity'],
         'to': user_state['target_task'],
         'mood': user_state['mood'],
-        'difficulty': user_state['difficulty'],
-        'analysis': analysis_result
-    }
+        'difficulty': user_state['difficulty']
+    }, analysis_id)
+    st.session_state.history_cursor = None
+
+def show_history_page(cursor):
+    """翻页：会话中只保存当前页的游标"""
+    st.session_state.history_cursor = cursor
+
+@st.fragment
+@synced_fragment
+def history_panel():
+    """
+    历史记录列表
+
+    每次渲染只读取当前页的摘要；展开某条记录时才读取它的完整分析结果，
+    展开、收起和翻页都只重新运行这一块
+    """
+    store = get_history_store()
+    user_id = current_user_id()
+    cursor = st.session_state.get('history_cursor')
+    history, next_cursor = store.page(user_id, cursor, HISTORY_PAGE_SIZE)
     
-    st.session_state.user_state['history'].insert(0, history_entry)
+    if not history:
+        st.info("暂无历史记录")
+        st.caption("完成的任务会显示在这里")
+        return
     
-    # 只保留最近10条记录
-    if len(st.session_state.user_state['history']) > 10:
-        st.session_state.user_state['history'] = st.session_state.user_state['history'][:10]
+    for i, record in enumerate(history):
+        with st.expander(f"{record['from']} → {record['to']}", expanded=(i == 0 and cursor is None),
+                         key=f"history_{record['id']}", on_change="rerun") as expander:
+            st.caption(f"时间: {record['timestamp']}")
+            
+            # 情绪显示
+            mood_text = MOOD_LABELS.get(record.get('mood', ''), record.get('mood', '未知'))
+            st.write(f"**情绪:** {mood_text}")
+            
+            st.write(f"**难度:** {record.get('difficulty', '?')}/10")
+            
+            # 展开时才读取完整分析
+            if expander.open:
+                analysis_id = store.get_analysis_hash(user_id, record['id'])
+                analysis = get_result_store().get(analysis_id)
+                if analysis:
+                    st.caption(f"{analysis['task_analysis']['task_type']} · "
+                               f"{len(analysis['micro_steps'])}个步骤 · {analysis['strategy']['name']}")
+                    if st.button("📖 查看分析", key=f"view_{record['id']}", use_container_width=True):
+                        st.session_state.analysis_id = analysis_id
+                        st.switch_page("pages/task_analysis.py")
+            
+            # 快速重试按钮：回调中预填表单（控件渲染之前）；表单在另一个片段中，
+            # 只重新运行本片段时表单仍显示旧值，所以点击后重新运行整个页面
+            if st.button("🔄 快速重试", key=f"retry_{record['id']}", use_container_width=True,
+                         on_click=retry_record, args=(record,)):
+                st.rerun(scope="app")
+    
+    # 翻页
+    if cursor is not None or next_cursor is not None:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.button("⬅️ 最新", key="history_newest", use_container_width=True, disabled=cursor is None,
+                      on_click=show_history_page, args=(None,))
+        with col2:
+            st.button("更早 ➡️", key="history_older", use_container_width=True, disabled=next_cursor is None,
+                      on_click=show_history_page, args=(next_cursor,))
 
 # ==================== 主页面 ====================
 def main():
@@ -284,97 +440,7 @@ def main():
     left_col, right_col = st.columns([2, 1])
     
     with left_col:
-        st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
-        
-        # 当前状态输入 - 直接使用user_state中的值
-        st.markdown("#### 📱 你现在在做什么？")
-        current_activity = st.text_input(
-            "描述你当前的活动状态",
-            value=st.session_state.user_state.get('current_activity', ''),
-            placeholder="例如：躺在床上刷手机、坐在桌前发呆、刚睡醒...",
-            # 不要添加key，让value参数控制显示
-            help="如实描述你现在在做什么，这有助于AI理解你的启动困难"
-        )
-
-        # 在输入后立即更新 user_state
-        if current_activity != st.session_state.user_state.get('current_activity', ''):
-            st.session_state.user_state['current_activity'] = current_activity
-
-        # 同理处理目标任务
-        st.markdown("#### 🎯 你想要做什么？")
-        target_task = st.text_input(
-            "描述你想要开始的任务",
-            value=st.session_state.user_state.get('target_task', ''),
-            placeholder="例如：整理房间、复习期末考试、写工作报告...",
-            # 不要添加key，让value参数控制显示
-            help="明确描述你想要开始的任务，越具体越好"
-        )
-
-        if target_task != st.session_state.user_state.get('target_task', ''):
-            st.session_state.user_state['target_task'] = target_task
-        
-        # 分隔线
-        st.markdown("<hr style='margin: 2rem 0;'>", unsafe_allow_html=True)
-        
-        # 情绪选择
-        selected_mood = st.session_state.user_state.get('mood', '')
-        mood_selector(selected_mood)
-        
-        # 难度选择
-        difficulty = difficulty_selector()
-
-        # 确保 user_state 中有最新的难度值
-        if 'difficulty' not in st.session_state.user_state:
-            st.session_state.user_state['difficulty'] = difficulty
-
-        # 更新session state
-        st.session_state.user_state.update({
-            'current_activity': current_activity,
-            'target_task': target_task,
-        })
-        
-        st.markdown("</div>", unsafe_allow_html=True)
-        
-        # 分析按钮
-        st.markdown("<div style='margin-top: 3rem;'>", unsafe_allow_html=True)
-        
-        # 检查必要输入
-        can_analyze = current_activity and target_task and selected_mood
-        
-        if st.button("🚀 开始AI智能分析", 
-                    type="primary", 
-                    use_container_width=True,
-                    disabled=not can_analyze,
-                    help="请填写所有必要信息"):
-            
-            if can_analyze:
-                # 调用AI分析
-                analysis_result = analyze_with_ai(
-                    current_state=current_activity,
-                    target_task=target_task,
-                    mood=selected_mood,
-                    difficulty=difficulty
-                )
-                
-                if analysis_result:
-                    # 保存分析结果
-                    st.session_state.task_analysis = analysis_result
-                    
-                    # 保存到历史记录
-                    save_to_history(st.session_state.user_state, analysis_result)
-                    
-                    # 成功消息
-                    st.success("✅ AI分析完成！正在跳转到分析页面...")
-                    time.sleep(1)
-                    
-                    # 跳转到分析页面
-                    st.switch_page("pages/task_analysis.py")
-                else:
-                    st.error("AI分析失败，请稍后重试或检查配置")
-            else:
-                st.warning("请填写所有必要信息")
-        
-        st.markdown("</div>", unsafe_allow_html=True)
+        task_form()
     
     with right_col:
         st.markdown("<div class='fade-in'>", unsafe_allow_html=True)
@@ -382,64 +448,7 @@ def main():
         # 历史记录卡片
         st.markdown("#### 📚 历史记录")
         
-        history = st.session_state.user_state.get('history', [])
-        
-        if history:
-            for i, record in enumerate(history[:5]):  # 只显示最近5条
-                with st.expander(f"{record['from']} → {record['to']}", expanded=(i==0)):
-                    st.caption(f"时间: {record['timestamp']}")
-                    
-                    # 情绪显示
-                    mood_map = {
-                        "energetic": "⚡ 精力充沛",
-                        "neutral": "😐 平稳中性",
-                        "tired": "😴 有些疲惫",
-                        "anxious": "😰 焦虑不安",
-                        "procrastinating": "🌀 拖延回避",
-                        "overwhelmed": "😫 压力很大"
-                    }
-                    mood_text = mood_map.get(record.get('mood', ''), record.get('mood', '未知'))
-                    st.write(f"**情绪:** {mood_text}")
-                    
-                    st.write(f"**难度:** {record.get('difficulty', '?')}/10")
-                    
-                    # 快速重试按钮
-                    if st.button("🔄 快速重试", key=f"retry_{i}", use_container_width=True):
-                        # 获取记录中的难度
-                        record_difficulty = record.get('difficulty', 5)
-                        # 处理情绪ID映射（从显示文本映射回ID）
-                        mood_id = record.get('mood', '')
-                        
-                        # 如果mood是中文（来自预设），需要映射回ID
-                        chinese_to_english = {
-                            "拖延回避": "procrastinating",
-                            "有些疲惫": "tired", 
-                            "焦虑不安": "anxious",
-                            "精力充沛": "energetic",
-                            "平稳中性": "neutral", 
-                            "压力很大": "overwhelmed"
-                        }
-                        
-                        if mood_id in chinese_to_english:
-                            mood_id = chinese_to_english[mood_id]
-                        
-                        # 更新所有状态
-                        st.session_state.user_state.update({
-                            'current_activity': record['from'],
-                            'target_task': record['to'],
-                            'mood': mood_id,  # 使用处理后的情绪值
-                            'difficulty': record_difficulty
-                        })
-                        
-                        # 不要直接修改小部件的session_state
-                        # st.session_state['current_activity_input'] = record['from']  # 删除这行
-                        # st.session_state['target_task_input'] = record['to']  # 删除这行
-                        
-                        # 直接重新运行，让输入框从更新后的user_state中获取值
-                        st.rerun()
-        else:
-            st.info("暂无历史记录")
-            st.caption("完成的任务会显示在这里")
+        history_panel()
         
         st.markdown("<hr style='margin: 1.5rem 0;'>", unsafe_allow_html=True)
         
@@ -468,19 +477,19 @@ def main():
             {"label": "🌀 → 💼", "desc": "从拖延到工作", "key": "quick_work"}
         ]
         
+        quick_map = {
+            "quick_study": "study",
+            "quick_clean": "clean",
+            "quick_work": "work"
+        }
+        
         for scenario in quick_scenarios:
-            if st.button(f"{scenario['label']} {scenario['desc']}", 
-                        key=scenario['key'],
-                        use_container_width=True,
-                        type="secondary"):
-                # 设置对应的快捷启动
-                quick_map = {
-                    "quick_study": "study",
-                    "quick_clean": "clean",
-                    "quick_work": "work"
-                }
-                st.session_state.quick_start = quick_map.get(scenario['key'])
-                st.rerun()
+            # 设置对应的快捷启动
+            st.button(f"{scenario['label']} {scenario['desc']}", 
+                      key=scenario['key'],
+                      use_container_width=True,
+                      type="secondary",
+                      on_click=handle_quick_start, args=(quick_map[scenario['key']],))
         
         st.markdown("</div>", unsafe_allow_html=True)
     
@@ -491,18 +500,7 @@ def main():
         if st.button("← 返回主页", use_container_width=True):
             st.switch_page("app.py")
     with col2:
-        if st.button("🔄 重置表单", use_container_width=True, type="secondary"):
-            st.session_state.user_state = {
-                'current_activity': '',
-                'target_task': '',
-                'mood': '',
-                'difficulty': 5,
-                'history': st.session_state.user_state.get('history', [])
-            }
-            # 不要直接修改小部件的session_state
-            # st.session_state['current_activity_input'] = ''  # 删除这行
-            # st.session_state['target_task_input'] = ''  # 删除这行
-            st.rerun()
+        st.button("🔄 重置表单", use_container_width=True, type="secondary", on_click=reset_form)
     with col3:
         st.markdown("""
         <div style='text-align: center; color: var(--text-secondary);'>
@@ -513,4 +511,6 @@ def main():
 
 # ==================== 运行主函数 ====================
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # 会话状态在运行前后与外部存储同步，刷新或换到其他副本时都能恢复进度
+    with session_state_synced():
+        main()
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+accounting.py - 模型调用的用量与成本统计
+记录每次后端调用的token、排队/网络/解析耗时和重试次数，
+并按后端、按模型维护滚动窗口计数，供后续的路由和预算决策查询
+"""
+
+import os
+import threading
+import time
+from collections import deque, defaultdict
+from typing import Dict, Any, Optional, List
+
+# 每百万token的价格（美元），通过环境变量配置，默认不计费
+PRICE_PER_1M_INPUT = float(os.getenv("REMOTE_PRICE_PER_1M_INPUT", "0"))
+PRICE_PER_1M_OUTPUT = float(os.getenv("REMOTE_PRICE_PER_1M_OUTPUT", "0"))
+
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "queue_ms", "network_ms", "parse_ms", "compute_ms", "total_ms", "retries", "cost_usd")
+
+
+def new_usage(backend: str, model: str) -> Dict[str, Any]:
+    """创建一条空的用量记录"""
+    usage = {"backend": backend, "model": model, "ok": True}
+    for field in USAGE_FIELDS:
+        usage[field] = 0
+    return usage
+
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int) -> float:
+    """按配置的单价估算一次调用的成本"""
+    return round((prompt_tokens * PRICE_PER_1M_INPUT + completion_tokens * PRICE_PER_1M_OUTPUT) / 1_000_000, 6)
+
+
+class UsageLedger:
+    """
+    用量账本
+
+    每条记录进入对应（后端, 模型）的滚动窗口，超出窗口时间的记录在写入和查询时淘汰；
+    同时维护从进程启动以来的累计值。
+    """
+
+    def __init__(self, window_seconds: float = 3600, max_records_per_key: int = 10000):
+        """
+        Args:
+            window_seconds: 滚动窗口长度（秒）
+            max_records_per_key: 每个（后端, 模型）最多保留的记录数
+        """
+        self.window_seconds = window_seconds
+        self._windows: Dict[tuple, deque] = defaultdict(lambda: deque(maxlen=max_records_per_key))
+        self._totals: Dict[tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def record(self, usage: Dict[str, Any]):
+        """记录一次调用"""
+        key = (usage["backend"], usage["model"])
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows[key]
+            window.append((now, usage))
+            self._expire(window, now)
+
+            totals = self._totals[key]
+            totals["calls"] += 1
+            totals["errors"] += 0 if usage.get("ok", True) else 1
+            for field in USAGE_FIELDS:
+                totals[field] += usage.get(field, 0)
+
+    def _expire(self, window: deque, now: float):
+        while window and now - window[0][0] > self.window_seconds:
+            window.popleft()
+
+    def query(self, backend: Optional[str] = None, model: Optional[str] = None) -> Dict[str, Any]:
+        """
+        查询滚动窗口内的汇总
+
+        Args:
+            backend: 只统计该后端（为空表示全部）
+            model: 只统计该模型（为空表示全部）
+        """
+        now = time.monotonic()
+        records: List[Dict[str, Any]] = []
+        with self._lock:
+            for (key_backend, key_model), window in self._windows.items():
+                if backend is not None and key_backend != backend:
+                    continue
+                if model is not None and key_model != model:
+                    continue
+                self._expire(window, now)
+                records.extend(usage for _, usage in window)
+
+        summary = {"calls": len(records), "errors": sum(1 for r in records if not r.get("ok", True))}
+        for field in USAGE_FIELDS:
+            summary[field] = round(sum(r.get(field, 0) for r in records), 6 if field == "cost_usd" else 2)
+        if records:
+            totals = sorted(r["total_ms"] for r in records)
+            summary["avg_total_ms"] = round(summary["total_ms"] / len(records), 2)
+            summary["p95_total_ms"] = totals[min(int(len(totals) * 0.95), len(totals) - 1)]
+            summary["avg_cost_usd"] = round(summary["cost_usd"] / len(records), 6)
+        return summary
+
+    def get_totals(self) -> Dict[str, Dict[str, float]]:
+        """进程启动以来按“后端/模型”累计的用量"""
+        with self._lock:
+            return {f"{backend}/{model}": dict(totals) for (backend, model), totals in self._totals.items()}
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """按后端和按模型分组的滚动窗口汇总"""
+        with self._lock:
+            keys = list(self._windows.keys())
+        return {
+            "window_seconds": self.window_seconds,
+            "by_backend": {backend: self.query(backend=backend) for backend in sorted({k[0] for k in keys})},
+            "by_model": {model: self.query(model=model) for model in sorted({k[1] for k in keys})}
+        }
+
+
+# 测试函数
+def test_usage_ledger():
+    """测试用量账本"""
+    print("🧪 测试用量账本")
+    print("=" * 60)
+
+    ledger = UsageLedger(window_seconds=0.05)
+    for backend, model, tokens in (("remote", "gpt-4o-mini", 1200), ("remote", "gpt-4o-mini", 800), ("simulator", "TaskSpark AI", 0)):
+        usage = new_usage(backend, model)
+        usage.update(prompt_tokens=tokens, completion_tokens=tokens // 4, total_ms=100)
+        ledger.record(usage)
+
+    remote = ledger.query(backend="remote")
+    assert remote["calls"] == 2 and remote["prompt_tokens"] == 2000
+    print(f"   📊 {ledger.get_metrics()['by_model']}")
+
+    time.sleep(0.06)
+    assert ledger.query()["calls"] == 0, "窗口外的记录应被淘汰"
+    assert ledger.get_totals()["remote/gpt-4o-mini"]["calls"] == 2, "累计值不受窗口影响"
+
+    print("\n" + "=" * 60)
+    print("✅ 用量账本测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_usage_ledger()
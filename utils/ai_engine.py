@@ -1,39 +1,296 @@
-import openai
-import streamlit as st  # 用于安全读取密钥
-import sys
+"""
+ai_engine.py - 统一的任务分析器
+不依赖Streamlit，批处理和命令行工具可以直接导入使用（python -m utils.ai_engine 运行自测）。
+远程后端和影子评估只在配置启用时才导入，离线分析不会加载OpenAI SDK。
+"""
+
 import os
-sys.path.append(os.path.dirname(__file__))
 
-from ai_simulator import AISimulator
+from .ai_simulator import AISimulator
+from .resilience import TokenBucket, CircuitBreaker
+from .result_schema import ResultValidator
+from .accounting import UsageLedger, new_usage
+from .speculation import SpeculativeExecutor
+from .presets import QUICK_PRESETS, PresetCache, preset_inputs
 import json
 import time
+import threading
 from typing import Dict, Any
 
+# 预热用的代表性输入（与首页快捷启动一致）
+WARMUP_INPUTS = [tuple(preset_inputs(preset).values()) for preset in QUICK_PRESETS.values()]
+
 class TaskAnalyzer:
     """统一的任务分析器"""
     
-    def __init__(self):
-        """初始化AI分析器"""
+    def __init__(self, remote_backend=None):
+        """
+        初始化AI分析器
+        
+        Args:
+            remote_backend: 远程分析后端，为空时根据环境变量创建（离线模式下没有远程后端）
+        """
         self.ai = AISimulator(name="TaskSpark AI")
+        remote = remote_backend
+        if remote is None and os.getenv("OFFLINE_MODE", "true").lower() != "true":
+            from .remote_backend import create_remote_backend
+            remote = create_remote_backend(self.ai)
+        
+        # 影子模式：远程后端只做异步评估，用户始终拿到模拟器结果
+        self.shadow = None
+        if remote is not None and os.getenv("SHADOW_MODE", "false").lower() == "true":
+            from .shadow import ShadowRunner
+            self.shadow = ShadowRunner(
+                remote,
+                ResultValidator(),
+                sample_rate=float(os.getenv("SHADOW_SAMPLE_RATE", "0.1")),
+                max_workers=int(os.getenv("SHADOW_MAX_WORKERS", "2"))
+            )
+            remote = None
+        self.remote = remote
+        
+        # 远程调用保护：限流 + 熔断，熔断期间直接使用本地模拟器
+        self.rate_limiter = TokenBucket(
+            rate=float(os.getenv("REMOTE_RATE_PER_SECOND", "2")),
+            capacity=int(os.getenv("REMOTE_BURST", "5"))
+        )
+        self.breaker = CircuitBreaker(
+            latency_threshold_ms=float(os.getenv("REMOTE_SLOW_CALL_MS", "8000")),
+            open_seconds=float(os.getenv("REMOTE_BREAKER_OPEN_SECONDS", "30"))
+        )
+        self.fallback_count = 0
+        
+        # 统一结果结构校验（结构定义只在这里编译一次）
+        self.validator = ResultValidator()
+        
+        # 每次后端调用的token、耗时和成本
+        self.usage = UsageLedger(window_seconds=float(os.getenv("USAGE_WINDOW_SECONDS", "3600")))
+        if self.shadow is not None:
+            self.shadow.ledger = self.usage
+        
+        # 快捷启动预设的预计算结果（只在使用本地模拟器时启用，远程结果每次都不同且按调用计费）
+        self.preset_cache = PresetCache() if os.getenv("PRESET_CACHE", "true").lower() == "true" else None
+        self._preset_refreshing = False
+        self._preset_lock = threading.Lock()
+        
+        # 推测执行：首页输入齐全后提前在后台分析（只走本地路径，见 analyze_speculative）
+        self.speculator = SpeculativeExecutor(
+            self.analyze_speculative,
+            max_workers=int(os.getenv("SPECULATION_MAX_WORKERS", "2")),
+            debounce_seconds=float(os.getenv("SPECULATION_DEBOUNCE_SECONDS", "0.3"))
+        )
+        
         print(f"🤖 {self.ai.name} v{self.ai.version} 已就绪")
+        if self.remote is not None:
+            print(f"   远程后端: {self.remote.name}")
+        if self.shadow is not None:
+            print(f"   影子模式: {self.shadow.backend.name} (采样 {self.shadow.sample_rate:.0%})")
     
     def analyze_task(self, current_state: str, target_task: str, mood: str, difficulty: int) -> dict:
-        """分析任务的核心方法"""
+        """分析任务的核心方法，所有后端的结果都经过统一结构校验后返回"""
+        return self._with_inputs(self._analyze_task(current_state, target_task, mood, difficulty), mood, difficulty)
+
+    @staticmethod
+    def _with_inputs(result: Dict[str, Any], mood: str, difficulty: int) -> Dict[str, Any]:
+        """
+        在 task_analysis 中记下这次分析的心情和难度
+
+        执行页按分析结果（而不是会话里当前的输入）统计心情和难度；从历史记录或恢复链接打开的旧结果也对得上。
+        """
+        result["task_analysis"]["mood"] = mood or ""
+        result["task_analysis"]["difficulty"] = int(difficulty or 0)
+        return result
+
+    def _analyze_task(self, current_state: str, target_task: str, mood: str, difficulty: int) -> dict:
+        """按预设结果、远程后端、本地模拟器、默认分析的顺序得到校验后的结果"""
+        request_start = time.perf_counter()
+        defaults = lambda: self._get_default_analysis(current_state, target_task, mood, difficulty)
+        
+        if self.remote is None and self.preset_cache is not None:
+            cached = self._get_preset(current_state, target_task, mood, difficulty)
+            if cached is not None:
+                return self._record_usage(cached, new_usage("preset_cache", self.ai.name), request_start)
+        
+        if self.remote is not None:
+            result = self._analyze_remote(current_state, target_task, mood, difficulty, request_start)
+            if result is not None:
+                result = self.validator.validate(result, defaults)
+                return self._record_usage(result, result["_meta"].get("usage"), request_start)
+            self.fallback_count += 1
+        
+        usage = new_usage("simulator", self.ai.name)
         try:
             print(f"🔍 开始分析任务: {target_task}")
+            compute_start = time.perf_counter()
+            usage["queue_ms"] = round((compute_start - request_start) * 1000, 2)
             result = self.ai.analyze_task(
                 current_state=current_state,
                 target_task=target_task,
                 mood=mood,
                 difficulty=difficulty
             )
+            usage["compute_ms"] = round((time.perf_counter() - compute_start) * 1000, 2)
             print(f"✅ 分析完成，返回 {len(result.get('micro_steps', []))} 个步骤")
-            return result
+            result = self.validator.validate(result, defaults)
+            if self.shadow is not None:
+                self.shadow.submit({
+                    "current_state": current_state,
+                    "target_task": target_task,
+                    "mood": mood,
+                    "difficulty": difficulty
+                }, result)
+            return self._record_usage(result, usage, request_start)
         except Exception as e:
             print(f"❌ AI分析失败: {e}")
             import traceback
             traceback.print_exc()
-            return self._get_default_analysis(current_state, target_task, mood, difficulty)
+            return self._record_usage(self.validator.validate(defaults()), new_usage("default", "default"), request_start)
+    
+    def _analyze_remote(self, current_state: str, target_task: str, mood: str, difficulty: int, request_start: float):
+        """经过熔断器和限流器调用远程后端，被拒绝或失败时返回None"""
+        if not self.breaker.allow_request():
+            return None
+        if not self.rate_limiter.try_acquire():
+            self.breaker.release()
+            return None
+        
+        start_time = time.perf_counter()
+        try:
+            result = self.remote.analyze_task(
+                current_state=current_state,
+                target_task=target_task,
+                mood=mood,
+                difficulty=difficulty
+            )
+        except Exception as e:
+            self.breaker.record_failure()
+            failed = new_usage(self.remote.name, getattr(self.remote, "model", self.remote.name))
+            failed.update(ok=False, **getattr(e, "usage", {}))
+            failed["queue_ms"] = round((start_time - request_start) * 1000, 2)
+            failed["total_ms"] = round((time.perf_counter() - request_start) * 1000, 2)
+            self.usage.record(failed)
+            print(f"❌ 远程分析失败，使用本地模拟器: {e}")
+            return None
+        
+        self.breaker.record_success((time.perf_counter() - start_time) * 1000)
+        meta = result.setdefault("_meta", {})
+        usage = meta.setdefault("usage", new_usage(self.remote.name, getattr(self.remote, "model", self.remote.name)))
+        usage["queue_ms"] = round((start_time - request_start) * 1000, 2)
+        return result
+    
+    def _get_preset(self, current_state: str, target_task: str, mood: str, difficulty: int):
+        """查找预设结果；知识库版本变化后在后台重新构建，构建完成前正常分析"""
+        version = self.ai.knowledge_base_version
+        if self.preset_cache.version is not None and self.preset_cache.is_stale(version):
+            self._refresh_presets_async()
+        return self.preset_cache.get({
+            "current_state": current_state,
+            "target_task": target_task,
+            "mood": mood,
+            "difficulty": difficulty
+        }, version)
+    
+    def _analyze_simulated(self, current_state: str, target_task: str, mood: str, difficulty: int) -> Dict[str, Any]:
+        """只用本地模拟器分析并校验，不记用量、不做影子评估（用于预计算）"""
+        result = self.ai.analyze_task(
+            current_state=current_state,
+            target_task=target_task,
+            mood=mood,
+            difficulty=difficulty
+        )
+        return self.validator.validate(result, lambda: self._get_default_analysis(current_state, target_task, mood, difficulty))
+    
+    @property
+    def speculation_enabled(self) -> bool:
+        """
+        是否做推测分析
+
+        推测只用预设结果和本地模拟器；配置了远程后端时真正的分析走远程，
+        本地的推测结果不能代替它，远程推测被丢弃时又会白白消耗限流配额和费用，所以不推测。
+        """
+        return self.remote is None
+
+    def analyze_speculative(self, current_state: str, target_task: str, mood: str, difficulty: int) -> Dict[str, Any]:
+        """
+        推测分析的入口：只查预设结果或用本地模拟器计算
+
+        不经过限流和熔断、不做影子评估、不记入用量账本；结果被取走时才由 take_speculative 记账。
+        """
+        start_time = time.perf_counter()
+        usage = new_usage("speculative", self.ai.name)
+        result = None
+        if self.preset_cache is not None:
+            result = self._get_preset(current_state, target_task, mood, difficulty)
+            usage["source"] = "preset_cache"
+        if result is None:
+            result = self._analyze_simulated(current_state, target_task, mood, difficulty)
+            usage["source"] = "simulator"
+        usage["compute_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
+        result["_meta"]["usage"] = usage
+        return self._with_inputs(result, mood, difficulty)
+
+    def take_speculative(self, session_id: str, inputs: Dict[str, Any], timeout: float = None):
+        """
+        取走与输入一致的推测结果，没有时返回None（由调用方直接分析）
+
+        只有真正交给用户的推测结果才记入用量账本（后端标记为speculative）并参与影子评估采样。
+        """
+        if not self.speculation_enabled:
+            return None
+        result = self.speculator.take(session_id, inputs, timeout=timeout)
+        if result is None:
+            return None
+        if self.shadow is not None and result["_meta"]["usage"].get("source") == "simulator":
+            self.shadow.submit(dict(inputs), result)
+        usage = result["_meta"]["usage"]
+        usage["total_ms"] = usage["compute_ms"]
+        self.usage.record(usage)
+        return result
+    
+    def refresh_presets(self) -> int:
+        """按当前知识库版本重新计算全部预设结果，返回条目数"""
+        if self.preset_cache is None or self.remote is not None:
+            return 0
+        count = self.preset_cache.build(self._analyze_simulated, self.ai.knowledge_base_version)
+        print(f"📦 快捷启动预设已预计算 {count} 条，用时 {self.preset_cache.last_build_ms}ms")
+        return count
+    
+    def _refresh_presets_async(self):
+        """后台重建预设结果，同一时间只有一个重建任务"""
+        with self._preset_lock:
+            if self._preset_refreshing:
+                return
+            self._preset_refreshing = True
+        
+        def run():
+            try:
+                self.refresh_presets()
+            finally:
+                with self._preset_lock:
+                    self._preset_refreshing = False
+        
+        threading.Thread(target=run, name="preset-refresh", daemon=True).start()
+    
+    def _record_usage(self, result: Dict[str, Any], usage: Dict[str, Any], request_start: float) -> Dict[str, Any]:
+        """补全总耗时，把用量摘要写入结果的_meta并记入账本"""
+        usage["total_ms"] = round((time.perf_counter() - request_start) * 1000, 2)
+        result["_meta"]["usage"] = usage
+        self.usage.record(usage)
+        return result
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """远程调用保护的运行指标"""
+        return {
+            "remote_backend": self.remote.name if self.remote is not None else None,
+            "circuit_breaker": self.breaker.get_metrics(),
+            "rate_limiter": self.rate_limiter.get_metrics(),
+            "fallback_count": self.fallback_count,
+            "validator": self.validator.get_metrics(),
+            "shadow": self.shadow.get_metrics() if self.shadow is not None else None,
+            "usage": self.usage.get_metrics(),
+            "speculation": self.speculator.get_metrics(),
+            "preset_cache": self.preset_cache.get_metrics() if self.preset_cache is not None else None
+        }
     
     def _get_default_analysis(self, current_state, target_task, mood, difficulty):
         """获取默认分析结果"""
@@ -65,6 +322,21 @@ class TaskAnalyzer:
     
     
     
+    def warm_up(self, inputs=None):
+        """
+        用代表性输入预热：触发模拟器各条分析路径、编译好的校验器和提示词前缀缓存，
+        并预先计算快捷启动预设的结果
+        
+        预热调用不经过远程后端，也不计入用量账本和影子评估。
+        """
+        for current_state, target_task, mood, difficulty in (inputs or WARMUP_INPUTS):
+            self._analyze_simulated(current_state, target_task, mood, difficulty)
+        
+        if self.remote is not None:
+            self.remote.prompt_builder.get_system_prefix()
+        
+        self.refresh_presets()
+    
     def get_progress_encouragement(self, progress: int) -> str:
         """根据进度获取鼓励语"""
         if progress <= 25:
@@ -79,15 +351,69 @@ class TaskAnalyzer:
             return "🎉 任务完成！你太棒了！"
 
 
-# 单例实例
+# 单例实例（整个进程共享，所有Streamlit会话共用一个分析器）
 _analyzer_instance = None
+_analyzer_lock = threading.Lock()
+
+# 预热状态：cold → warming → ready / failed
+_readiness = {"status": "cold", "started_at": None, "ready_at": None, "warmup_ms": None, "error": None}
+_readiness_lock = threading.Lock()
 
 def get_analyzer() -> TaskAnalyzer:
-    """获取分析器实例（单例模式）"""
+    """获取分析器实例（单例模式，并发的首次调用也只会创建一个）"""
     global _analyzer_instance
-    if _analyzer_instance is None:
-        _analyzer_instance = TaskAnalyzer()
-    return _analyzer_instance
+    instance = _analyzer_instance
+    if instance is None:
+        with _analyzer_lock:
+            if _analyzer_instance is None:
+                _analyzer_instance = TaskAnalyzer()
+            instance = _analyzer_instance
+    return instance
+
+
+def _run_warm_up():
+    """在后台线程中创建并预热分析器"""
+    start_time = time.perf_counter()
+    try:
+        get_analyzer().warm_up()
+    except Exception as e:
+        with _readiness_lock:
+            _readiness.update(status="failed", error=str(e))
+        print(f"❌ 分析器预热失败: {e}")
+        return
+    
+    warmup_ms = round((time.perf_counter() - start_time) * 1000, 2)
+    with _readiness_lock:
+        _readiness.update(status="ready", ready_at=time.strftime("%Y-%m-%d %H:%M:%S"), warmup_ms=warmup_ms)
+    print(f"✅ 分析器预热完成，用时 {warmup_ms}ms")
+
+
+def warm_up_analyzer(background: bool = True) -> Dict[str, Any]:
+    """
+    启动分析器预热（每个进程只执行一次，重复调用直接返回当前状态）
+    
+    Args:
+        background: 是否在后台线程中预热，不阻塞当前页面的渲染
+    """
+    with _readiness_lock:
+        should_start = _readiness["status"] == "cold"
+        if should_start:
+            _readiness.update(status="warming", started_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+    
+    if should_start:
+        if background:
+            threading.Thread(target=_run_warm_up, name="analyzer-warmup", daemon=True).start()
+        else:
+            _run_warm_up()
+    return get_readiness()
+
+
+def get_readiness() -> Dict[str, Any]:
+    """分析器就绪状态"""
+    with _readiness_lock:
+        readiness = dict(_readiness)
+    readiness["ready"] = readiness["status"] == "ready"
+    return readiness
 
 
 # 测试函数
@@ -120,6 +446,30 @@ def test_ai_engine():
         print(f"   🤖 AI模型: {result['_meta']['ai_model']}")
         print(f"   📡 离线模式: {result['_meta']['offline_mode']}")
     
+    # 推测分析：被丢弃的推测不记账，取走的推测单独标记为speculative
+    inputs = dict(zip(("current_state", "target_task", "mood", "difficulty"), test_cases[0]))
+    speculative_calls = lambda: analyzer.usage.query(backend="speculative")["calls"]
+    before = speculative_calls()
+    analyzer.speculator.speculate("test", dict(inputs, difficulty=3))
+    analyzer.speculator.speculate("test", inputs)
+    time.sleep(analyzer.speculator.debounce_seconds + 0.2)
+    result = analyzer.take_speculative("test", inputs, timeout=5)
+    assert result is not None and result["_meta"]["usage"]["backend"] == "speculative"
+    assert speculative_calls() == before + 1, "只有取走的推测结果记入账本"
+    
+    # 配置了远程后端时不推测，推测不会调用远程后端
+    class CountingBackend:
+        name = "counting"
+        calls = 0
+        def analyze_task(self, **kwargs):
+            CountingBackend.calls += 1
+            raise RuntimeError("offline")
+    remote_analyzer = TaskAnalyzer(remote_backend=CountingBackend())
+    assert not remote_analyzer.speculation_enabled
+    assert remote_analyzer.take_speculative("test", inputs) is None and CountingBackend.calls == 0
+    remote_analyzer.speculator.shutdown(wait=False)
+    print(f"   🔮 推测: {analyzer.speculator.get_metrics()}")
+    
     print("\n" + "=" * 60)
     print("✅ AI引擎测试完成！")
     return True
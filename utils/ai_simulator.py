@@ -7,6 +7,7 @@ ai_simulator.py - 智能模拟AI模块
 import random
 import json
 import time
+import hashlib
 from typing import Dict, List, Any, Tuple
 from datetime import datetime
 import re
@@ -240,7 +241,31 @@ class AISimulator:
         print(f"   人格: {self.personality}")
         print(f"   知识库: {len(self.psychology_knowledge['adhd_challenges'])}条心理学知识")
         print(f"   任务模式: {len(self.task_patterns)}种任务类型")
-    
+
+        # 知识库版本号（惰性计算，知识库变更后调用 reload_knowledge_base 刷新）
+        self._knowledge_base_version = None
+
+    def get_knowledge_base(self) -> Dict[str, Any]:
+        """获取供远程模型使用的静态知识库"""
+        return {
+            "psychology_knowledge": self.psychology_knowledge,
+            "emotion_responses": self.emotion_responses,
+            "microstep_templates": self.microstep_templates
+        }
+
+    @property
+    def knowledge_base_version(self) -> str:
+        """知识库版本号：知识库内容的稳定哈希"""
+        if self._knowledge_base_version is None:
+            canonical = json.dumps(self.get_knowledge_base(), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+            self._knowledge_base_version = f"{self.version}-{hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:12]}"
+        return self._knowledge_base_version
+
+    def reload_knowledge_base(self) -> str:
+        """知识库被修改后重新计算版本号，依赖版本号的缓存会随之失效"""
+        self._knowledge_base_version = None
+        return self.knowledge_base_version
+
     def analyze_task(self, current_state: str, target_task: str, mood: str, difficulty: int) -> Dict[str, Any]:
         """
         智能分析任务
@@ -307,18 +332,19 @@ class AISimulator:
                 "reward_ideas": self._get_reward_ideas(task_type_info["name"]),
                 "accountability_ideas": self._get_accountability_ideas()
             },
-            "meta": {
+            "_meta": {
                 "ai_model": self.name,
                 "ai_version": self.version,
                 "analysis_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "processing_time_ms": round((time.time() - start_time) * 1000, 2),
                 "api_used": False,
+                "offline_mode": True,
                 "confidence_score": self._calculate_confidence_score(current_state, target_task),
                 "note": "这是智能模拟AI的分析结果，基于心理学和任务管理原理"
             }
         }
         
-        print(f"✅ 分析完成！用时: {response['meta']['processing_time_ms']}ms")
+        print(f"✅ 分析完成！用时: {response['_meta']['processing_time_ms']}ms")
         print(f"   任务类型: {task_type_info['name']} {task_type_info['icon']}")
         print(f"   生成步骤: {len(micro_steps)}个微步骤")
         print(f"   核心策略: {strategy['name']}")
@@ -0,0 +1,448 @@
+"""
+event_log.py - 步骤事件日志
+执行页的每个步骤开始、完成、暂停和放弃都追加一条事件，用来统计真实的步骤用时和用户在哪一步放弃。
+事件是定长的NumPy结构化数组记录（28字节），只追加写入分段文件，不修改已写入的内容；
+统计时按段用memmap读取，用bincount等向量化运算汇总，几百万条事件也只需几毫秒。
+"""
+
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from .sqlite_store import DATA_DIR
+from .write_behind import WriteBehind, WRITE_BEHIND_ENABLED
+
+EVENTS_DIR = os.getenv("TASKSPARK_EVENTS_DIR", os.path.join(DATA_DIR, "events"))
+
+# 每个分段文件最多保存的事件数（约28MB），写满后换新的分段
+SEGMENT_EVENTS = int(os.getenv("EVENT_SEGMENT_SIZE", "1000000"))
+
+# 分段最长写入时间（秒）：超过后换新的分段，维护任务只处理早已不再写入的分段
+SEGMENT_MAX_SECONDS = float(os.getenv("EVENT_SEGMENT_MAX_HOURS", "24")) * 3600
+
+# 事件记录格式（格式变化时修改文件名中的版本号）
+EVENT_DTYPE = np.dtype([
+    ("ts", "<f8"),           # 发生时间（Unix时间戳）
+    ("run", "<u8"),          # 一次执行的ID，同一次执行的事件相同
+    ("seconds", "<f4"),      # completed事件：这一步实际用时（秒，不含休息）
+    ("step", "<u2"),         # 步骤序号（从0开始）
+    ("total_steps", "<u2"),  # 这次执行的总步骤数
+    ("event", "u1"),
+    ("task_type", "u1"),
+    ("mood", "u1"),
+    ("difficulty", "u1"),
+])
+SEGMENT_VERSION = "v1"
+
+# 分类字段的编码（0表示未知）
+EVENT_TYPES = ("", "started", "completed", "paused", "abandoned")
+TASK_TYPES = ("", "学习", "工作", "整理", "创作", "健康", "社交", "其他")
+MOODS = ("", "energetic", "neutral", "tired", "anxious", "procrastinating", "overwhelmed")
+
+EVENT_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+TASK_TYPE_CODES = {name: code for code, name in enumerate(TASK_TYPES)}
+MOOD_CODES = {name: code for code, name in enumerate(MOODS)}
+
+
+def encode_task_type(task_type: str) -> int:
+    """任务类型编码，不认识的类型（如远程模型返回的名称）归为"其他" """
+    if not task_type:
+        return 0
+    return TASK_TYPE_CODES.get(task_type, TASK_TYPE_CODES["其他"])
+
+
+def new_run_id() -> int:
+    """一次执行的ID（63位随机数）"""
+    return uuid.uuid4().int >> 65
+
+
+# 汇总数组的大小：步骤序号、实际用时（1秒一格，最后一格包含更长的用时）、难度
+MAX_STEPS = 64
+DURATION_BINS = 7200
+DIFFICULTY_LEVELS = 11
+
+
+def empty_partial() -> Dict[str, np.ndarray]:
+    """空的汇总（各数组可以直接相加合并）"""
+    events = len(EVENT_TYPES)
+    return {
+        "by_step": np.zeros((events, MAX_STEPS), dtype=np.int64),
+        "by_task_type": np.zeros((events, len(TASK_TYPES)), dtype=np.int64),
+        "by_mood": np.zeros((events, len(MOODS)), dtype=np.int64),
+        "by_difficulty": np.zeros((events, DIFFICULTY_LEVELS), dtype=np.int64),
+        "seconds_by_step": np.zeros(MAX_STEPS, dtype=np.float64),
+        "duration_hist": np.zeros(DURATION_BINS, dtype=np.int64)
+    }
+
+
+def _count_by(events: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """按 (事件类型, 分类) 计数：两者合成一个下标，一次bincount完成"""
+    index = events * size + np.minimum(values, size - 1)
+    return np.bincount(index, minlength=len(EVENT_TYPES) * size).reshape(len(EVENT_TYPES), size)
+
+
+def summarize_records(records: np.ndarray) -> Dict[str, np.ndarray]:
+    """汇总一批事件记录（全部是向量化运算）"""
+    if len(records) == 0:
+        return empty_partial()
+    events = np.minimum(records["event"], len(EVENT_TYPES) - 1).astype(np.intp)
+    steps = np.minimum(records["step"], MAX_STEPS - 1)
+    completed = events == EVENT_CODES["completed"]
+    seconds = records["seconds"][completed]
+    return {
+        "by_step": _count_by(events, steps, MAX_STEPS),
+        "by_task_type": _count_by(events, records["task_type"], len(TASK_TYPES)),
+        "by_mood": _count_by(events, records["mood"], len(MOODS)),
+        "by_difficulty": _count_by(events, records["difficulty"], DIFFICULTY_LEVELS),
+        "seconds_by_step": np.bincount(steps[completed], weights=seconds, minlength=MAX_STEPS),
+        "duration_hist": np.bincount(np.clip(seconds, 0, DURATION_BINS - 1).astype(np.intp), minlength=DURATION_BINS)
+    }
+
+
+def summary_from(totals: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """汇总数组转换为可以直接展示的结果"""
+    started, completed = EVENT_CODES["started"], EVENT_CODES["completed"]
+    by_step = totals["by_step"]
+    used = int(np.max(np.nonzero(by_step[started] + by_step[completed])[0], initial=-1)) + 1
+    completed_by_step = by_step[completed][:used]
+
+    durations = totals["duration_hist"]
+    median = None
+    if durations.sum():
+        median = int(np.searchsorted(np.cumsum(durations), (durations.sum() + 1) // 2))
+
+    def breakdown(counts: np.ndarray, names) -> Dict[str, Dict[str, int]]:
+        return {(names[code] if names else code) or "未知": {"started": int(counts[started][code]),
+                                                             "completed": int(counts[completed][code])}
+                for code in range(counts.shape[1]) if counts[started][code] or counts[completed][code]}
+
+    return {
+        "events": {name: int(by_step[code].sum()) for code, name in enumerate(EVENT_TYPES) if name},
+        "started_by_step": by_step[started][:used].tolist(),
+        "completed_by_step": completed_by_step.tolist(),
+        "abandoned_by_step": by_step[EVENT_CODES["abandoned"]][:used].tolist(),
+        "avg_seconds_by_step": [round(float(s / c), 1) if c else None
+                                for s, c in zip(totals["seconds_by_step"][:used], completed_by_step)],
+        "median_step_seconds": median,
+        "by_task_type": breakdown(totals["by_task_type"], TASK_TYPES),
+        "by_mood": breakdown(totals["by_mood"], MOODS),
+        "by_difficulty": breakdown(totals["by_difficulty"], None)
+    }
+
+
+class EventLog:
+    """
+    只追加的事件日志
+
+    每个进程（副本）写自己的分段文件，文件名中带写入者ID，多个副本可以共用同一个目录；
+    每条事件直接追加到当前分段（一次write），读取时只使用完整的记录。
+    """
+
+    def __init__(self, directory: str = EVENTS_DIR, segment_events: int = SEGMENT_EVENTS,
+                 write_behind: bool = WRITE_BEHIND_ENABLED):
+        """
+        Args:
+            directory: 分段文件所在目录
+            segment_events: 每个分段最多保存的事件数
+            write_behind: append() 是否后台批量写入（一批事件一次write）
+        """
+        self.directory = directory
+        self.segment_events = segment_events
+        self.writer_id = uuid.uuid4().hex[:8]
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+        self._sequence = 0
+        self._segment_count = 0
+        self._segment_opened = 0.0
+        # 各分段已汇总的记录数和汇总结果
+        self._aggregate_lock = threading.Lock()
+        self._partials: Dict[str, Any] = {}
+
+        self.appended = 0
+        self.segments_sealed = 0
+        self.records_scanned = 0
+        self.writer = WriteBehind("events", self._write_batch) if write_behind else None
+
+    # ==================== 写入 ====================
+    def _open_segment(self):
+        """打开一个新的分段文件（调用方持有锁）"""
+        if self._file is not None:
+            self._file.close()
+            self.segments_sealed += 1
+        self._sequence += 1
+        name = f"events-{SEGMENT_VERSION}-{int(time.time())}-{self.writer_id}-{self._sequence:04d}.bin"
+        self._file = open(os.path.join(self.directory, name), "ab", buffering=0)
+        self._segment_count = 0
+        self._segment_opened = time.time()
+
+    def append_records(self, records: np.ndarray):
+        """追加一批事件记录（EVENT_DTYPE数组）"""
+        records = np.ascontiguousarray(records, dtype=EVENT_DTYPE)
+        with self._lock:
+            offset = 0
+            while offset < len(records):
+                if (self._file is None or self._segment_count >= self.segment_events
+                        or time.time() - self._segment_opened >= SEGMENT_MAX_SECONDS):
+                    self._open_segment()
+                chunk = records[offset:offset + self.segment_events - self._segment_count]
+                self._file.write(chunk.tobytes())
+                self._segment_count += len(chunk)
+                offset += len(chunk)
+            self.appended += len(records)
+
+    def _write_batch(self, records: List[tuple]):
+        """一批事件合成一个数组，一次写入"""
+        self.append_records(np.array(records, dtype=EVENT_DTYPE))
+
+    def append(self, event: str, step: int, total_steps: int, task_type: str = "", mood: str = "",
+               difficulty: int = 0, run_id: int = 0, seconds: float = 0.0, ts: Optional[float] = None):
+        """追加一条事件（后台批量写入时立即返回）"""
+        record = (
+            ts or time.time(), run_id, seconds, step, total_steps, EVENT_CODES[event],
+            encode_task_type(task_type), MOOD_CODES.get(mood or "", 0), max(0, min(int(difficulty or 0), 255))
+        )
+        if self.writer is not None:
+            self.writer.submit(record)
+        else:
+            self._write_batch([record])
+
+    def flush(self):
+        """等待排队中的事件写入完成"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        """写完排队中的事件并关闭当前分段"""
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # ==================== 读取 ====================
+    def segment_paths(self) -> List[str]:
+        """所有副本写入的分段文件，按文件名（创建时间）排序"""
+        prefix = f"events-{SEGMENT_VERSION}-"
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith(prefix) and name.endswith(".bin"))
+
+    @staticmethod
+    def read_segment(path: str) -> np.ndarray:
+        """只读映射一个分段（正在写入的分段只取完整的记录）"""
+        count = os.path.getsize(path) // EVENT_DTYPE.itemsize
+        if count == 0:
+            return np.empty(0, dtype=EVENT_DTYPE)
+        return np.memmap(path, dtype=EVENT_DTYPE, mode="r", shape=(count,))
+
+    def segments(self):
+        """逐段读取全部事件"""
+        self.flush()
+        for path in self.segment_paths():
+            yield self.read_segment(path)
+
+    def _partial_aggregate(self, path: str) -> Dict[str, np.ndarray]:
+        """
+        一个分段的汇总（调用方持有汇总锁）
+
+        分段只追加不修改：已汇总过的部分直接使用缓存，只汇总新追加的记录再累加上去，
+        已写满的分段汇总一次之后不再读取。
+        """
+        cached = self._partials.get(path)
+        try:
+            count = os.path.getsize(path) // EVENT_DTYPE.itemsize
+            if cached is not None and cached[0] == count:
+                return cached[1]
+            start = cached[0] if cached is not None else 0
+            partial = summarize_records(self.read_segment(path)[start:count])
+        except FileNotFoundError:
+            # 刚被维护任务汇总并删除
+            self._partials.pop(path, None)
+            return empty_partial()
+        if cached is not None:
+            partial = {name: cached[1][name] + values for name, values in partial.items()}
+        self._partials[path] = (count, partial)
+        self.records_scanned += count - start
+        return partial
+
+    def aggregate(self) -> Dict[str, Any]:
+        """
+        汇总保留期内的全部原始事件（更早的事件由维护任务按天汇总到event_daily表）
+
+        Returns:
+            events: 各类事件的数量
+            started_by_step / completed_by_step: 各步骤开始和完成的次数（看出用户在哪一步放弃）
+            abandoned_by_step: 各步骤被放弃的次数
+            avg_seconds_by_step: 各步骤的平均实际用时
+            median_step_seconds: 所有步骤实际用时的中位数（精确到秒）
+            by_task_type / by_mood / by_difficulty: 各分类开始和完成的步骤数
+        """
+        self.flush()
+        totals = empty_partial()
+        with self._aggregate_lock:
+            paths = self.segment_paths()
+            # 已删除的分段（如维护任务清理的旧分段）不再保留缓存
+            self._partials = {path: self._partials[path] for path in paths if path in self._partials}
+            for path in paths:
+                for name, values in self._partial_aggregate(path).items():
+                    totals[name] += values
+        return summary_from(totals)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """写入情况和磁盘占用"""
+        self.flush()
+        paths = self.segment_paths()
+        with self._lock:
+            return {
+                "appended": self.appended,
+                "segments": len(paths),
+                "segments_sealed": self.segments_sealed,
+                "records_scanned": self.records_scanned,
+                "bytes": sum(os.path.getsize(path) for path in paths),
+                "record_bytes": EVENT_DTYPE.itemsize
+            }
+
+
+# 单例实例（整个进程共享）
+_log_instance = None
+_log_lock = threading.Lock()
+
+def get_event_log() -> EventLog:
+    """获取步骤事件日志（单例模式）"""
+    global _log_instance
+    instance = _log_instance
+    if instance is None:
+        with _log_lock:
+            if _log_instance is None:
+                _log_instance = EventLog()
+            instance = _log_instance
+    return instance
+
+
+def synthetic_events(count: int, seed: int = 42, start_ts: float = 1_700_000_000) -> np.ndarray:
+    """生成模拟的事件记录（性能测试用）：每次执行依次开始、完成各步骤，部分中途暂停或放弃"""
+    rng = np.random.default_rng(seed)
+    records = np.zeros(count, dtype=EVENT_DTYPE)
+    records["ts"] = start_ts + np.sort(rng.uniform(0, 90 * 86400, count))
+    records["run"] = rng.integers(1, 2 ** 63, count // 8 + 1, dtype=np.uint64).repeat(8)[:count]
+    records["total_steps"] = 6
+    records["step"] = np.tile(np.repeat(np.arange(4, dtype=np.uint16), 2), count // 8 + 1)[:count]
+    events = np.tile(np.array([EVENT_CODES["started"], EVENT_CODES["completed"]], dtype=np.uint8), count // 2 + 1)[:count]
+    interrupted = rng.random(count) < 0.1
+    events[interrupted] = rng.choice([EVENT_CODES["paused"], EVENT_CODES["abandoned"]], interrupted.sum())
+    records["event"] = events
+    records["seconds"] = np.where(events == EVENT_CODES["completed"], rng.gamma(2.0, 90.0, count), 0)
+    records["task_type"] = rng.integers(1, len(TASK_TYPES), count)
+    records["mood"] = rng.integers(1, len(MOODS), count)
+    records["difficulty"] = rng.integers(1, 11, count)
+    return records
+
+
+# 性能测试
+def benchmark_event_log(total_events: int = 3_000_000, segment_events: int = 1_000_000):
+    """单条追加的耗时，以及几百万条事件的汇总耗时"""
+    import tempfile
+
+    print("⏱️ 步骤事件日志性能测试")
+    print("=" * 60)
+
+    log = EventLog(tempfile.mkdtemp(), segment_events=segment_events)
+    rounds = 2000
+    start_time = time.perf_counter()
+    for i in range(rounds):
+        log.append("completed", i % 6, 6, "学习", "tired", 7, run_id=i // 6, seconds=120.0)
+    append_us = (time.perf_counter() - start_time) * 1_000_000 / rounds
+
+    start_time = time.perf_counter()
+    for offset in range(0, total_events, 500_000):
+        log.append_records(synthetic_events(min(500_000, total_events - offset), seed=offset))
+    bulk_s = time.perf_counter() - start_time
+    log.close()
+
+    # 首次汇总读取全部分段；之后只汇总新追加的记录
+    start_time = time.perf_counter()
+    log.aggregate()
+    cold_ms = (time.perf_counter() - start_time) * 1000
+
+    samples = []
+    for i in range(5):
+        log.append_records(synthetic_events(1000, seed=i))
+        start_time = time.perf_counter()
+        summary = log.aggregate()
+        samples.append((time.perf_counter() - start_time) * 1000)
+    aggregate_ms = sorted(samples)[len(samples) // 2]
+
+    full = empty_partial()
+    start_time = time.perf_counter()
+    for segment in log.segments():
+        for name, values in summarize_records(segment).items():
+            full[name] += values
+    rescan_ms = (time.perf_counter() - start_time) * 1000
+    assert summary_from(full) == summary, "增量汇总应与重新汇总全部事件的结果一致"
+
+    metrics = log.get_metrics()
+    print(f"   ✍️ 单条追加: {append_us:.1f}µs · 批量写入{total_events}条: {bulk_s:.2f}s")
+    print(f"   📦 {metrics['segments']}个分段 · {metrics['bytes'] / 1024 / 1024:.1f}MB（每条{metrics['record_bytes']}字节）")
+    print(f"   📊 汇总{sum(summary['events'].values())}条事件: 首次 {cold_ms:.1f}ms · "
+          f"追加1000条后 {aggregate_ms:.2f}ms · 每次重新汇总全部 {rescan_ms:.1f}ms")
+    print(f"   ⏱️ 各步骤平均用时: {summary['avg_seconds_by_step']} · 中位数 {summary['median_step_seconds']}秒")
+    return {"append_us": append_us, "cold_ms": cold_ms, "aggregate_ms": aggregate_ms, "rescan_ms": rescan_ms}
+
+
+# 测试函数
+def test_event_log():
+    """测试追加、分段切换、读取不完整的记录和增量汇总"""
+    import tempfile
+
+    print("🧪 测试步骤事件日志")
+    print("=" * 60)
+
+    directory = tempfile.mkdtemp()
+    log = EventLog(directory, segment_events=4)
+    run_id = new_run_id()
+    for step in range(3):
+        log.append("started", step, 3, "学习", "tired", 7, run_id)
+        log.append("completed", step, 3, "学习", "tired", 7, run_id, seconds=60.0 * (step + 1))
+    log.append("started", 0, 3, "某种新类型", "unknown-mood", 5, new_run_id())
+    log.append("paused", 0, 3, "", "", 0, run_id)
+    log.append("abandoned", 0, 3, "", "", 0, run_id)
+    log.flush()
+    assert len(log.segment_paths()) == 3, log.segment_paths()
+
+    # 另一个副本同时写入同一个目录，正在写的分段末尾有半条记录
+    other = EventLog(directory)
+    other.append("started", 1, 3, "工作", "anxious", 4, new_run_id())
+    other.flush()
+    with open(other._file.name, "ab") as f:
+        f.write(b"\x00" * 5)
+
+    summary = log.aggregate()
+    assert summary["events"] == {"started": 5, "completed": 3, "paused": 1, "abandoned": 1}, summary
+    assert summary["started_by_step"] == [2, 2, 1] and summary["completed_by_step"] == [1, 1, 1]
+    assert summary["avg_seconds_by_step"] == [60.0, 120.0, 180.0] and summary["median_step_seconds"] == 120.0
+    assert summary["abandoned_by_step"] == [1, 0, 0]
+
+    assert summary["by_task_type"]["学习"] == {"started": 3, "completed": 3}
+    assert summary["by_task_type"]["其他"] == {"started": 1, "completed": 0}, "不认识的类型归为其他"
+    assert summary["by_mood"]["未知"]["started"] == 1 and summary["by_difficulty"][4]["started"] == 1
+
+    # 汇总之后继续追加：只汇总新记录，结果与重新读取全部事件一致
+    scanned = log.get_metrics()["records_scanned"]
+    log.append("completed", 0, 3, "学习", "tired", 7, run_id, seconds=600.0)
+    summary = log.aggregate()
+    assert log.get_metrics()["records_scanned"] == scanned + 1
+    assert summary == EventLog(directory).aggregate() and summary["completed_by_step"] == [2, 1, 1]
+    print(f"   📊 {log.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 步骤事件日志测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_event_log()
+    benchmark_event_log()
@@ -0,0 +1,308 @@
+"""
+history_store.py - 历史记录的持久化存储
+SQLite（WAL模式）保存每个用户的分析历史，刷新页面或重启服务后仍然保留。
+列表按 (user_id, created_at) 索引做游标分页，只读取摘要列；
+每条记录只保存分析结果的内容标识，结果本身在 result_store 中按需读取。
+"""
+
+import os
+import re
+import uuid
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from .result_store import ResultStore
+from .sqlite_store import SQLiteStore, DB_PATH
+from .write_behind import WriteBehind, WRITE_BEHIND_ENABLED
+
+# 列表只读取的摘要列（不含分析结果）
+SUMMARY_COLUMNS = "id, created_at, from_text, to_text, mood, difficulty"
+
+# 游标：上一页最后一条的 (created_at, id)
+Cursor = Tuple[float, int]
+
+
+class HistoryStore(SQLiteStore):
+    """分析历史存储"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        from_text TEXT NOT NULL,
+        to_text TEXT NOT NULL,
+        mood TEXT NOT NULL,
+        difficulty INTEGER NOT NULL,
+        analysis_hash TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_history_user_time ON history (user_id, created_at DESC, id DESC);
+    """
+
+    def __init__(self, path: str = DB_PATH, write_behind: bool = WRITE_BEHIND_ENABLED):
+        """
+        Args:
+            path: 数据库文件路径
+            write_behind: enqueue() 是否后台批量写入（False时同步写入）
+        """
+        super().__init__(path)
+        self.writer = WriteBehind("history", self._write_batch) if write_behind else None
+
+        self.writes = 0
+        self.page_reads = 0
+        self.analysis_reads = 0
+
+    @staticmethod
+    def _summary(row: tuple) -> Dict[str, Any]:
+        """数据库行转换为首页使用的历史记录字段"""
+        entry_id, created_at, from_text, to_text, mood, difficulty = row
+        return {
+            'id': entry_id,
+            'created_at': created_at,
+            'timestamp': time.strftime("%Y-%m-%d %H:%M", time.localtime(created_at)),
+            'from': from_text,
+            'to': to_text,
+            'mood': mood,
+            'difficulty': difficulty
+        }
+
+    def add(self, user_id: str, entry: Dict[str, Any], analysis_hash: str) -> int:
+        """写入一条历史记录（分析结果需先存入result_store），返回记录ID"""
+        cursor = self._connect().execute(
+            "INSERT INTO history (user_id, created_at, from_text, to_text, mood, difficulty, analysis_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", self._row(user_id, entry, analysis_hash)
+        )
+        with self._lock:
+            self.writes += 1
+        return cursor.lastrowid
+
+    @staticmethod
+    def _row(user_id: str, entry: Dict[str, Any], analysis_hash: str) -> tuple:
+        """一条历史记录的列值"""
+        return (user_id, entry.get('created_at', time.time()), entry['from'], entry['to'], entry['mood'] or '',
+                int(entry['difficulty']), analysis_hash)
+
+    def _write_batch(self, rows: List[tuple]):
+        """一批历史记录在一个事务中写入"""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO history (user_id, created_at, from_text, to_text, mood, difficulty, analysis_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self.writes += len(rows)
+
+    def enqueue(self, user_id: str, entry: Dict[str, Any], analysis_hash: str):
+        """写入一条历史记录，不等待写入完成（页面中使用；需要记录ID时用add）"""
+        row = self._row(user_id, entry, analysis_hash)
+        if self.writer is not None:
+            self.writer.submit(row)
+        else:
+            self._write_batch([row])
+
+    def flush(self):
+        """等待排队中的历史记录写入完成"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def page(self, user_id: str, cursor: Optional[Cursor] = None, limit: int = 5) -> Tuple[List[Dict[str, Any]], Optional[Cursor]]:
+        """
+        按时间倒序读取一页摘要
+
+        Args:
+            cursor: 上一页返回的游标，为空时从最新的记录开始
+
+        Returns:
+            (本页记录, 下一页的游标)；没有更多记录时游标为None
+        """
+        # 先写完排队中的记录（通常为空，立即返回），刚保存的记录马上出现在列表中
+        self.flush()
+        if cursor is None:
+            rows = self._connect().execute(
+                f"SELECT {SUMMARY_COLUMNS} FROM history WHERE user_id = ? "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (user_id, limit + 1)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                f"SELECT {SUMMARY_COLUMNS} FROM history WHERE user_id = ? AND (created_at, id) < (?, ?) "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (user_id, cursor[0], cursor[1], limit + 1)
+            ).fetchall()
+        with self._lock:
+            self.page_reads += 1
+
+        # 多读一条用来判断是否还有下一页
+        entries = [self._summary(row) for row in rows[:limit]]
+        next_cursor = (entries[-1]['created_at'], entries[-1]['id']) if len(rows) > limit else None
+        return entries, next_cursor
+
+    def get_analysis_hash(self, user_id: str, entry_id: int) -> Optional[str]:
+        """一条记录对应的分析结果标识（只能读取自己的记录）"""
+        row = self._connect().execute(
+            "SELECT analysis_hash FROM history WHERE id = ? AND user_id = ?", (entry_id, user_id)
+        ).fetchone()
+        with self._lock:
+            self.analysis_reads += 1
+        return row[0] if row else None
+
+    def count(self, user_id: str) -> int:
+        """用户的历史记录总数"""
+        self.flush()
+        return self._connect().execute("SELECT COUNT(*) FROM history WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """读写次数和数据库大小"""
+        self.flush()
+        with self._lock:
+            return {
+                "path": self.path,
+                "writes": self.writes,
+                "page_reads": self.page_reads,
+                "analysis_reads": self.analysis_reads,
+                "db_bytes": self.db_bytes()
+            }
+
+
+# 单例实例（整个进程共享）
+_store_instance = None
+_store_lock = threading.Lock()
+
+def get_history_store() -> HistoryStore:
+    """获取历史记录存储（单例模式）"""
+    global _store_instance
+    instance = _store_instance
+    if instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                _store_instance = HistoryStore()
+            instance = _store_instance
+    return instance
+
+
+# 用户标识所在的Cookie（一年有效）
+USER_COOKIE = "taskspark_uid"
+USER_COOKIE_MAX_AGE = 365 * 86400
+
+
+def current_user_id() -> str:
+    """
+    当前Streamlit会话的用户标识
+
+    保存在浏览器的Cookie中，刷新页面、服务重启或换到其他副本时仍能找回自己的历史、统计和执行进度。
+    标识决定了能看到谁的数据，所以不放进URL：地址栏里的链接（包括可以分享的恢复链接）
+    不会把自己的数据带给别人。拿到Cookie的人仍然能以该用户的身份访问，标识只是一个随机值，不是登录。
+    """
+    import streamlit as st
+    cookie = st.context.cookies.get(USER_COOKIE)
+    # 没有浏览器请求时（AppTest等）取不到Cookie
+    cookie = cookie if isinstance(cookie, str) else ''
+    user_id = st.session_state.get('user_id') or cookie
+    if not re.fullmatch(r"[0-9a-f]{32}", user_id):
+        user_id = uuid.uuid4().hex
+    st.session_state.user_id = user_id
+
+    # 服务端不能直接设置Cookie，由一段脚本写入；每个会话只写一次，下次打开页面时随请求带回
+    if cookie != user_id and st.session_state.get('user_cookie') != user_id:
+        st.html(
+            f"<script>document.cookie = '{USER_COOKIE}={user_id}; Max-Age={USER_COOKIE_MAX_AGE}; Path=/; "
+            f"SameSite=Strict' + (location.protocol === 'https:' ? '; Secure' : '');</script>",
+            unsafe_allow_javascript=True
+        )
+        st.session_state.user_cookie = user_id
+    if 'uid' in st.query_params:
+        del st.query_params['uid']
+    return user_id
+
+
+# 性能测试
+def benchmark_history_store(entries: int = 20000, page_size: int = 5):
+    """历史很长时，第一页、深处分页和单条分析的读取耗时"""
+    import tempfile
+    from .ai_simulator import AISimulator
+
+    print("⏱️ 历史记录存储性能测试")
+    print("=" * 60)
+
+    path = os.path.join(tempfile.mkdtemp(), "history.db")
+    store = HistoryStore(path)
+    results = ResultStore(path)
+    ai = AISimulator()
+    entry = {'from': "躺在床上刷抖音", 'to': "复习期末考试", 'mood': "procrastinating", 'difficulty': 8}
+    analysis_hashes = [results.put(ai.analyze_task(entry['from'], entry['to'], entry['mood'], d)) for d in range(1, 11)]
+
+    conn = store._connect()
+    start_time = time.perf_counter()
+    conn.execute("BEGIN")
+    for i in range(entries):
+        store.add("heavy-user", dict(entry, created_at=1_700_000_000 + i), analysis_hashes[i % len(analysis_hashes)])
+    conn.execute("COMMIT")
+    print(f"   📝 写入 {entries} 条: {(time.perf_counter() - start_time) * 1000:.0f}ms")
+
+    def timed(fn, rounds=200):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = fn()
+        return (time.perf_counter() - start) * 1000 / rounds, result
+
+    first_ms, (page, cursor) = timed(lambda: store.page("heavy-user", limit=page_size))
+    deep_cursor = (1_700_000_000 + entries // 2, entries // 2 + 1)
+    deep_ms, _ = timed(lambda: store.page("heavy-user", deep_cursor, limit=page_size))
+    analysis_ms, _ = timed(lambda: results.get(store.get_analysis_hash("heavy-user", page[0]['id'])))
+    print(f"   📄 第一页: {first_ms:.3f}ms · 中间某页: {deep_ms:.3f}ms · 单条分析: {analysis_ms:.3f}ms")
+    print(f"   📊 {store.get_metrics()}")
+    print(f"   📦 {results.get_metrics()}")
+    return {"first_page_ms": first_ms, "deep_page_ms": deep_ms, "analysis_ms": analysis_ms}
+
+
+# 测试函数
+def test_history_store():
+    """测试写入、游标分页和按需读取分析结果"""
+    import tempfile
+
+    print("🧪 测试历史记录存储")
+    print("=" * 60)
+
+    path = os.path.join(tempfile.mkdtemp(), "history.db")
+    store = HistoryStore(path)
+    for i in range(12):
+        store.add("alice", {'from': f"状态{i}", 'to': f"任务{i}", 'mood': "tired", 'difficulty': 5,
+                            'created_at': 1_700_000_000 + i // 2}, f"hash-{i}")
+    store.add("bob", {'from': "状态", 'to': "任务", 'mood': "", 'difficulty': 3}, "hash-bob")
+
+    # 同一秒内的多条记录由id区分，翻页既不重复也不遗漏
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.page("alice", cursor, limit=5)
+        seen.extend(entry['to'] for entry in page)
+        if cursor is None:
+            break
+    assert seen == [f"任务{i}" for i in reversed(range(12))], seen
+    assert store.count("alice") == 12 and store.count("bob") == 1
+
+    latest = store.page("alice", limit=1)[0][0]
+    assert "analysis" not in latest, "列表不应读取分析结果"
+    assert store.get_analysis_hash("alice", latest['id']) == "hash-11"
+    assert store.get_analysis_hash("bob", latest['id']) is None, "不能读取其他用户的记录"
+
+    # 重新打开数据库（相当于重启服务）记录仍在
+    assert HistoryStore(path).count("alice") == 12
+    journal_mode = store._connect().execute("PRAGMA journal_mode").fetchone()[0]
+    assert journal_mode == "wal", journal_mode
+    print(f"   📊 {store.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 历史记录存储测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_history_store()
+    benchmark_history_store()
@@ -0,0 +1,659 @@
+"""
+maintenance.py - 定期维护任务
+按数据类型的保留期删除过期数据，把过期的原始步骤事件按天汇总后删除分段文件，
+清理无人引用的分析结果，最后分步回收数据库的空闲页。
+每一步都是"先读出要处理的键，再分小批删除"：WAL模式下读取不阻塞写入，
+每批一个短事务、批之间稍作停顿，前台的读写不会被长时间挡住。
+"""
+
+import os
+import json
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from .event_log import (EVENTS_DIR, EVENT_DTYPE, EVENT_TYPES, TASK_TYPES, MOODS, SEGMENT_MAX_SECONDS,
+                        EventLog)
+from .resume_store import decode_snapshot
+from .sqlite_store import SQLiteStore, DB_PATH
+
+# 各类数据的保留期（天），0表示永久保留
+RETENTION_DAYS = {
+    "history": float(os.getenv("RETENTION_HISTORY_DAYS", "365")),
+    "events": float(os.getenv("RETENTION_EVENTS_DAYS", "30")),           # 原始步骤事件，更早的按天汇总
+    "stats_daily": float(os.getenv("RETENTION_STATS_DAILY_DAYS", "730")),
+    "stats_runs": float(os.getenv("RETENTION_STATS_RUNS_DAYS", "90")),    # 执行的去重记录，与会话状态的保留期一致
+    "resume_points": float(os.getenv("RETENTION_RESUME_DAYS", "30")),
+    "session_state": float(os.getenv("RETENTION_SESSION_DAYS", "90")),   # 按用户最后一次写入计算
+    "session_spill": float(os.getenv("RETENTION_SPILL_DAYS", "30"))
+}
+
+# 分析结果至少保留的天数（会话只在内存中、历史还在后台写入队列中时，数据库里看不到对它的引用）
+RESULT_GRACE_DAYS = float(os.getenv("RESULT_GRACE_DAYS", "7"))
+
+# 定期执行的间隔（小时），0表示不自动执行；进程启动后第一次执行前的等待（秒）
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "24"))
+MAINTENANCE_START_DELAY = float(os.getenv("MAINTENANCE_START_DELAY", "300"))
+
+# 每批删除的行数、批之间的停顿（毫秒）、每步回收的空闲页数
+# 批的大小决定前台等锁的时间：两年数据的测试库上，500行一批时前台p99约8ms、整次维护约10秒；
+# 200行一批时p99约3ms、约18秒（每天只执行一次，多花的时间不影响用户）。停顿加长、回收步数减小对p99几乎没有影响
+DELETE_BATCH = int(os.getenv("MAINTENANCE_BATCH", "200"))
+BATCH_PAUSE_MS = float(os.getenv("MAINTENANCE_PAUSE_MS", "5"))
+VACUUM_STEP_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "256"))
+
+# 各类数据过期时要删除的行：(表, 主键列, 查出过期行主键的SQL)；参数是保留期的截止时间
+EXPIRY_QUERIES = {
+    "history": ("history", ("id",), "SELECT id FROM history WHERE created_at < ?"),
+    "resume_points": ("resume_points", ("token",), "SELECT token FROM resume_points WHERE updated_at < ?"),
+    "session_state": ("session_state", ("user_id", "key"),
+                      "SELECT user_id, key FROM session_state WHERE user_id IN "
+                      "(SELECT user_id FROM session_state GROUP BY user_id HAVING MAX(updated_at) < ?)"),
+    "session_spill": ("session_spill", ("id",), "SELECT id FROM session_spill WHERE created_at < ?"),
+    "stats_daily": ("stats_daily", ("user_id", "day"), "SELECT user_id, day FROM stats_daily WHERE day < ?"),
+    "stats_runs": ("stats_runs", ("user_id", "run_id"), "SELECT user_id, run_id FROM stats_runs WHERE started_at < ?")
+}
+
+
+def file_bytes(path: str) -> int:
+    """数据库文件及其WAL文件的大小"""
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def local_days(ts: np.ndarray) -> np.ndarray:
+    """时间戳所在的本地日期（自1970-01-01起的天数；按第一条记录的时区偏移计算）"""
+    offset = time.localtime(float(ts[0])).tm_gmtoff if len(ts) else 0
+    return np.floor((ts + offset) / 86400).astype(np.int64)
+
+
+def rollup_segment(records: np.ndarray) -> List[tuple]:
+    """
+    一个分段的事件按 (日期, 事件, 步骤, 任务类型, 心情, 难度) 汇总
+
+    各字段合成一个整数键，np.unique分组、bincount计数和累加用时。
+    """
+    if len(records) == 0:
+        return []
+    fields = [
+        (local_days(records["ts"]), None),
+        (records["event"].astype(np.int64), 8),
+        (np.minimum(records["step"], 4095).astype(np.int64), 4096),
+        (records["task_type"].astype(np.int64), 16),
+        (records["mood"].astype(np.int64), 16),
+        (records["difficulty"].astype(np.int64), 256)
+    ]
+    key = fields[0][0]
+    for values, size in fields[1:]:
+        key = key * size + np.minimum(values, size - 1)
+    unique, inverse = np.unique(key, return_inverse=True)
+    counts = np.bincount(inverse)
+    seconds = np.bincount(inverse, weights=records["seconds"])
+
+    rows = []
+    for key, count, total in zip(unique.tolist(), counts.tolist(), seconds.tolist()):
+        key, difficulty = divmod(key, 256)
+        key, mood = divmod(key, 16)
+        key, task_type = divmod(key, 16)
+        key, step = divmod(key, 4096)
+        day, event = divmod(key, 8)
+        rows.append((time.strftime("%Y-%m-%d", time.gmtime(day * 86400)), EVENT_TYPES[event], step,
+                     TASK_TYPES[task_type] if task_type < len(TASK_TYPES) else "",
+                     MOODS[mood] if mood < len(MOODS) else "", difficulty, count, round(total, 3)))
+    return rows
+
+
+class Maintenance(SQLiteStore):
+    """
+    维护任务
+
+    run() 依次执行：过期数据删除 → 原始事件按天汇总 → 清理无人引用的分析结果 → 分步回收空闲页，
+    返回每一步处理的数量、耗时和回收的空间。多个副本共用一个数据库时，
+    maintenance_runs 表中的租约保证同一个周期内只有一个副本执行。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS event_daily (
+        day TEXT NOT NULL,
+        event TEXT NOT NULL,
+        step INTEGER NOT NULL,
+        task_type TEXT NOT NULL,
+        mood TEXT NOT NULL,
+        difficulty INTEGER NOT NULL,
+        events INTEGER NOT NULL,
+        seconds REAL NOT NULL,
+        PRIMARY KEY (day, event, step, task_type, mood, difficulty)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS event_segments_rolled (
+        name TEXT PRIMARY KEY,
+        events INTEGER NOT NULL,
+        rows_done INTEGER NOT NULL,
+        finished INTEGER NOT NULL DEFAULT 0,
+        rolled_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS maintenance_runs (
+        job TEXT PRIMARY KEY,
+        started_at REAL NOT NULL,
+        finished_at REAL,
+        report TEXT
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str = DB_PATH, events_dir: str = EVENTS_DIR, retention: Optional[Dict[str, float]] = None,
+                 result_grace_days: float = RESULT_GRACE_DAYS, batch_size: int = DELETE_BATCH,
+                 pause_ms: float = BATCH_PAUSE_MS):
+        """
+        Args:
+            path: 数据库文件路径
+            events_dir: 步骤事件分段文件所在目录
+            retention: 覆盖部分数据类型的保留期（天）
+            result_grace_days: 分析结果至少保留的天数
+            batch_size: 每批删除的行数
+            pause_ms: 批之间的停顿（毫秒），让前台的写入插进来
+        """
+        super().__init__(path)
+        self.events_dir = events_dir
+        self.retention = dict(RETENTION_DAYS, **(retention or {}))
+        self.result_grace_seconds = result_grace_days * 86400
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000
+
+        self.runs = 0
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    # ==================== 公共部分 ====================
+    def _tables(self) -> set:
+        """数据库中已有的表（某些存储可能从未使用过）"""
+        return {row[0] for row in self._connect().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def _delete_keys(self, table: str, key_columns: Tuple[str, ...], keys: List[tuple]) -> int:
+        """按主键分批删除，每批一个短事务"""
+        conn = self._connect()
+        condition = " AND ".join(f"{column} = ?" for column in key_columns)
+        deleted = 0
+        for offset in range(0, len(keys), self.batch_size):
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(f"DELETE FROM {table} WHERE {condition}", keys[offset:offset + self.batch_size])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            deleted += min(self.batch_size, len(keys) - offset)
+            time.sleep(self.pause)
+        return deleted
+
+    def _cutoff(self, data_type: str, now: float) -> Optional[float]:
+        """保留期的截止时间，永久保留时返回None"""
+        days = self.retention.get(data_type, 0)
+        return now - days * 86400 if days > 0 else None
+
+    # ==================== 过期数据 ====================
+    def expire_rows(self, now: Optional[float] = None) -> Dict[str, int]:
+        """按保留期删除各类过期的行，返回每类删除的行数"""
+        now = now or time.time()
+        tables = self._tables()
+        removed = {}
+        for data_type, (table, key_columns, query) in EXPIRY_QUERIES.items():
+            cutoff = self._cutoff(data_type, now)
+            if cutoff is None or table not in tables:
+                continue
+            # 统计汇总的日期列是本地日期文本
+            parameter = time.strftime("%Y-%m-%d", time.localtime(cutoff)) if table == "stats_daily" else cutoff
+            keys = self._connect().execute(query, (parameter,)).fetchall()
+            removed[data_type] = self._delete_keys(table, key_columns, keys)
+
+        # 分享的计划有自己的有效期
+        if "shared_plans" in tables:
+            keys = self._connect().execute("SELECT plan_id FROM shared_plans WHERE expires_at <= ?", (now,)).fetchall()
+            removed["shared_plans"] = self._delete_keys("shared_plans", ("plan_id",), keys)
+        return removed
+
+    # ==================== 步骤事件按天汇总 ====================
+    def roll_up_events(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        把已过保留期、不再写入的分段按天汇总到event_daily，然后删除分段文件
+
+        汇总行分批写入，每批和该分段的进度（已写入的行数）在同一个事务中提交：
+        单个事务很短，中途失败重新执行时从上次的进度继续，不会重复计数。
+        """
+        now = now or time.time()
+        cutoff = self._cutoff("events", now)
+        report = {"segments": 0, "events": 0, "bytes": 0, "rows": 0}
+        if cutoff is None or not os.path.isdir(self.events_dir):
+            return report
+        # 写入中的分段最多写SEGMENT_MAX_SECONDS就会换新的，最后修改时间早于这个时间的分段不会再被追加
+        cutoff = min(cutoff, now - SEGMENT_MAX_SECONDS)
+
+        conn = self._connect()
+        for path in EventLog(self.events_dir, write_behind=False).segment_paths():
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            name = os.path.basename(path)
+            size = os.path.getsize(path)
+            progress = conn.execute("SELECT rows_done, finished FROM event_segments_rolled WHERE name = ?",
+                                    (name,)).fetchone()
+            if progress is None or not progress[1]:
+                records = np.array(EventLog.read_segment(path))
+                rows = rollup_segment(records)
+                done = progress[0] if progress else 0
+                while True:
+                    batch = rows[done:done + self.batch_size]
+                    conn.execute("BEGIN")
+                    try:
+                        conn.executemany(
+                            "INSERT INTO event_daily (day, event, step, task_type, mood, difficulty, events, seconds) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (day, event, step, task_type, mood, difficulty) "
+                            "DO UPDATE SET events = events + excluded.events, seconds = seconds + excluded.seconds", batch
+                        )
+                        done += len(batch)
+                        conn.execute(
+                            "INSERT INTO event_segments_rolled (name, events, rows_done, finished, rolled_at) "
+                            "VALUES (?, ?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET rows_done = excluded.rows_done, "
+                            "finished = excluded.finished, rolled_at = excluded.rolled_at",
+                            (name, len(records), done, done >= len(rows), now)
+                        )
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+                    time.sleep(self.pause)
+                    if done >= len(rows):
+                        break
+                report["events"] += len(records)
+                report["rows"] += len(rows)
+            os.remove(path)
+            report["segments"] += 1
+            report["bytes"] += size
+        return report
+
+    def event_daily(self, since_day: str = "") -> Dict[str, Dict[str, int]]:
+        """已汇总的事件：每天各类事件的数量"""
+        daily: Dict[str, Dict[str, int]] = {}
+        for day, event, count in self._connect().execute(
+                "SELECT day, event, SUM(events) FROM event_daily WHERE day >= ? GROUP BY day, event", (since_day,)):
+            daily.setdefault(day, {})[event] = count
+        return daily
+
+    # ==================== 无人引用的分析结果 ====================
+    def referenced_results(self) -> set:
+        """历史、分享的计划、恢复令牌和会话状态中引用的分析结果"""
+        conn = self._connect()
+        tables = self._tables()
+        referenced = set()
+        if "history" in tables:
+            referenced.update(row[0] for row in conn.execute("SELECT DISTINCT analysis_hash FROM history"))
+        if "shared_plans" in tables:
+            referenced.update(row[0] for row in conn.execute("SELECT DISTINCT analysis_hash FROM shared_plans"))
+        if "resume_points" in tables:
+            for (snapshot,) in conn.execute("SELECT snapshot FROM resume_points"):
+                point = decode_snapshot(snapshot)
+                if point is not None:
+                    referenced.add(point[0])
+        if "session_state" in tables:
+            for (value,) in conn.execute("SELECT value FROM session_state WHERE key = 'analysis_id'"):
+                try:
+                    referenced.add(json.loads(value))
+                except ValueError:
+                    continue
+        return referenced
+
+    def drop_orphaned_results(self, now: Optional[float] = None) -> Dict[str, int]:
+        """删除超过保护期、且没有任何引用的分析结果"""
+        now = now or time.time()
+        if "results" not in self._tables():
+            return {"results": 0, "kept": 0}
+        referenced = self.referenced_results()
+        candidates = self._connect().execute(
+            "SELECT hash FROM results WHERE created_at < ?", (now - self.result_grace_seconds,)
+        ).fetchall()
+        orphans = [(result_hash, now - self.result_grace_seconds) for (result_hash,) in candidates
+                   if result_hash not in referenced]
+        # 删除时再次检查保存时间：这期间被重新保存（又用到了）的结果不删除
+        conn = self._connect()
+        removed = 0
+        for offset in range(0, len(orphans), self.batch_size):
+            conn.execute("BEGIN")
+            try:
+                before = conn.total_changes
+                conn.executemany("DELETE FROM results WHERE hash = ? AND created_at < ?",
+                                 orphans[offset:offset + self.batch_size])
+                removed += conn.total_changes - before
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            time.sleep(self.pause)
+        return {"results": removed, "kept": len(candidates) - removed}
+
+    # ==================== 回收空闲页 ====================
+    def compact(self) -> Dict[str, Any]:
+        """
+        分步回收空闲页（每步VACUUM_STEP_PAGES页，一个短事务），最后做一次不等待读取方的检查点
+
+        只有以增量回收模式创建的数据库可以这样回收；旧数据库只报告空闲页数，
+        需要在停机维护时执行一次完整的VACUUM（会锁住整个数据库）。
+        """
+        conn = self._connect()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        report = {"incremental": incremental, "free_pages": free_pages, "freed_pages": 0, "steps": 0}
+        if incremental:
+            while True:
+                remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if remaining == 0:
+                    break
+                # 这条PRAGMA没有结果列，execute()只执行一步（回收一页），executescript()才会执行完
+                conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});")
+                report["steps"] += 1
+                time.sleep(self.pause)
+            report["freed_pages"] = free_pages
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        report["freed_bytes"] = report["freed_pages"] * page_size
+        return report
+
+    # ==================== 执行 ====================
+    def try_acquire(self, interval_seconds: float, now: Optional[float] = None) -> bool:
+        """取得本周期的执行租约（上一次开始执行已超过interval_seconds时才能取得）"""
+        now = now or time.time()
+        return self._connect().execute(
+            "INSERT INTO maintenance_runs (job, started_at) VALUES ('maintenance', ?) "
+            "ON CONFLICT (job) DO UPDATE SET started_at = excluded.started_at WHERE started_at <= ?",
+            (now, now - interval_seconds)
+        ).rowcount == 1
+
+    def run(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """执行一次完整的维护，返回报告（各步处理的数量、耗时和回收的空间）"""
+        now = now or time.time()
+        start_time = time.perf_counter()
+        db_before = file_bytes(self.path)
+        report: Dict[str, Any] = {}
+
+        for step, action in (("expired", self.expire_rows), ("events", self.roll_up_events),
+                             ("results", self.drop_orphaned_results)):
+            step_start = time.perf_counter()
+            report[step] = action(now)
+            report[step]["ms"] = round((time.perf_counter() - step_start) * 1000, 1)
+        step_start = time.perf_counter()
+        report["compact"] = self.compact()
+        report["compact"]["ms"] = round((time.perf_counter() - step_start) * 1000, 1)
+
+        report["db_bytes_before"] = db_before
+        report["db_bytes_after"] = file_bytes(self.path)
+        report["reclaimed_bytes"] = db_before - report["db_bytes_after"] + report["events"]["bytes"]
+        report["ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+
+        self._connect().execute(
+            "INSERT INTO maintenance_runs (job, started_at, finished_at, report) VALUES ('maintenance', ?, ?, ?) "
+            "ON CONFLICT (job) DO UPDATE SET finished_at = excluded.finished_at, report = excluded.report",
+            (now, time.time(), json.dumps(report))
+        )
+        with self._lock:
+            self.runs += 1
+            self.last_report = report
+        print(f"🧹 维护完成，用时 {report['ms']}ms · 删除过期 {report['expired']} · "
+              f"汇总事件 {report['events']['events']}条 · 清理结果 {report['results']['results']}份 · "
+              f"回收 {report['reclaimed_bytes'] / 1024 / 1024:.1f}MB")
+        return report
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """执行次数和最近一次的报告"""
+        row = self._connect().execute(
+            "SELECT started_at, finished_at FROM maintenance_runs WHERE job = 'maintenance'").fetchone()
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "last_started_at": row[0] if row else None,
+                "last_finished_at": row[1] if row else None,
+                "last_report": self.last_report
+            }
+
+
+# 单例实例（整个进程共享）
+_maintenance_instance = None
+_maintenance_lock = threading.Lock()
+_scheduler_started = False
+
+def get_maintenance() -> Maintenance:
+    """获取维护任务（单例模式）"""
+    global _maintenance_instance
+    instance = _maintenance_instance
+    if instance is None:
+        with _maintenance_lock:
+            if _maintenance_instance is None:
+                _maintenance_instance = Maintenance()
+            instance = _maintenance_instance
+    return instance
+
+
+def _run_scheduler(interval_seconds: float):
+    """后台线程：每隔一段时间尝试取得租约并执行维护"""
+    time.sleep(MAINTENANCE_START_DELAY)
+    while True:
+        try:
+            maintenance = get_maintenance()
+            if maintenance.try_acquire(interval_seconds):
+                maintenance.run()
+        except Exception as e:
+            print(f"❌ 维护任务失败: {e}")
+        # 多个副本错开检查时间，租约保证每个周期只执行一次
+        time.sleep(min(interval_seconds, 3600))
+
+
+def start_maintenance_scheduler() -> bool:
+    """启动定期维护（每个进程只启动一次，MAINTENANCE_INTERVAL_HOURS=0 时不启动）"""
+    global _scheduler_started
+    if MAINTENANCE_INTERVAL_HOURS <= 0:
+        return False
+    with _maintenance_lock:
+        if _scheduler_started:
+            return True
+        _scheduler_started = True
+    threading.Thread(target=_run_scheduler, args=(MAINTENANCE_INTERVAL_HOURS * 3600,),
+                     name="maintenance", daemon=True).start()
+    return True
+
+
+def populate(path: str, events_dir: str, now: float, users: int = 2000, history_per_user: int = 50,
+             results: int = 10000, old_events: int = 2_000_000) -> Dict[str, int]:
+    """生成一个已经运行了两年的数据库（性能测试用）：大部分历史、令牌、会话和事件已过保留期"""
+    import random
+    from .event_log import synthetic_events
+    from .history_store import HistoryStore
+    from .plan_store import PlanStore
+    from .result_store import ResultStore
+    from .resume_store import ResumeStore, encode_snapshot
+    from .session_backend import SQLiteSessionBackend
+    from .session_budget import SpillStore
+    from .stats_store import StatsStore
+
+    rng = random.Random(3)
+    for store in (HistoryStore, PlanStore, ResultStore, ResumeStore, SQLiteSessionBackend, SpillStore):
+        store(path) if store is not HistoryStore else store(path, write_behind=False)
+    StatsStore(path, write_behind=False)
+    conn = HistoryStore(path, write_behind=False)._connect()
+    two_years = 730 * 86400
+
+    hashes = [f"{rng.getrandbits(160):040x}" for _ in range(results)]
+    body = json.dumps({"micro_steps": [{"action": "打开书本，翻到第一页" * 4}] * 8}, ensure_ascii=False)
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO results (hash, body, created_at) VALUES (?, ?, ?)",
+                     [(h, body, now - rng.uniform(0, two_years)) for h in hashes])
+    conn.executemany(
+        "INSERT INTO history (user_id, created_at, from_text, to_text, mood, difficulty, analysis_hash) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(f"{u:032x}", now - rng.uniform(0, two_years), "刷手机", "复习", "tired", 7, rng.choice(hashes[:results // 4]))
+         for u in range(users) for _ in range(history_per_user)])
+    conn.executemany("INSERT INTO resume_points (token, snapshot, updated_at) VALUES (?, ?, ?)",
+                     [(f"t{i}", encode_snapshot(rng.choice(hashes), 2), now - rng.uniform(0, two_years))
+                      for i in range(users * 5)])
+    conn.executemany("INSERT INTO session_state (user_id, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                     [(f"{u:032x}", key, json.dumps(rng.choice(hashes)) if key == "analysis_id" else "0",
+                       now - rng.uniform(0, two_years)) for u in range(users) for key in ("analysis_id", "current_step")])
+    conn.executemany("INSERT INTO session_spill (user_id, key, created_at, payload) VALUES (?, ?, ?, ?)",
+                     [(f"{u:032x}", "completed_tasks", now - rng.uniform(0, two_years), "[" + "{}," * 50 + "{}]")
+                      for u in range(users) for _ in range(5)])
+    conn.executemany("INSERT INTO stats_daily (user_id, day, tasks_started) VALUES (?, ?, 1) ON CONFLICT DO NOTHING",
+                     [(f"{u:032x}", time.strftime("%Y-%m-%d", time.localtime(now - d * 86400)))
+                      for u in range(users // 4) for d in range(0, 730, 3)])
+    conn.executemany("INSERT INTO stats_runs (user_id, run_id, started_at, steps_done) VALUES (?, ?, ?, 1)",
+                     [(f"{u:032x}", i, now - rng.uniform(0, two_years)) for u in range(users) for i in range(1, 6)])
+    conn.execute("COMMIT")
+
+    log = EventLog(events_dir, segment_events=250_000, write_behind=False)
+    log.append_records(synthetic_events(old_events, start_ts=now - 400 * 86400))
+    log.close()
+    for path_ in log.segment_paths():
+        os.utime(path_, (now - 300 * 86400, now - 300 * 86400))
+    return {"results": results, "history": users * history_per_user, "events": old_events}
+
+
+# 性能测试
+def benchmark_maintenance(duration: float = 2.0, p99_threshold_ms: float = None):
+    """
+    维护任务回收的空间，以及执行期间前台读写的耗时（与不执行时对比）
+
+    执行期间前台读写的p99超过阈值（MAINTENANCE_P99_MS，默认10ms）时失败：维护不能明显阻塞在线的读写。
+    """
+    import tempfile
+    from .history_store import HistoryStore
+    from .result_store import ResultStore
+    from .stats_store import StatsStore
+
+    print("⏱️ 维护任务性能测试")
+    print("=" * 60)
+
+    p99_threshold_ms = p99_threshold_ms or float(os.getenv("MAINTENANCE_P99_MS", "10"))
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "maintenance.db")
+    events_dir = os.path.join(directory, "events")
+    now = time.time()
+    sizes = populate(path, events_dir, now)
+    events_bytes = sum(os.path.getsize(p) for p in EventLog(events_dir, write_behind=False).segment_paths())
+    print(f"   📦 数据库 {file_bytes(path) / 1024 / 1024:.1f}MB · 事件分段 {events_bytes / 1024 / 1024:.1f}MB · {sizes}")
+
+    history = HistoryStore(path, write_behind=False)
+    stats = StatsStore(path, write_behind=False)
+    results = ResultStore(path, max_cached=0)
+    recent_hash = results.put({"micro_steps": [{"action": "写下第一句话"}]})
+    run = {'task_type': "学习", 'mood': "tired", 'difficulty': 7, 'total_steps': 6}
+
+    def foreground(stop: threading.Event, samples: List[float]):
+        """前台会话：翻历史、累加统计、保存历史、读取分析结果"""
+        i = 0
+        while not stop.is_set():
+            user_id = f"{i % 2000:032x}"
+            start_time = time.perf_counter()
+            history.page(user_id)
+            stats.record_step_completed(user_id, run, i % 6)
+            history.add(user_id, {'from': "刷手机", 'to': "复习", 'mood': "tired", 'difficulty': 7}, recent_hash)
+            results.get(recent_hash)
+            samples.append((time.perf_counter() - start_time) * 1000)
+            i += 1
+            time.sleep(0.002)
+
+    def measure(during_maintenance: bool) -> Dict[str, Any]:
+        stop, samples = threading.Event(), []
+        worker = threading.Thread(target=foreground, args=(stop, samples))
+        worker.start()
+        report = None
+        if during_maintenance:
+            report = Maintenance(path, events_dir).run(now)
+        else:
+            time.sleep(duration)
+        stop.set()
+        worker.join()
+        samples.sort()
+        return {"ops": len(samples), "p50_ms": round(samples[len(samples) // 2], 2),
+                "p99_ms": round(samples[int(len(samples) * 0.99)], 2), "max_ms": round(samples[-1], 2), "report": report}
+
+    baseline = measure(False)
+    during = measure(True)
+    report = during.pop("report")
+    baseline.pop("report")
+
+    print(f"   🧹 用时 {report['ms']}ms · 过期删除 {report['expired']}")
+    print(f"   📊 事件 {report['events']} · 结果 {report['results']} · 回收空闲页 {report['compact']}")
+    print(f"   💾 数据库 {report['db_bytes_before'] / 1024 / 1024:.1f}MB → {report['db_bytes_after'] / 1024 / 1024:.1f}MB"
+          f" · 共回收 {report['reclaimed_bytes'] / 1024 / 1024:.1f}MB（含事件分段）")
+    print(f"   ⏱️ 前台读写 不执行维护: {baseline}")
+    print(f"   ⏱️ 前台读写 执行维护期间: {during}")
+    assert during["p99_ms"] < p99_threshold_ms, \
+        f"维护期间前台读写p99 {during['p99_ms']}ms 超过 {p99_threshold_ms}ms（每批{DELETE_BATCH}行）"
+    print(f"   ✅ 维护期间前台读写p99低于 {p99_threshold_ms}ms")
+    return {"report": report, "baseline": baseline, "during": during}
+
+
+# 测试函数
+def test_maintenance():
+    """测试保留期、事件汇总、结果清理、空闲页回收和租约"""
+    import tempfile
+    from .event_log import synthetic_events
+    from .history_store import HistoryStore
+    from .plan_store import PlanStore
+    from .result_store import ResultStore
+    from .resume_store import ResumeStore
+    from .session_backend import SQLiteSessionBackend
+
+    print("🧪 测试维护任务")
+    print("=" * 60)
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "maintenance.db")
+    events_dir = os.path.join(directory, "events")
+    now = time.time()
+    day = 86400
+
+    results = ResultStore(path)
+    hashes = {name: results.put({"name": name}) for name in ("history", "plan", "resume", "session", "orphan", "young")}
+    conn = results._connect()
+    conn.execute("UPDATE results SET created_at = ? WHERE hash != ?", (now - 30 * day, hashes["young"]))
+
+    history = HistoryStore(path, write_behind=False)
+    history.add("alice", {'from': "a", 'to': "b", 'mood': "", 'difficulty': 3, 'created_at': now - 400 * day}, hashes["orphan"])
+    history.add("alice", {'from': "a", 'to': "b", 'mood': "", 'difficulty': 3}, hashes["history"])
+    PlanStore(path, results=results).share(hashes["plan"])
+    ResumeStore(path).create(hashes["resume"], 2)
+    SQLiteSessionBackend(path).save("bob", {"analysis_id": json.dumps(hashes["session"])}, [])
+    SQLiteSessionBackend(path).save("carol", {"current_step": "1"}, [])
+    conn.execute("UPDATE session_state SET updated_at = ? WHERE user_id = 'carol'", (now - 200 * day,))
+
+    log = EventLog(events_dir, segment_events=1000, write_behind=False)
+    old = synthetic_events(2500, start_ts=now - 90 * day)
+    log.append_records(old)
+    log.close()
+    for segment in log.segment_paths():
+        os.utime(segment, (now - 60 * day, now - 60 * day))
+    recent = EventLog(events_dir, write_behind=False)
+    recent.append("started", 0, 3, "学习", "tired", 7)
+
+    maintenance = Maintenance(path, events_dir, pause_ms=0)
+    assert maintenance.try_acquire(3600, now) and not maintenance.try_acquire(3600, now), "同一周期只能执行一次"
+    report = maintenance.run(now)
+
+    assert report["expired"]["history"] == 1 and history.count("alice") == 1
+    assert report["expired"]["session_state"] == 1, "只删除很久没有写入的用户的会话状态"
+    assert report["events"]["segments"] == 3 and report["events"]["events"] == 2500
+    assert sum(sum(counts.values()) for counts in maintenance.event_daily().values()) == 2500, "汇总不丢事件"
+    assert recent.aggregate()["events"]["started"] == 1, "保留期内的事件不汇总"
+    assert report["results"]["results"] == 1, report["results"]
+    assert ResultStore(path).get(hashes["orphan"]) is None
+    assert all(ResultStore(path).get(hashes[name]) is not None for name in ("history", "plan", "resume", "session", "young"))
+    assert report["compact"]["incremental"] and report["compact"]["freed_pages"] == report["compact"]["free_pages"]
+    assert maintenance._connect().execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+    # 再执行一次：没有需要处理的数据
+    again = maintenance.run(now)
+    assert again["expired"]["history"] == 0 and again["events"]["segments"] == 0 and again["results"]["results"] == 0
+    print(f"   📊 {maintenance.get_metrics()['runs']}次 · 最近一次 {again['ms']}ms")
+
+    print("\n" + "=" * 60)
+    print("✅ 维护任务测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_maintenance()
+    benchmark_maintenance()
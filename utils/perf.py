@@ -0,0 +1,1054 @@
+"""
+perf.py - 页面性能测试
+用Streamlit的AppTest在进程内运行页面，测量一次交互（点击到下一次渲染完成）的服务端耗时
+"""
+
+import os
+import re
+import sys
+import json
+import pickle
+import time
+import socket
+import tempfile
+import asyncio
+import subprocess
+import urllib.request
+from contextlib import contextmanager
+from typing import Dict, Any, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES_DIR = os.path.join(ROOT_DIR, "pages")
+
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+# 测试中的会话状态只保存在进程内，不写入正式的数据库
+os.environ.setdefault("SESSION_BACKEND", "memory")
+# 测试中点击产生的步骤事件写到临时目录，不计入正式的统计
+os.environ.setdefault("TASKSPARK_EVENTS_DIR", tempfile.mkdtemp(prefix="taskspark-events-"))
+# 测试中不启动定期维护，避免与被测的读写争用数据库
+os.environ.setdefault("MAINTENANCE_INTERVAL_HOURS", "0")
+
+# 页面和样式中出现的外部地址（绝对地址或协议相对地址）
+EXTERNAL_URL_PATTERN = re.compile(r"https?://[^\s'\")]+|url\(\s*['\"]?//[^\s'\")]+")
+
+
+def percentile(values: List[float], p: float) -> float:
+    """取分位数（最近秩）"""
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    """耗时样本汇总（毫秒）"""
+    return {
+        "runs": len(samples),
+        "p50_ms": round(percentile(samples, 0.5), 2),
+        "p95_ms": round(percentile(samples, 0.95), 2),
+        "max_ms": round(max(samples), 2)
+    }
+
+
+def timed_run(at) -> float:
+    """运行一次页面并返回耗时（毫秒）"""
+    start_time = time.perf_counter()
+    at.run()
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    if at.exception:
+        raise RuntimeError(f"页面运行出错: {at.exception[0].value}")
+    return elapsed_ms
+
+
+def payload_bytes(at) -> int:
+    """估算一次渲染发给浏览器的元素数据量：页面上所有元素protobuf的序列化字节数之和"""
+    return sum(proto.ByteSize() for proto in iter_protos(at) if hasattr(proto, "ByteSize"))
+
+
+def iter_protos(at):
+    """遍历页面上所有元素的protobuf"""
+    nodes = [at._tree]
+    while nodes:
+        node = nodes.pop()
+        proto = getattr(node, "proto", None)
+        if proto is not None:
+            yield proto
+        children = getattr(node, "children", None) or {}
+        nodes.extend(children.values() if isinstance(children, dict) else children)
+
+
+@contextmanager
+def network_disabled():
+    """断开外网：进程内除本机回环地址外的连接一律失败"""
+    original_connect = socket.socket.connect
+
+    def guarded_connect(sock, address):
+        host = address[0] if isinstance(address, tuple) else address
+        if host not in ("127.0.0.1", "::1", "localhost") and sock.family != socket.AF_UNIX:
+            raise OSError(f"网络已断开，拒绝连接 {host}")
+        return original_connect(sock, address)
+
+    socket.socket.connect = guarded_connect
+    try:
+        yield
+    finally:
+        socket.socket.connect = original_connect
+
+
+class LiveApp:
+    """
+    真实的Streamlit服务端会话
+
+    AppTest每次交互都重新执行整个脚本，无法体现局部重新运行（fragment）的效果，
+    这里启动一个真正的 streamlit run 进程，用浏览器同样的websocket协议发送交互，
+    统计往返耗时、脚本执行耗时（服务端page_profile中的exec_time）和收到的字节数。
+    """
+
+    def __init__(self, script: str = "app.py", port: int = 8765):
+        self.script = script
+        self.port = port
+        self.process = None
+        self.ws = None
+        self.loop = asyncio.new_event_loop()
+        self.pages: Dict[str, str] = {}
+        self.page_hash = ""
+        # 标签 → 最近一次渲染出的控件信息（id、类型、所属fragment）
+        self.widgets: Dict[str, Dict[str, Any]] = {}
+        # 控件id → 当前值（WidgetState），每次交互都把全部当前值发给服务端
+        self.states: Dict[str, Any] = {}
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", self.script, "--server.headless", "true",
+             "--server.port", str(self.port),
+             # 打开后服务端才会在每次运行结束时发送page_profile（含脚本执行耗时）；无头模式下没有浏览器，不会上报任何数据
+             "--browser.gatherUsageStats", "true"],
+            cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.time() + 30
+        while True:
+            try:
+                urllib.request.urlopen(f"http://localhost:{self.port}/_stcore/health", timeout=1)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    self.__exit__()
+                    raise RuntimeError("streamlit服务启动超时")
+                time.sleep(0.2)
+
+        self.new_session()
+        return self
+
+    def new_session(self):
+        """重新建立websocket连接，相当于一个新用户打开应用"""
+        import websockets
+
+        if self.ws is not None:
+            self.loop.run_until_complete(self.ws.close())
+        self.ws = self.loop.run_until_complete(websockets.connect(
+            f"ws://localhost:{self.port}/_stcore/stream", subprotocols=["streamlit"], max_size=None))
+        self.page_hash = ""
+        self.widgets = {}
+        self.states = {}
+        self.rerun()
+
+    def __exit__(self, *exc):
+        if self.ws is not None:
+            self.loop.run_until_complete(self.ws.close())
+        self.loop.close()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+
+    def open_page(self, url_pathname: str) -> Dict[str, Any]:
+        """切换到指定页面（与点击侧边栏导航相同）"""
+        self.page_hash = self.pages[url_pathname]
+        self.widgets = {}
+        self.states = {}
+        return self.rerun()
+
+    def rerun(self, trigger: Dict[str, Any] = None, fragment_id: str = "") -> Dict[str, Any]:
+        """发送一次重新运行请求，等待脚本结束"""
+        return self.loop.run_until_complete(self._rerun(trigger, fragment_id))
+
+    async def _rerun(self, trigger, fragment_id):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        client_state = msg.rerun_script
+        client_state.page_script_hash = self.page_hash
+        client_state.fragment_id = fragment_id
+        live_ids = {w["id"] for w in self.widgets.values()}
+        for widget_id, state in self.states.items():
+            if widget_id in live_ids:
+                client_state.widget_states.widgets.add().CopyFrom(state)
+        if trigger is not None:
+            client_state.widget_states.widgets.add().CopyFrom(trigger)
+
+        start_time = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        received = 0
+        exec_us = 0
+        runs = 0
+        while True:
+            raw = await self.ws.recv()
+            forward = ForwardMsg()
+            forward.ParseFromString(raw)
+            kind = forward.WhichOneof("type")
+            if kind == "page_profile":
+                exec_us += forward.page_profile.exec_time
+                continue
+            received += len(raw)
+            if kind in ("new_session", "navigation"):
+                for page in getattr(forward, kind).app_pages:
+                    self.pages[page.url_pathname] = page.page_script_hash
+            elif kind == "delta":
+                self._track_widget(forward.delta)
+            elif kind == "script_finished":
+                runs += 1
+                # st.rerun()会先结束本次运行再开始下一次，要等到最终那次运行结束
+                if forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    break
+        return {"ms": (time.perf_counter() - start_time) * 1000, "exec_ms": exec_us / 1000, "bytes": received, "runs": runs}
+
+    def _track_widget(self, delta):
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        widget = getattr(element, kind)
+        if getattr(widget, "id", None) and getattr(widget, "label", None) is not None:
+            self.widgets[widget.label] = {"id": widget.id, "type": kind, "fragment_id": delta.fragment_id,
+                                          "form_id": getattr(widget, "form_id", "")}
+
+    def _widget_state(self, label: str):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        state = WidgetState()
+        state.id = self.widgets[label]["id"]
+        return state
+
+    def click(self, label: str) -> Dict[str, Any]:
+        """点击按钮；按钮在fragment内时只重新运行该fragment，和浏览器行为一致"""
+        state = self._widget_state(label)
+        state.trigger_value = True
+        return self.rerun(state, self.widgets[label]["fragment_id"])
+
+    def set_value(self, label: str, **value) -> Dict[str, Any]:
+        """
+        修改控件的值，例如 set_value("难度评分 (1-10)", double_array_value=[7])
+
+        表单内的控件和浏览器中一样只在本地记下新值，等提交按钮点击时一起发送，不触发重新运行
+        """
+        state = self._widget_state(label)
+        for field, field_value in value.items():
+            if isinstance(field_value, list):
+                getattr(state, field).data.extend(field_value)
+            else:
+                setattr(state, field, field_value)
+        self.states[state.id] = state
+        if self.widgets[label]["form_id"]:
+            return {"ms": 0, "exec_ms": 0, "bytes": 0, "runs": 0}
+        return self.rerun(None, self.widgets[label]["fragment_id"])
+
+
+def find_button(at, label: str):
+    """按标签查找按钮"""
+    for button in at.button:
+        if button.label == label:
+            return button
+    raise LookupError(f"找不到按钮: {label}")
+
+
+def sample_analysis(difficulty: int = 8) -> Dict[str, Any]:
+    """生成一份用于测试的分析结果"""
+    from utils.ai_engine import get_analyzer
+    return get_analyzer().analyze_task("躺在床上刷抖音", "复习期末考试", "procrastinating", difficulty)
+
+
+def store_analysis(analysis: Dict[str, Any]) -> str:
+    """把分析结果存入共享的结果存储，返回会话中保存的内容标识"""
+    from utils.result_store import get_result_store
+    return get_result_store().put(analysis)
+
+
+def open_page(name: str, session: Dict[str, Any] = None):
+    """用AppTest打开页面，可以预先写入session state"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(PAGES_DIR, name), default_timeout=30)
+    for key, value in (session or {}).items():
+        at.session_state[key] = value
+    return at
+
+
+# 性能测试
+def benchmark_step_clicks(rounds: int = 30, threshold_ms: float = 100) -> Dict[str, Any]:
+    """测量执行页“完成这一步”“暂停休息”点击后的渲染耗时"""
+    print("⏱️ 执行页点击延迟测试")
+    print("=" * 60)
+
+    analysis = sample_analysis()
+    at = open_page("micro_steps.py", {"analysis_id": store_analysis(analysis), "current_step": 0})
+    timed_run(at)
+
+    results = {}
+    for label in ("✅ 完成这一步", "⏸️ 暂停休息"):
+        samples = []
+        for _ in range(rounds):
+            if at.session_state["current_step"] >= len(analysis["micro_steps"]):
+                at.session_state["current_step"] = 0
+                timed_run(at)
+            find_button(at, label).click()
+            samples.append(timed_run(at))
+        results[label] = summarize(samples)
+        print(f"   {label}: {results[label]}")
+
+    worst_p95 = max(r["p95_ms"] for r in results.values())
+    assert worst_p95 < threshold_ms, f"点击到渲染的p95耗时 {worst_p95}ms 超过 {threshold_ms}ms"
+    print(f"   ✅ p95均低于 {threshold_ms}ms")
+    return results
+
+
+def all_pages() -> Dict[str, Any]:
+    """所有页面及其打开时需要的session state"""
+    analysis = sample_analysis()
+    return {
+        "app.py": (os.path.join(ROOT_DIR, "app.py"), {}),
+        "task_spark_home.py": (os.path.join(PAGES_DIR, "task_spark_home.py"), {}),
+        "task_analysis.py": (os.path.join(PAGES_DIR, "task_analysis.py"), {"analysis_id": store_analysis(analysis)}),
+        "micro_steps.py": (os.path.join(PAGES_DIR, "micro_steps.py"), {"analysis_id": store_analysis(analysis), "current_step": 2})
+    }
+
+
+def load_page(path: str, session: Dict[str, Any]):
+    """用AppTest加载任意路径的页面"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(path, default_timeout=30)
+    for key, value in session.items():
+        at.session_state[key] = value
+    return at
+
+
+def benchmark_rerun_payload() -> Dict[str, int]:
+    """测量每个页面一次重新运行发送的字节数"""
+    print("📦 页面重新运行数据量测试")
+    print("=" * 60)
+
+    results = {}
+    for name, (path, session) in all_pages().items():
+        at = load_page(path, session)
+        timed_run(at)
+        timed_run(at)  # 第二次运行才是“重新运行”
+        results[name] = payload_bytes(at)
+        print(f"   {name}: {results[name]} 字节/次")
+    return results
+
+
+def choose_mood(app: LiveApp, name: str, emoji: str) -> Dict[str, Any]:
+    """在首页选择情绪：旧版是一组按钮，表单版是分段选择控件"""
+    if name in app.widgets:
+        return app.click(name)
+    return app.set_value("选择当前情绪", string_array_value=[f"{emoji} {name}"])
+
+
+def benchmark_home_interactions(rounds: int = 10, port: int = 8765) -> Dict[str, Any]:
+    """
+    在真实服务端上测量首页交互的往返
+
+    情绪、难度和输入框都在表单里，修改它们不发请求（检查确实没有重新运行）；
+    首页剩下的往返只有提交表单，测量它的耗时和数据量。
+    """
+    print("🎭 首页交互测试（真实服务端）")
+    print("=" * 60)
+
+    edits, submits = [], []
+    with LiveApp(port=port) as app:
+        for i in range(rounds):
+            app.new_session()
+            app.open_page("task_spark_home")
+            edits += [
+                app.set_value("描述你当前的活动状态", string_value=f"躺在床上刷抖音{i}"),
+                app.set_value("描述你想要开始的任务", string_value="复习期末考试"),
+                choose_mood(app, *[("焦虑不安", "😰"), ("有些疲惫", "😴")][i % 2]),
+                app.set_value("难度评分 (1-10)", double_array_value=[3 + (i % 2) * 5])
+            ]
+            submits.append(app.click("🚀 开始AI智能分析"))
+            assert "✅ 开始执行第一步" in app.widgets, "提交后应跳转到分析页"
+
+    assert all(r["runs"] == 0 for r in edits), "表单内的修改不应触发重新运行"
+    results = {
+        "edit_runs": sum(r["runs"] for r in edits),
+        "submit": {
+            "round_trip": summarize([r["ms"] for r in submits]),
+            "exec": summarize([r["exec_ms"] for r in submits]),
+            "avg_bytes": round(sum(r["bytes"] for r in submits) / len(submits))
+        }
+    }
+    print(f"   修改{len(edits)}次输入: 重新运行 {results['edit_runs']} 次")
+    print(f"   提交表单: {results['submit']}")
+    return results
+
+
+def benchmark_reruns_per_analysis(rounds: int = 5, port: int = 8766) -> Dict[str, Any]:
+    """在真实服务端上完成“填写输入 → 选择情绪和难度 → 开始分析”的完整流程，统计每次分析触发的脚本运行次数"""
+    print("🔁 每次分析的重新运行次数（真实服务端）")
+    print("=" * 60)
+
+    steps = []
+    with LiveApp(port=port) as app:
+        for i in range(rounds):
+            app.new_session()
+            app.open_page("task_spark_home")
+            interactions = [
+                app.set_value("描述你当前的活动状态", string_value=f"躺在床上刷抖音{i}"),
+                app.set_value("描述你想要开始的任务", string_value="复习期末考试")
+            ]
+            interactions.append(choose_mood(app, "有些疲惫", "😴"))
+            interactions.append(app.set_value("难度评分 (1-10)", double_array_value=[8]))
+            interactions.append(app.click("🚀 开始AI智能分析"))
+            assert "✅ 开始执行第一步" in app.widgets, "提交后应跳转到分析页"
+            steps.append(interactions)
+
+    results = {
+        "reruns_per_analysis": round(sum(sum(r["runs"] for r in interactions) for interactions in steps) / len(steps), 2),
+        "requests_per_analysis": round(sum(sum(1 for r in interactions if r["runs"]) for interactions in steps) / len(steps), 2),
+        "bytes_per_analysis": round(sum(sum(r["bytes"] for r in interactions) for interactions in steps) / len(steps)),
+        "exec_ms_per_analysis": round(sum(sum(r["exec_ms"] for r in interactions) for interactions in steps) / len(steps), 2)
+    }
+    print(f"   {results}")
+    return results
+
+
+def benchmark_speculation(rounds: int = 5, think_seconds: float = 0.5) -> Dict[str, Any]:
+    """
+    首页推测分析的命中率和浪费的计算量
+
+    每轮三种用户行为：快捷启动后稍等再提交（应命中）、快捷启动后修改任务再提交（推测作废）、
+    快捷启动后立刻提交（推测还在防抖，未命中）
+    """
+    from streamlit.testing.v1 import AppTest
+    from utils.ai_engine import get_analyzer
+
+    print("🔮 推测分析测试")
+    print("=" * 60)
+
+    speculator = get_analyzer().speculator
+    before = speculator.get_metrics()
+    submit_ms = {"wait": [], "edit": [], "immediate": []}
+
+    at = AppTest.from_file(os.path.join(ROOT_DIR, "app.py"), default_timeout=30)
+    timed_run(at)
+    for _ in range(rounds):
+        for behavior, scenario in (("wait", "📱 → 📚 从娱乐到学习"), ("edit", "🛏️ → 🧹 从躺床到整理"), ("immediate", "🌀 → 💼 从拖延到工作")):
+            at.switch_page("pages/task_spark_home.py")
+            timed_run(at)
+            find_button(at, scenario).click()
+            timed_run(at)
+            if behavior != "immediate":
+                time.sleep(think_seconds)
+            if behavior == "edit":
+                at.text_input[1].input("整理书桌")
+            find_button(at, "🚀 开始AI智能分析").click()
+            submit_ms[behavior].append(timed_run(at))
+
+    after = speculator.get_metrics()
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+    results = {
+        "hit_rate": round(hits / (hits + misses), 3),
+        "hits": hits,
+        "misses": misses,
+        "wasted": after["wasted"] - before["wasted"],
+        "wasted_compute_ms": round(after["wasted_compute_ms"] - before["wasted_compute_ms"], 2),
+        "submit_p50_ms": {behavior: summarize(samples)["p50_ms"] for behavior, samples in submit_ms.items()}
+    }
+    print(f"   {results}")
+    return results
+
+
+def analysis_with_steps(step_count: int) -> Dict[str, Any]:
+    """生成指定步骤数的分析结果（在示例结果的步骤基础上扩展）"""
+    analysis = sample_analysis()
+    base_steps = analysis["micro_steps"]
+    analysis["micro_steps"] = [
+        dict(base_steps[i % len(base_steps)], step=f"{base_steps[i % len(base_steps)]['step']}（第{i + 1}步）")
+        for i in range(step_count)
+    ]
+    return analysis
+
+
+def benchmark_rerun_vs_steps(step_counts=(5, 10, 20, 40), rounds: int = 15) -> Dict[int, Dict[str, Any]]:
+    """
+    分析页和执行页的重新运行耗时随步骤数的变化
+
+    执行页停在最后一步（前面的步骤都已完成，已完成列表最长），反复点击“暂停休息”触发重新运行；
+    分析页直接重新运行。
+    """
+    print("📈 重新运行耗时 vs 步骤数")
+    print("=" * 60)
+
+    results = {}
+    for step_count in step_counts:
+        analysis = analysis_with_steps(step_count)
+
+        at = open_page("task_analysis.py", {"analysis_id": store_analysis(analysis)})
+        timed_run(at)
+        analysis_samples = [timed_run(at) for _ in range(rounds)]
+
+        at = open_page("micro_steps.py", {"analysis_id": store_analysis(analysis), "current_step": step_count - 1})
+        timed_run(at)
+        step_samples = []
+        for _ in range(rounds):
+            find_button(at, "⏸️ 暂停休息").click()
+            step_samples.append(timed_run(at))
+        at.session_state["step_timer"] = None
+
+        results[step_count] = {
+            "analysis_p50_ms": summarize(analysis_samples)["p50_ms"],
+            "micro_steps_p50_ms": summarize(step_samples)["p50_ms"],
+            "micro_steps_elements": sum(1 for _ in iter_protos(at))
+        }
+        print(f"   {step_count}步: {results[step_count]}")
+    return results
+
+
+def session_state_bytes(at) -> int:
+    """会话状态序列化后的字节数（近似每个会话占用的内存）"""
+    return len(pickle.dumps(at.session_state.to_dict()))
+
+
+def benchmark_history_session_memory(history_lengths=(0, 10, 100, 1000)) -> Dict[int, Dict[str, Any]]:
+    """
+    历史记录变长时首页的会话状态大小和渲染耗时
+
+    历史记录保存在SQLite中，会话里只有当前页的游标，两者都不应随历史长度增长。
+    """
+    import tempfile
+    from utils.history_store import HistoryStore
+    import utils.history_store as history_store
+
+    print("📚 历史记录长度 vs 会话内存")
+    print("=" * 60)
+
+    store = HistoryStore(os.path.join(tempfile.mkdtemp(), "history.db"))
+    history_store._store_instance = store
+    analysis = sample_analysis()
+    analysis_id = store_analysis(analysis)
+    entry = {'from': "躺在床上刷抖音", 'to': "复习期末考试", 'mood': "procrastinating", 'difficulty': 8}
+
+    results = {}
+    for length in history_lengths:
+        user_id = f"{length:032x}"
+        for _ in range(length):
+            store.add(user_id, entry, analysis_id)
+
+        at = open_page("task_spark_home.py", {"user_id": user_id})
+        timed_run(at)
+        samples = [timed_run(at) for _ in range(10)]
+        results[length] = {"session_bytes": session_state_bytes(at), "p50_ms": summarize(samples)["p50_ms"]}
+        print(f"   {length}条历史: {results[length]}")
+
+    # 旧的做法：会话中保存最近10条历史，每条带完整的分析结果
+    print(f"   （对比：会话中保存10条带分析结果的历史需要 {len(pickle.dumps([dict(entry, analysis=sample_analysis()) for _ in range(10)]))} 字节）")
+    history_store._store_instance = None
+    return results
+
+
+def benchmark_saved_records_memory(save_counts=(10, 50, 200)) -> Dict[int, Dict[str, Any]]:
+    """
+    执行页反复点击"保存记录"后的会话状态大小和渲染耗时
+
+    会话中只保留最近 COMPLETED_TASKS_MAX 条记录，更早的转存到数据库，会话大小不再随点击次数增长。
+    """
+    import tempfile
+    from utils.session_budget import SessionBudget, SpillStore
+    import utils.session_budget as session_budget
+
+    print("💾 保存记录次数 vs 会话内存")
+    print("=" * 60)
+
+    budget = SessionBudget(spill_store=SpillStore(os.path.join(tempfile.mkdtemp(), "spill.db")))
+    session_budget._budget_instance = budget
+    analysis = sample_analysis()
+    at = open_page("micro_steps.py", {"user_id": "0" * 32, "analysis_id": store_analysis(analysis),
+                                      "current_step": len(analysis["micro_steps"])})
+    timed_run(at)
+
+    results, saved = {}, 0
+    for count in save_counts:
+        while saved < count:
+            find_button(at, "💾 保存记录").click()
+            timed_run(at)
+            saved += 1
+        samples = [timed_run(at) for _ in range(10)]
+        records = list(at.session_state["completed_tasks"])
+        results[count] = {
+            "session_bytes": session_state_bytes(at),
+            "kept": len(records),
+            # 旧的做法：会话中的列表保存全部记录
+            "unbounded_bytes": session_state_bytes(at) - len(pickle.dumps(at.session_state["completed_tasks"]))
+                               + len(pickle.dumps(json.loads(json.dumps(records[:1] * count)))),
+            "p50_ms": summarize(samples)["p50_ms"]
+        }
+        print(f"   保存{count}次: {results[count]}")
+
+    print(f"   📊 {budget.get_metrics()}")
+    session_budget._budget_instance = None
+    return results
+
+
+def benchmark_session_backend_rerun(rounds: int = 30) -> Dict[str, Dict[str, Any]]:
+    """
+    会话状态写到外部存储后，执行页每次点击增加的耗时
+
+    每次点击"完成这一步"都会改变current_step，前后两次同步中有一次需要写入。
+    最后用一个全新的会话（相当于另一个副本）按用户标识恢复进度。
+    """
+    import tempfile
+    from utils.session_backend import SessionSync, MemorySessionBackend, SQLiteSessionBackend
+    import utils.session_backend as session_backend
+
+    print("🔁 会话状态后端 vs 每次点击耗时")
+    print("=" * 60)
+
+    analysis = sample_analysis()
+    analysis_id = store_analysis(analysis)
+    backends = {
+        "off": None,
+        "memory": MemorySessionBackend(),
+        "sqlite": SQLiteSessionBackend(os.path.join(tempfile.mkdtemp(), "session.db"))
+    }
+
+    results = {}
+    for name, backend in backends.items():
+        sync = SessionSync(backend) if backend is not None else None
+        session_backend._sync_instance = sync or False
+        user_id = f"{len(results):032x}"
+        at = open_page("micro_steps.py", {"user_id": user_id, "analysis_id": analysis_id, "current_step": 0})
+        timed_run(at)
+
+        samples = []
+        for _ in range(rounds):
+            if at.session_state["current_step"] >= len(analysis["micro_steps"]) - 1:
+                at.session_state["current_step"] = 0
+                timed_run(at)
+            find_button(at, "✅ 完成这一步").click()
+            samples.append(timed_run(at))
+        results[name] = summarize(samples)
+
+        if sync is not None:
+            # 另一个副本上的新会话：只带着URL中的用户标识
+            replica = open_page("micro_steps.py", {"user_id": user_id})
+            timed_run(replica)
+            assert replica.session_state["current_step"] == at.session_state["current_step"]
+            assert replica.session_state["analysis_id"] == analysis_id
+            results[name]["sync"] = sync.get_metrics()
+        print(f"   {name}: {results[name]}")
+
+    for name in ("memory", "sqlite"):
+        print(f"   ➕ {name}: p50 +{results[name]['p50_ms'] - results['off']['p50_ms']:.2f}ms · "
+              f"p95 +{results[name]['p95_ms'] - results['off']['p95_ms']:.2f}ms")
+    print("   ✅ 新会话按用户标识恢复了执行进度")
+    session_backend._sync_instance = None
+    return results
+
+
+def benchmark_resume_token(rounds: int = 10) -> Dict[str, Any]:
+    """
+    执行页刷新或换一台设备打开时，按URL中的恢复令牌恢复进度
+
+    新会话只带着resume参数（不同的用户标识），首次渲染的耗时与会话中已有进度时相同，不重新分析。
+    """
+    import tempfile
+    from utils.resume_store import RESUME_PARAM, ResumeStore
+    import utils.resume_store as resume_store
+
+    print("🔗 恢复令牌 vs 首次渲染耗时")
+    print("=" * 60)
+
+    store = ResumeStore(os.path.join(tempfile.mkdtemp(), "resume.db"))
+    resume_store._store_instance = store
+
+    analysis = sample_analysis()
+    analysis_id = store_analysis(analysis)
+    at = open_page("micro_steps.py", {"user_id": "1" * 32, "analysis_id": analysis_id, "current_step": 0})
+    timed_run(at)
+    for _ in range(3):
+        find_button(at, "✅ 完成这一步").click()
+        timed_run(at)
+    token = at.query_params[RESUME_PARAM]
+
+    with_state, restored = [], []
+    for i in range(rounds):
+        fresh = open_page("micro_steps.py", {"user_id": f"{i + 2:032x}", "analysis_id": analysis_id, "current_step": 3})
+        with_state.append(timed_run(fresh))
+
+        device = open_page("micro_steps.py", {"user_id": f"{i + 100:032x}"})
+        device.query_params[RESUME_PARAM] = token
+        restored.append(timed_run(device))
+        assert device.session_state["analysis_id"] == analysis_id and device.session_state["current_step"] == 3
+
+    results = {"token": token, "with_state": summarize(with_state), "restored": summarize(restored),
+               "resume_store": store.get_metrics()}
+    print(f"   🔑 令牌 {token}（{len(token)}个字符）")
+    print(f"   会话中已有进度: {results['with_state']}")
+    print(f"   按令牌恢复:     {results['restored']}")
+    print(f"   📊 {results['resume_store']}")
+    print("   ✅ 新设备按令牌恢复到第3步")
+    resume_store._store_instance = None
+    return results
+
+
+def benchmark_step_events() -> Dict[str, Any]:
+    """
+    执行页的步骤事件：完成、暂停、重新开始各记录一条事件，点击耗时与不记录时相同
+
+    完成两步 → 暂停 → 重新开始（放弃）→ 做完全部步骤，检查事件数量、各步骤用时和放弃的位置。
+    """
+    from utils.event_log import EventLog
+    import utils.event_log as event_log
+
+    print("📝 步骤事件记录测试")
+    print("=" * 60)
+
+    log = EventLog(tempfile.mkdtemp())
+    event_log._log_instance = log
+
+    analysis = sample_analysis()
+    total_steps = len(analysis["micro_steps"])
+    at = open_page("micro_steps.py", {"analysis_id": store_analysis(analysis), "current_step": 0})
+    timed_run(at)
+    samples = []
+    for label in ("✅ 完成这一步", "✅ 完成这一步", "⏸️ 暂停休息", "🔄 重新开始") + ("✅ 完成这一步",) * total_steps:
+        find_button(at, label).click()
+        samples.append(timed_run(at))
+
+    summary = log.aggregate()
+    assert summary["events"] == {"started": total_steps + 3, "completed": total_steps + 2, "paused": 1, "abandoned": 1}, summary
+    assert summary["abandoned_by_step"][2] == 1, "重新开始时应记录在第3步放弃"
+    assert summary["by_mood"][analysis["task_analysis"]["mood"]]["completed"] == total_steps + 2, "心情取自分析结果"
+
+    results = {"clicks": summarize(samples), "events": summary["events"], "event_log": log.get_metrics()}
+    print(f"   点击耗时（含写入事件）: {results['clicks']}")
+    print(f"   📊 {summary['events']} · 各步骤开始/完成: {summary['started_by_step']} / {summary['completed_by_step']}")
+    print(f"   📦 {results['event_log']}")
+    print("   ✅ 开始、完成、暂停、放弃均已记录")
+    event_log._log_instance = None
+    return results
+
+
+def benchmark_statistics_page(task_counts=(10, 1000, 20000), rounds: int = 10) -> Dict[str, Dict[str, Any]]:
+    """
+    统计页的渲染耗时：用户的记录数增长时保持不变（只读取汇总行）
+
+    另外从执行页做完一个任务，检查统计页的汇总已经更新。
+    """
+    from utils.stats_store import StatsStore, simulate_user
+    import utils.stats_store as stats_store
+
+    print("📊 统计页耗时 vs 记录数")
+    print("=" * 60)
+
+    store = StatsStore(os.path.join(tempfile.mkdtemp(), "stats.db"))
+    stats_store._store_instance = store
+    start_ts = time.time() - 365 * 86400
+
+    results = {}
+    for i, tasks in enumerate(task_counts):
+        user_id = f"{i + 1:032x}"
+        records = simulate_user(store, user_id, tasks, start_ts)["records"]
+        samples = [timed_run(open_page("statistics.py", {"user_id": user_id})) for _ in range(rounds)]
+        results[tasks] = dict(summarize(samples), records=records)
+        print(f"   {tasks:>6}个任务（{records}条记录）: {results[tasks]}")
+
+    analysis = sample_analysis()
+    # 心情和难度取自分析结果，表单里后来改过的输入不影响这次执行的统计
+    at = open_page("micro_steps.py", {"user_id": "f" * 32, "analysis_id": store_analysis(analysis), "current_step": 0,
+                                      "user_state": {"mood": "anxious", "difficulty": 6}})
+    timed_run(at)
+    for _ in analysis["micro_steps"]:
+        find_button(at, "✅ 完成这一步").click()
+        timed_run(at)
+    summary = store.summary("f" * 32)
+    mood = analysis["task_analysis"]["mood"]
+    assert summary["totals"]["tasks_completed"] == 1 and summary["mood"][mood]["completion_rate"] == 1.0, summary
+    assert "anxious" not in summary["mood"] and str(analysis["task_analysis"]["difficulty"]) in summary["difficulty"]
+    assert summary["totals"]["avg_steps_per_task"] == len(analysis["micro_steps"])
+    print(f"   ✅ 做完一个任务后汇总已更新: {summary['totals']}")
+    print(f"   📦 {store.get_metrics()}")
+    stats_store._store_instance = None
+    return results
+
+
+# 写入密集负载：模拟另一个副本上的会话，不停地保存历史、累加统计和记录步骤事件（写同一个数据库文件）
+WRITE_LOAD_SCRIPT = """
+import os, sys, time, signal
+sys.path.insert(0, {root!r})
+sys.stdout = open(os.devnull, "w")
+# 收到SIGTERM时正常退出，队列中的记录由atexit写完
+signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+from utils.event_log import EventLog
+from utils.history_store import HistoryStore
+from utils.stats_store import StatsStore
+history = HistoryStore({path!r}, write_behind={write_behind!r})
+stats = StatsStore({path!r}, write_behind={write_behind!r})
+events = EventLog({events_dir!r}, write_behind={write_behind!r})
+user_id = "{index:032x}"
+run = {{'task_type': "工作", 'mood': "anxious", 'difficulty': 5, 'total_steps': 6}}
+i = 0
+next_time = time.perf_counter()
+while True:
+    # 按固定频率写入，两种写入方式下负载相同
+    next_time += 1 / {rate!r}
+    time.sleep(max(0.0, next_time - time.perf_counter()))
+    history.enqueue(user_id, {{'from': "发呆", 'to': f"任务{{i}}", 'mood': "anxious", 'difficulty': 5}}, "0" * 40)
+    stats.record_step_completed(user_id, run, i % 6)
+    events.append("completed", i % 6, 6, "工作", "anxious", 5, {index}, 30.0)
+    i += 1
+"""
+
+
+def benchmark_write_heavy_reruns(clicks: int = 300, load_processes: int = 4, rate: float = 400) -> Dict[str, Dict[str, Any]]:
+    """
+    写入密集负载下执行页“完成这一步”的重新运行耗时：同步写入 vs 后台批量写入
+
+    另外几个进程模拟其他副本上的会话，每个进程每秒rate次写同一个数据库文件（与被测页面使用相同的写入方式），
+    比较点击后重新运行耗时的p50 / p99，以及每次运行中等待写入（统计、步骤事件）的耗时。
+    """
+    from utils.event_log import EventLog
+    from utils.history_store import HistoryStore
+    from utils.stats_store import StatsStore
+    import utils.event_log as event_log
+    import utils.history_store as history_store
+    import utils.stats_store as stats_store
+
+    print("✍️ 写入密集负载下的重新运行耗时")
+    print("=" * 60)
+
+    analysis = sample_analysis()
+    analysis_id = store_analysis(analysis)
+    results = {}
+    for write_behind in (False, True):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "load.db")
+        events_dir = os.path.join(directory, "events")
+        history = history_store._store_instance = HistoryStore(path, write_behind=write_behind)
+        stats = stats_store._store_instance = StatsStore(path, write_behind=write_behind)
+        events = event_log._log_instance = EventLog(events_dir, write_behind=write_behind)
+
+        # 页面中每次写入调用的耗时累加到当前这次运行
+        write_ms = [0.0]
+        def timed_write(method):
+            def wrapper(*args, **kwargs):
+                start_time = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    write_ms[-1] += (time.perf_counter() - start_time) * 1000
+            return wrapper
+        stats.record_started = timed_write(stats.record_started)
+        stats.record_step_completed = timed_write(stats.record_step_completed)
+        events.append = timed_write(events.append)
+
+        load = [subprocess.Popen([sys.executable, "-c", WRITE_LOAD_SCRIPT.format(
+                    root=ROOT_DIR, path=path, events_dir=events_dir, write_behind=write_behind, index=i + 1000, rate=rate)],
+                    cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                for i in range(load_processes)]
+        try:
+            time.sleep(2)  # 等负载进程开始写入
+            at = open_page("micro_steps.py", {"analysis_id": analysis_id, "current_step": 0})
+            timed_run(at)
+            samples = []
+            for _ in range(clicks):
+                if at.session_state["current_step"] >= len(analysis["micro_steps"]):
+                    at.session_state["current_step"] = 0
+                    timed_run(at)
+                find_button(at, "✅ 完成这一步").click()
+                write_ms.append(0.0)
+                samples.append(timed_run(at))
+        finally:
+            for process in load:
+                process.terminate()
+                process.wait()
+
+        name = "后台批量写入" if write_behind else "同步写入"
+        waits = write_ms[1:]
+        results[name] = dict(summarize(samples), p99_ms=round(percentile(samples, 0.99), 2),
+                             write_p50_ms=round(percentile(waits, 0.5), 3), write_p99_ms=round(percentile(waits, 0.99), 3),
+                             load_rows=history.count(f"{1000:032x}"))
+        print(f"   {name}: {results[name]}")
+        if write_behind:
+            for store in (history, stats, events):
+                print(f"   📊 {store.writer.get_metrics()}")
+        history_store._store_instance = stats_store._store_instance = event_log._log_instance = None
+
+    sync, behind = results["同步写入"], results["后台批量写入"]
+    print(f"   ✅ 重新运行p99 {sync['p99_ms']}ms → {behind['p99_ms']}ms · "
+          f"其中等待写入的p99 {sync['write_p99_ms']}ms → {behind['write_p99_ms']}ms")
+    return results
+
+
+# 冷启动测试在全新的子进程里运行，日志输出被丢弃，只把JSON结果写到标准输出
+ENGINE_COLD_START_SCRIPT = """
+import os, sys, time, json
+sys.path.insert(0, {root!r})
+sys.stdout = open(os.devnull, "w")
+start = time.perf_counter()
+from utils.ai_engine import TaskAnalyzer
+imported = time.perf_counter()
+analyzer = TaskAnalyzer()
+analyzer.analyze_task("躺在床上刷抖音", "复习期末考试", "procrastinating", 8)
+analyzed = time.perf_counter()
+sys.__stdout__.write(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "first_analysis_ms": (analyzed - imported) * 1000,
+    "heavy_modules": [m for m in {heavy!r} if m in sys.modules]
+}}, ensure_ascii=False))
+"""
+
+PAGE_COLD_START_SCRIPT = """
+import os, sys, time, json
+sys.path.insert(0, {root!r})
+sys.stdout = open(os.devnull, "w")
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file({path!r}, default_timeout=60)
+at.run()
+assert not at.exception, at.exception
+rendered = time.perf_counter()
+sys.__stdout__.write(json.dumps({{
+    "streamlit_import_ms": (imported - start) * 1000,
+    "first_run_ms": (rendered - imported) * 1000
+}}, ensure_ascii=False))
+"""
+
+# 只做离线分析时不应加载的依赖
+HEAVY_MODULES = ("streamlit", "openai", "pandas", "numpy")
+
+
+def run_cold(script: str) -> Dict[str, Any]:
+    """在全新的Python进程中运行脚本，返回其输出的JSON结果"""
+    env = dict(os.environ, OFFLINE_MODE="true", PYTHONDONTWRITEBYTECODE="1")
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT_DIR, env=env,
+                            capture_output=True, text=True, timeout=120, check=True).stdout
+    return json.loads(output)
+
+
+def benchmark_cold_start(rounds: int = 5, import_threshold_ms: float = None,
+                         first_analysis_threshold_ms: float = None, page_threshold_ms: float = None) -> Dict[str, Any]:
+    """
+    冷启动测试：分析引擎的导入耗时、第一次分析耗时，以及各页面在新进程中的首次运行耗时
+
+    引擎必须能在不加载Streamlit和OpenAI SDK的情况下完成离线分析；
+    任一项p50超过阈值即失败（阈值可用环境变量 COLD_IMPORT_MS / COLD_ANALYSIS_MS / COLD_PAGE_MS 调整）。
+    """
+    import_threshold_ms = import_threshold_ms or float(os.getenv("COLD_IMPORT_MS", "150"))
+    first_analysis_threshold_ms = first_analysis_threshold_ms or float(os.getenv("COLD_ANALYSIS_MS", "100"))
+    page_threshold_ms = page_threshold_ms or float(os.getenv("COLD_PAGE_MS", "1500"))
+
+    print("🧊 冷启动测试")
+    print("=" * 60)
+
+    engine_runs = [run_cold(ENGINE_COLD_START_SCRIPT.format(root=ROOT_DIR, heavy=HEAVY_MODULES)) for _ in range(rounds)]
+    results = {
+        "engine_import": summarize([r["import_ms"] for r in engine_runs]),
+        "engine_first_analysis": summarize([r["first_analysis_ms"] for r in engine_runs]),
+        "engine_heavy_modules": engine_runs[-1]["heavy_modules"]
+    }
+    print(f"   引擎导入: {results['engine_import']}")
+    print(f"   第一次分析: {results['engine_first_analysis']}")
+    print(f"   引擎加载的重量级依赖: {results['engine_heavy_modules'] or '无'}")
+
+    for name, path in (("app.py", "app.py"), ("task_spark_home.py", os.path.join("pages", "task_spark_home.py"))):
+        page_runs = [run_cold(PAGE_COLD_START_SCRIPT.format(root=ROOT_DIR, path=path)) for _ in range(rounds)]
+        results[name] = summarize([r["first_run_ms"] for r in page_runs])
+        print(f"   {name} 首次运行（不含导入Streamlit {page_runs[-1]['streamlit_import_ms']:.0f}ms）: {results[name]}")
+
+    assert not results["engine_heavy_modules"], f"离线分析加载了 {results['engine_heavy_modules']}"
+    assert results["engine_import"]["p50_ms"] < import_threshold_ms, \
+        f"引擎导入p50 {results['engine_import']['p50_ms']}ms 超过 {import_threshold_ms}ms"
+    assert results["engine_first_analysis"]["p50_ms"] < first_analysis_threshold_ms, \
+        f"第一次分析p50 {results['engine_first_analysis']['p50_ms']}ms 超过 {first_analysis_threshold_ms}ms"
+    worst_page = max(results[name]["p50_ms"] for name in ("app.py", "task_spark_home.py"))
+    assert worst_page < page_threshold_ms, f"页面首次运行p50 {worst_page}ms 超过 {page_threshold_ms}ms"
+    print("   ✅ 冷启动耗时均在阈值内")
+    return results
+
+
+def audit_external_requests() -> Dict[str, List[str]]:
+    """检查主题样式和每个页面渲染出的内容是否引用外部地址"""
+    from utils.theme import build_stylesheet
+
+    found = {}
+    stylesheet_urls = EXTERNAL_URL_PATTERN.findall(build_stylesheet()["css"])
+    if stylesheet_urls:
+        found["theme"] = stylesheet_urls
+
+    for name, (path, session) in all_pages().items():
+        at = load_page(path, session)
+        timed_run(at)
+        urls = [url for proto in iter_protos(at) for url in EXTERNAL_URL_PATTERN.findall(str(proto))]
+        if urls:
+            found[name] = urls
+    return found
+
+
+def benchmark_offline_page_load(rounds: int = 10, threshold_ms: float = 500) -> Dict[str, Any]:
+    """
+    断网情况下的页面加载测试
+
+    每轮用新的AppTest冷启动页面（相当于一次新的页面访问），并读取页面引用的样式和字体文件，
+    任何外部请求都会因为断网直接失败，不会被计入一个等待超时的耗时。
+    """
+    from utils.theme import build_stylesheet, STATIC_DIR, FONT_DIR, FONT_FILES
+
+    print("📴 断网页面加载测试")
+    print("=" * 60)
+
+    with network_disabled():
+        found = audit_external_requests()
+        assert not found, f"页面引用了外部地址: {found}"
+        print("   ✅ 所有页面和样式均未引用外部地址")
+
+        assets = [os.path.join(STATIC_DIR, build_stylesheet()["expected_file"])]
+        assets += [os.path.join(FONT_DIR, filename) for filename in FONT_FILES.values()]
+        results = {}
+        for name, (path, session) in all_pages().items():
+            samples = []
+            for _ in range(rounds):
+                start_time = time.perf_counter()
+                load_page(path, session).run()
+                for asset in assets:
+                    if os.path.exists(asset):
+                        with open(asset, "rb") as f:
+                            f.read()
+                samples.append((time.perf_counter() - start_time) * 1000)
+            results[name] = summarize(samples)
+            print(f"   {name}: {results[name]}")
+
+    worst_p95 = max(r["p95_ms"] for r in results.values())
+    assert worst_p95 < threshold_ms, f"断网时页面加载p95耗时 {worst_p95}ms 超过 {threshold_ms}ms"
+    print(f"   ✅ 断网时页面加载p95均低于 {threshold_ms}ms")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_step_clicks()
+    benchmark_rerun_payload()
+    benchmark_offline_page_load()
+    benchmark_home_interactions()
+    benchmark_reruns_per_analysis()
+    benchmark_speculation()
+    benchmark_rerun_vs_steps()
+    benchmark_cold_start()
+    benchmark_history_session_memory()
+    benchmark_saved_records_memory()
+    benchmark_session_backend_rerun()
+    benchmark_resume_token()
+    benchmark_step_events()
+    benchmark_statistics_page()
+    benchmark_write_heavy_reruns()
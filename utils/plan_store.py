@@ -0,0 +1,253 @@
+"""
+plan_store.py - 可分享的计划链接
+计划ID由分析结果的内容标识派生，同一份计划无论分享多少次都是同一个ID，内容永远不变。
+读取接口模仿HTTP缓存语义：ETag就是计划ID，带If-None-Match时直接返回304，不再读取结果；
+链接有有效期（PLAN_TTL_DAYS），过期后返回410，compact()定期删除过期的记录。
+"""
+
+import os
+import base64
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from .result_store import ResultStore, get_result_store
+from .sqlite_store import SQLiteStore, DB_PATH
+
+# 分享链接的有效期（天），再次分享同一份计划会重新计算有效期
+PLAN_TTL_DAYS = float(os.getenv("PLAN_TTL_DAYS", "30"))
+
+# URL中的参数名
+PLAN_PARAM = "plan"
+
+
+def plan_id_for(analysis_hash: str) -> str:
+    """由分析结果的内容标识（sha1）派生计划ID：前12字节的base64url编码，16个字符"""
+    return base64.urlsafe_b64encode(bytes.fromhex(analysis_hash)[:12]).decode("ascii")
+
+
+def plan_etag(plan_id: str) -> str:
+    """计划内容不会改变，ETag直接使用计划ID（强校验）"""
+    return f'"{plan_id}"'
+
+
+class PlanStore(SQLiteStore):
+    """
+    分享的计划
+
+    只保存计划ID到结果标识的映射和有效期，计划内容就是result_store中的那份结果。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS shared_plans (
+        plan_id TEXT PRIMARY KEY,
+        analysis_hash TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        views INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_shared_plans_expires ON shared_plans (expires_at);
+    """
+
+    def __init__(self, path: str = DB_PATH, results: Optional[ResultStore] = None, ttl_days: float = PLAN_TTL_DAYS):
+        """
+        Args:
+            path: 数据库文件路径
+            results: 计划内容所在的结果存储，为空时使用共享的单例
+            ttl_days: 分享链接的有效期（天）
+        """
+        super().__init__(path)
+        self.results = results
+        self.ttl_seconds = ttl_days * 86400
+
+        self.shares = 0
+        self.fetches = 0
+        self.not_modified = 0
+        self.gone = 0
+        self.not_found = 0
+        self.compacted = 0
+
+    def share(self, analysis_hash: str, now: Optional[float] = None) -> Optional[str]:
+        """
+        分享一份已保存的分析结果，返回计划ID；结果不存在时返回None
+
+        同一份结果再次分享得到同一个ID，有效期从这次分享重新计算。
+        """
+        results = self.results or get_result_store()
+        if results.get(analysis_hash) is None:
+            return None
+        now = now or time.time()
+        plan_id = plan_id_for(analysis_hash)
+        self._connect().execute(
+            "INSERT INTO shared_plans (plan_id, analysis_hash, created_at, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (plan_id) DO UPDATE SET expires_at = MAX(expires_at, excluded.expires_at)",
+            (plan_id, analysis_hash, now, now + self.ttl_seconds)
+        )
+        with self._lock:
+            self.shares += 1
+        return plan_id
+
+    def fetch(self, plan_id: str, if_none_match: Optional[str] = None, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        按计划ID读取，返回HTTP风格的响应
+
+        Returns:
+            {"status": 200/304/404/410, "etag", "cache_control", "analysis_hash", "analysis"}；
+            304时不读取计划内容（analysis为None），调用方继续使用缓存的那份
+        """
+        now = now or time.time()
+        row = self._connect().execute(
+            "SELECT analysis_hash, expires_at FROM shared_plans WHERE plan_id = ?", (plan_id,)
+        ).fetchone()
+        response = {"status": 404, "etag": None, "cache_control": "no-store", "analysis_hash": None, "analysis": None}
+
+        if row is not None and row[1] <= now:
+            response["status"] = 410
+        elif row is not None:
+            analysis_hash, expires_at = row
+            response.update({
+                "etag": plan_etag(plan_id),
+                # 内容不会改变，在链接过期之前都可以直接使用缓存
+                "cache_control": f"public, max-age={int(expires_at - now)}, immutable",
+                "analysis_hash": analysis_hash
+            })
+            if if_none_match == response["etag"]:
+                response["status"] = 304
+            else:
+                analysis = (self.results or get_result_store()).get(analysis_hash)
+                if analysis is not None:
+                    response.update({"status": 200, "analysis": analysis})
+                    self._connect().execute("UPDATE shared_plans SET views = views + 1 WHERE plan_id = ?", (plan_id,))
+
+        with self._lock:
+            self.fetches += 1
+            if response["status"] == 304:
+                self.not_modified += 1
+            elif response["status"] == 410:
+                self.gone += 1
+            elif response["status"] == 404:
+                self.not_found += 1
+        return response
+
+    def compact(self, now: Optional[float] = None, batch_size: int = 500) -> int:
+        """分批删除已过期的分享记录（每批一个短事务，不长时间占用写锁），返回删除的条数"""
+        now = now or time.time()
+        conn = self._connect()
+        removed = 0
+        while True:
+            deleted = conn.execute(
+                "DELETE FROM shared_plans WHERE plan_id IN "
+                "(SELECT plan_id FROM shared_plans WHERE expires_at <= ? LIMIT ?)",
+                (now, batch_size)
+            ).rowcount
+            removed += deleted
+            if deleted < batch_size:
+                break
+        with self._lock:
+            self.compacted += removed
+        return removed
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """分享和读取次数"""
+        with self._lock:
+            return {
+                "shares": self.shares,
+                "fetches": self.fetches,
+                "not_modified": self.not_modified,
+                "gone": self.gone,
+                "not_found": self.not_found,
+                "compacted": self.compacted,
+                "stored": self._connect().execute("SELECT COUNT(*) FROM shared_plans").fetchone()[0]
+            }
+
+
+# 单例实例（整个进程共享）
+_store_instance = None
+_store_lock = threading.Lock()
+
+def get_plan_store() -> PlanStore:
+    """获取分享计划存储（单例模式）"""
+    global _store_instance
+    instance = _store_instance
+    if instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                _store_instance = PlanStore()
+            instance = _store_instance
+    return instance
+
+
+# 性能测试
+def benchmark_plan_fetch(rounds: int = 2000):
+    """打开分享链接的耗时：首次读取（200）、带ETag的重复读取（304）"""
+    import tempfile
+    from .ai_simulator import AISimulator
+
+    print("⏱️ 分享计划读取性能测试")
+    print("=" * 60)
+
+    path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    results = ResultStore(path, max_cached=0)
+    store = PlanStore(path, results=results)
+    analysis = AISimulator().analyze_task("躺在床上刷抖音", "复习期末考试", "procrastinating", 8)
+    plan_id = store.share(results.put(analysis))
+
+    def timed(if_none_match):
+        start_time = time.perf_counter()
+        for _ in range(rounds):
+            response = store.fetch(plan_id, if_none_match)
+        return (time.perf_counter() - start_time) * 1000 / rounds, response
+
+    full_ms, response = timed(None)
+    cached_ms, cached = timed(response["etag"])
+    assert response["status"] == 200 and cached["status"] == 304
+    print(f"   🔗 计划ID {plan_id} · {response['cache_control']}")
+    print(f"   ⏱️ 200（从数据库读取结果）: {full_ms:.3f}ms · 304（带ETag）: {cached_ms:.3f}ms")
+    print(f"   📊 {store.get_metrics()}")
+    return {"full_ms": full_ms, "not_modified_ms": cached_ms}
+
+
+# 测试函数
+def test_plan_store():
+    """测试计划ID、ETag、过期和压缩"""
+    import tempfile
+    from .ai_simulator import AISimulator
+
+    print("🧪 测试分享计划")
+    print("=" * 60)
+
+    path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    results = ResultStore(path)
+    store = PlanStore(path, results=results, ttl_days=1)
+    analysis = AISimulator().analyze_task("坐在桌前发呆", "写工作报告", "anxious", 7)
+    analysis_hash = results.put(analysis)
+
+    now = time.time()
+    plan_id = store.share(analysis_hash, now=now)
+    assert len(plan_id) == 16 and plan_id == plan_id_for(analysis_hash)
+    assert store.share(analysis_hash, now=now) == plan_id, "同一份计划应得到同一个ID"
+    assert store.share("0" * 40) is None, "没有保存的结果不能分享"
+
+    response = store.fetch(plan_id, now=now)
+    assert response["status"] == 200 and response["analysis"] is analysis
+    assert response["etag"] == f'"{plan_id}"' and "immutable" in response["cache_control"]
+    cached = store.fetch(plan_id, if_none_match=response["etag"], now=now)
+    assert cached["status"] == 304 and cached["analysis"] is None
+    assert store.fetch("missing", now=now)["status"] == 404
+
+    # 过期：读取返回410，压缩后记录被删除
+    later = now + 2 * 86400
+    assert store.fetch(plan_id, now=later)["status"] == 410
+    assert store.compact(now=later) == 1
+    assert store.fetch(plan_id, now=later)["status"] == 404
+    assert results.get(analysis_hash) is not None, "压缩只删除分享记录，结果本身仍然保留"
+    print(f"   📊 {store.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 分享计划测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_plan_store()
+    benchmark_plan_fetch()
@@ -0,0 +1,167 @@
+"""
+presets.py - 快捷启动预设
+首页和主页的快捷启动使用固定输入，也是最常见的请求。
+进程启动时为每个预设的所有情绪和相邻难度预先算好分析结果，命中时直接返回副本。
+"""
+
+import copy
+import threading
+import time
+from typing import Dict, Any, List, Callable, Optional
+
+# 快捷启动预设（字段与首页的user_state一致）
+QUICK_PRESETS = {
+    'study': {
+        'current_activity': '刷手机/看视频',
+        'target_task': '学习/复习考试',
+        'mood': 'procrastinating',
+        'difficulty': 7
+    },
+    'clean': {
+        'current_activity': '躺在床上',
+        'target_task': '整理房间/打扫卫生',
+        'mood': 'tired',
+        'difficulty': 6
+    },
+    'work': {
+        'current_activity': '坐在桌前发呆',
+        'target_task': '写报告/完成工作',
+        'mood': 'anxious',
+        'difficulty': 8
+    }
+}
+
+# 首页可选的全部情绪
+MOOD_IDS = ["energetic", "neutral", "tired", "anxious", "procrastinating", "overwhelmed"]
+
+
+def preset_inputs(preset: Dict[str, Any]) -> Dict[str, Any]:
+    """预设转换为analyze_task的参数"""
+    return {
+        "current_state": preset["current_activity"],
+        "target_task": preset["target_task"],
+        "mood": preset["mood"],
+        "difficulty": preset["difficulty"]
+    }
+
+
+def preset_variants(difficulty_spread: int = 1) -> List[Dict[str, Any]]:
+    """所有预设 × 全部情绪 × 预设难度附近的取值"""
+    variants = []
+    for preset in QUICK_PRESETS.values():
+        base = preset["difficulty"]
+        difficulties = [d for d in range(base - difficulty_spread, base + difficulty_spread + 1) if 1 <= d <= 10]
+        for mood in MOOD_IDS:
+            for difficulty in difficulties:
+                variants.append(dict(preset_inputs(preset), mood=mood, difficulty=difficulty))
+    return variants
+
+
+class PresetCache:
+    """
+    预设分析结果缓存
+
+    整组结果绑定一个知识库版本，版本不一致时整组视为过期，由调用方重新构建；
+    构建完成后一次性替换，读取时不加锁。
+    """
+
+    def __init__(self, difficulty_spread: int = 1):
+        """
+        Args:
+            difficulty_spread: 预设难度上下各预先计算几档
+        """
+        self.difficulty_spread = difficulty_spread
+        self._results: Dict[tuple, Dict[str, Any]] = {}
+        self.version: Optional[str] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.builds = 0
+        self.last_build_ms = None
+
+    @staticmethod
+    def make_key(inputs: Dict[str, Any]) -> tuple:
+        return (inputs["current_state"], inputs["target_task"], inputs["mood"], int(inputs["difficulty"]))
+
+    def build(self, analyze_fn: Callable[..., Dict[str, Any]], version: str) -> int:
+        """为所有预设变体计算结果，返回条目数"""
+        start_time = time.perf_counter()
+        results = {self.make_key(inputs): analyze_fn(**inputs) for inputs in preset_variants(self.difficulty_spread)}
+        with self._lock:
+            self._results = results
+            self.version = version
+            self.builds += 1
+            self.last_build_ms = round((time.perf_counter() - start_time) * 1000, 2)
+        return len(results)
+
+    def is_stale(self, version: str) -> bool:
+        """缓存为空或属于旧的知识库版本"""
+        return self.version != version
+
+    def get(self, inputs: Dict[str, Any], version: str) -> Optional[Dict[str, Any]]:
+        """查找预设结果，返回深拷贝（调用方可以随意修改）；未命中或已过期返回None"""
+        results = self._results
+        if self.version != version:
+            with self._lock:
+                self.stale += 1
+            return None
+
+        result = results.get(self.make_key(inputs))
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return copy.deepcopy(result)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """缓存命中情况"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "entries": len(self._results),
+                "builds": self.builds,
+                "last_build_ms": self.last_build_ms,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+# 测试函数
+def test_preset_cache():
+    """测试预设缓存的命中和版本失效"""
+    from .ai_simulator import AISimulator
+
+    print("🧪 测试快捷启动预设缓存")
+    print("=" * 60)
+
+    ai = AISimulator()
+    cache = PresetCache()
+    count = cache.build(ai.analyze_task, ai.knowledge_base_version)
+    assert count == len(QUICK_PRESETS) * len(MOOD_IDS) * 3
+    print(f"   📦 预先计算 {count} 条，用时 {cache.last_build_ms}ms")
+
+    inputs = dict(preset_inputs(QUICK_PRESETS['clean']), mood="overwhelmed", difficulty=7)
+    start_time = time.perf_counter()
+    result = cache.get(inputs, ai.knowledge_base_version)
+    print(f"   ⚡ 命中耗时 {(time.perf_counter() - start_time) * 1000:.3f}ms")
+    assert result is not None
+    result["micro_steps"].clear()
+    assert cache.get(inputs, ai.knowledge_base_version)["micro_steps"], "返回的应是副本"
+
+    assert cache.get(dict(inputs, difficulty=3), ai.knowledge_base_version) is None
+    assert cache.get(inputs, "other-version") is None and cache.is_stale("other-version")
+    print(f"   📊 {cache.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 快捷启动预设缓存测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_preset_cache()
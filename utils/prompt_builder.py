@@ -0,0 +1,230 @@
+"""
+prompt_builder.py - 远程模型提示词构建器
+把模拟器的知识库渲染成静态系统前缀（每个知识库版本只渲染一次），
+每次请求只追加用户字段，并按token预算确定性地截断过长的自由文本
+"""
+
+import json
+import math
+import threading
+from typing import Dict, Any, List, Tuple
+
+# 远程模型需要返回的JSON结构说明（与模拟器的输出结构保持一致）
+RESPONSE_FORMAT = {
+    "task_analysis": {
+        "task_type": "任务类型（学习/整理/工作/创作/健康/社交/其他）",
+        "difficulty_level": "难度级别（低/中低/中高/高）",
+        "mental_blocks": ["心理障碍"],
+        "key_insight": "核心洞察",
+        "estimated_time": "预计总时间，如：约30分钟"
+    },
+    "micro_steps": [{"step": "具体动作", "time": "N分钟", "tip": "小提示", "energy": "低/中/高"}],
+    "strategy": {"name": "策略名称", "description": "策略说明", "first_step": "第一步", "key_principle": "关键原则"},
+    "encouragement": "鼓励语",
+    "personalized_suggestions": ["个性化建议"],
+    "adhd_specific": {
+        "focus_tips": ["专注技巧"],
+        "environment_tips": ["环境调整"],
+        "reward_ideas": ["奖励想法"],
+        "accountability_ideas": ["责任机制"]
+    }
+}
+
+USER_TEMPLATE = (
+    "当前状态: {current_state}\n"
+    "目标任务: {target_task}\n"
+    "情绪: {mood}\n"
+    "难度: {difficulty}/10\n"
+    "请只输出符合上述结构的JSON。"
+)
+
+TRUNCATION_MARK = "…"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计文本的token数
+
+    中日韩字符按每字1个token计算，其余字符按每4个字符1个token计算。
+    估计值偏保守，只用于预算控制，不追求与具体分词器完全一致。
+    """
+    cjk = 0
+    for ch in text:
+        if "⺀" <= ch <= "鿿" or "가" <= ch <= "힯" or "＀" <= ch <= "￯":
+            cjk += 1
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """把文本截断到不超过max_tokens，同样的输入总是得到同样的输出"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    # 二分查找最长的合法前缀（保留截断标记的位置）
+    budget = max_tokens - estimate_tokens(TRUNCATION_MARK)
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low].rstrip() + TRUNCATION_MARK
+
+
+class PromptBuilder:
+    """
+    提示词构建器
+
+    静态前缀只依赖知识库内容，按知识库版本缓存并保持逐字节稳定，
+    这样服务端的前缀缓存（prefix caching）才能命中。
+    """
+
+    def __init__(self, ai, max_prompt_tokens: int = 4000, max_field_tokens: int = 200):
+        """
+        初始化提示词构建器
+
+        Args:
+            ai: 提供知识库的AISimulator实例
+            max_prompt_tokens: 整个提示词（前缀 + 用户字段）的token上限
+            max_field_tokens: 单个自由文本字段的token上限
+        """
+        self.ai = ai
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_field_tokens = max_field_tokens
+
+        self._lock = threading.Lock()
+        self._prefix_cache: Dict[str, Tuple[str, int]] = {}
+        self.prefix_renders = 0
+
+    @property
+    def knowledge_base_version(self) -> str:
+        """当前知识库版本"""
+        return self.ai.knowledge_base_version
+
+    def _render_system_prefix(self) -> str:
+        """渲染静态系统前缀（输出只依赖知识库内容，键顺序固定）"""
+        knowledge_base = json.dumps(self.ai.get_knowledge_base(), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        response_format = json.dumps(RESPONSE_FORMAT, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return (
+            f"你是{self.ai.name}，一个{self.ai.personality}的任务启动助手，"
+            "专门帮助ADHD/执行力困难的用户把任务拆解成可以立即开始的微步骤。\n"
+            "请基于以下知识库进行分析：\n"
+            f"{knowledge_base}\n"
+            "输出要求：只返回一个JSON对象，结构如下：\n"
+            f"{response_format}"
+        )
+
+    def get_system_prefix(self) -> Tuple[str, int]:
+        """
+        获取静态系统前缀
+
+        Returns:
+            (前缀文本, 前缀token估计值)，同一知识库版本只渲染一次
+        """
+        version = self.knowledge_base_version
+        cached = self._prefix_cache.get(version)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            cached = self._prefix_cache.get(version)
+            if cached is None:
+                prefix = self._render_system_prefix()
+                cached = (prefix, estimate_tokens(prefix))
+                # 旧版本的前缀不会再被使用
+                self._prefix_cache = {version: cached}
+                self.prefix_renders += 1
+        return cached
+
+    def _fit_fields(self, fields: Dict[str, str], budget: int) -> Tuple[Dict[str, str], List[str]]:
+        """在预算内截断自由文本字段：先按单字段上限截断，超出总预算时优先缩短较长的字段"""
+        fitted = {name: truncate_to_tokens(value, self.max_field_tokens) for name, value in fields.items()}
+        costs = {name: estimate_tokens(value) for name, value in fitted.items()}
+
+        while sum(costs.values()) > budget:
+            # 按（token数，字段名）排序，保证平局时结果也确定
+            longest = max(costs, key=lambda name: (costs[name], name))
+            overflow = sum(costs.values()) - budget
+            fitted[longest] = truncate_to_tokens(fitted[longest], max(costs[longest] - overflow, 0))
+            new_cost = estimate_tokens(fitted[longest])
+            if new_cost >= costs[longest]:
+                # 已经无法再缩短
+                fitted[longest] = ""
+                new_cost = 0
+            costs[longest] = new_cost
+
+        truncated = [name for name in fields if fitted[name] != fields[name]]
+        return fitted, truncated
+
+    def build(self, current_state: str, target_task: str, mood: str, difficulty: int) -> Dict[str, Any]:
+        """
+        构建一次请求的完整提示词
+
+        Returns:
+            包含messages、token估计和截断信息的字典
+        """
+        prefix, prefix_tokens = self.get_system_prefix()
+
+        # 模板本身（不含自由文本）的开销
+        fixed_tokens = estimate_tokens(USER_TEMPLATE.format(current_state="", target_task="", mood=mood, difficulty=difficulty))
+        budget = max(self.max_prompt_tokens - prefix_tokens - fixed_tokens, 0)
+
+        fields, truncated = self._fit_fields(
+            {"current_state": current_state or "", "target_task": target_task or ""},
+            budget
+        )
+
+        user_content = USER_TEMPLATE.format(mood=mood, difficulty=difficulty, **fields)
+        user_tokens = estimate_tokens(user_content)
+
+        return {
+            "messages": [
+                {"role": "system", "content": prefix},
+                {"role": "user", "content": user_content}
+            ],
+            "prefix_version": self.knowledge_base_version,
+            "prefix_tokens": prefix_tokens,
+            "user_tokens": user_tokens,
+            "prompt_tokens": prefix_tokens + user_tokens,
+            "truncated_fields": truncated
+        }
+
+
+# 测试函数
+def test_prompt_builder():
+    """测试提示词构建器"""
+    from .ai_simulator import AISimulator
+
+    print("🧪 测试提示词构建器")
+    print("=" * 60)
+
+    builder = PromptBuilder(AISimulator(), max_prompt_tokens=2500, max_field_tokens=50)
+
+    first = builder.build("躺在床上刷抖音", "复习期末考试", "procrastinating", 8)
+    second = builder.build("坐在桌前发呆", "写工作报告" * 40, "anxious", 7)
+
+    assert first["messages"][0]["content"] == second["messages"][0]["content"], "静态前缀必须逐字节稳定"
+    assert builder.prefix_renders == 1, "同一知识库版本只应渲染一次前缀"
+    assert second["truncated_fields"] == ["target_task"]
+    assert second == builder.build("坐在桌前发呆", "写工作报告" * 40, "anxious", 7), "截断必须是确定性的"
+
+    print(f"   📦 前缀版本: {first['prefix_version']}")
+    print(f"   🔢 前缀token: {first['prefix_tokens']}，用户token: {first['user_tokens']}")
+    print(f"   ✂️ 截断字段: {second['truncated_fields']}")
+
+    builder.ai.microstep_templates["通用"].append("检查今天的完成情况")
+    builder.ai.reload_knowledge_base()
+    third = builder.build("躺在床上刷抖音", "复习期末考试", "procrastinating", 8)
+    assert third["prefix_version"] != first["prefix_version"]
+    assert builder.prefix_renders == 2
+
+    print("\n" + "=" * 60)
+    print("✅ 提示词构建器测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_prompt_builder()
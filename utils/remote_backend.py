@@ -0,0 +1,135 @@
+"""
+remote_backend.py - 远程模型后端
+通过OpenAI兼容接口调用远程大模型，提示词由PromptBuilder构建
+"""
+
+import os
+import json
+import time
+from typing import Dict, Any, Optional
+
+from .prompt_builder import PromptBuilder, estimate_tokens
+from .accounting import new_usage, estimate_cost
+
+
+class RemoteBackend:
+    """OpenAI兼容接口的远程分析后端"""
+
+    def __init__(self, prompt_builder: PromptBuilder, model: str, api_key: str,
+                 base_url: Optional[str] = None, timeout: float = 15.0,
+                 max_retries: int = 1, retry_backoff: float = 0.5):
+        """
+        Args:
+            prompt_builder: 提示词构建器
+            model: 模型名称
+            api_key: API密钥
+            base_url: 接口地址（为空时使用OpenAI官方地址）
+            timeout: 单次请求超时时间（秒）
+            max_retries: 超时、连接错误、限流和服务端错误的最大重试次数
+            retry_backoff: 首次重试前的等待时间（秒），之后每次翻倍
+        """
+        self.prompt_builder = prompt_builder
+        self.model = model
+        self.name = f"remote:{model}"
+        self._api_key = api_key
+        self._base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._client = None
+
+    def _get_client(self):
+        """首次调用时才创建客户端"""
+        if self._client is None:
+            import openai
+            # 重试由analyze_task自己处理，这样才能统计重试次数
+            self._client = openai.OpenAI(api_key=self._api_key, base_url=self._base_url, timeout=self.timeout, max_retries=0)
+        return self._client
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        import openai
+        return isinstance(error, (openai.APITimeoutError, openai.APIConnectionError,
+                                  openai.RateLimitError, openai.InternalServerError))
+
+    def analyze_task(self, current_state: str, target_task: str, mood: str, difficulty: int) -> Dict[str, Any]:
+        """
+        调用远程模型分析任务，请求失败或返回内容无法解析时抛出异常
+
+        成功时结果的_meta.usage带有本次调用的token、网络/解析耗时和重试次数；
+        失败时同样的信息挂在异常的usage属性上。
+        """
+        usage = new_usage(self.name, self.model)
+        prompt = self.prompt_builder.build(current_state, target_task, mood, difficulty)
+        client = self._get_client()
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                network_start = time.perf_counter()
+                try:
+                    response = client.chat.completions.create(
+                        model=self.model,
+                        messages=prompt["messages"],
+                        response_format={"type": "json_object"},
+                        temperature=0.7
+                    )
+                    break
+                except Exception as e:
+                    if attempt >= self.max_retries or not self._is_retryable(e):
+                        raise
+                    usage["retries"] += 1
+                    time.sleep(self.retry_backoff * (2 ** attempt))
+                finally:
+                    usage["network_ms"] = round(usage["network_ms"] + (time.perf_counter() - network_start) * 1000, 2)
+
+            parse_start = time.perf_counter()
+            content = response.choices[0].message.content
+            result = json.loads(content)
+            usage["parse_ms"] = round((time.perf_counter() - parse_start) * 1000, 2)
+            if not isinstance(result, dict):
+                raise ValueError("远程模型返回的不是JSON对象")
+        except Exception as e:
+            e.usage = {key: usage[key] for key in ("network_ms", "parse_ms", "retries")}
+            raise
+
+        if response.usage is not None:
+            usage["prompt_tokens"] = response.usage.prompt_tokens
+            usage["completion_tokens"] = response.usage.completion_tokens
+        else:
+            # 部分兼容接口不返回用量，用估计值代替
+            usage["prompt_tokens"] = prompt["prompt_tokens"]
+            usage["completion_tokens"] = estimate_tokens(content)
+        usage["cost_usd"] = estimate_cost(usage["prompt_tokens"], usage["completion_tokens"])
+
+        result["_meta"] = {
+            "ai_model": self.model,
+            "offline_mode": False,
+            "api_used": True,
+            "prompt_version": prompt["prefix_version"],
+            "truncated_fields": prompt["truncated_fields"],
+            "usage": usage
+        }
+        return result
+
+
+def create_remote_backend(ai) -> Optional[RemoteBackend]:
+    """
+    根据环境变量创建远程后端
+
+    OFFLINE_MODE为true或没有配置OPENAI_API_KEY时返回None，分析器只使用本地模拟器
+    """
+    if os.getenv("OFFLINE_MODE", "true").lower() == "true":
+        return None
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("⚠️ 未配置OPENAI_API_KEY，使用离线模拟器")
+        return None
+
+    return RemoteBackend(
+        prompt_builder=PromptBuilder(ai),
+        model=os.getenv("AI_MODEL", "gpt-4o-mini"),
+        api_key=api_key,
+        base_url=os.getenv("OPENAI_BASE_URL") or None,
+        timeout=float(os.getenv("REMOTE_TIMEOUT", "15"))
+    )
@@ -0,0 +1,237 @@
+"""
+resilience.py - 远程调用保护
+令牌桶限流器和熔断器，远程后端变慢或出错时让分析器直接走本地模拟器
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Any
+
+
+class TokenBucket:
+    """
+    令牌桶限流器
+
+    以固定速率补充令牌，桶满时多余的令牌丢弃；没有令牌的请求立即被拒绝，
+    调用方应当走本地降级路径而不是排队等待。
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发请求数）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.granted = 0
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens: int = 1) -> bool:
+        """尝试取出令牌，成功返回True，令牌不足时立即返回False"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                self.granted += 1
+                return True
+            self.throttled += 1
+            return False
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """限流器指标"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "rate_per_second": self.rate,
+                "capacity": self.capacity,
+                "available_tokens": round(self._tokens, 2),
+                "granted": self.granted,
+                "throttled": self.throttled
+            }
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed（正常）→ 最近窗口内失败或慢调用达到阈值 → open（熔断，直接拒绝）
+    → 冷却时间过后 → half_open（放行少量探测请求）→ 探测成功则closed，失败则重新open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: float = 0.5, latency_threshold_ms: float = 8000,
+                 slow_call_threshold: float = 0.5, window_size: int = 20, min_calls: int = 5,
+                 open_seconds: float = 30.0, half_open_max_calls: int = 1):
+        """
+        Args:
+            failure_threshold: 窗口内失败率达到该值时熔断
+            latency_threshold_ms: 超过该耗时的成功调用记为慢调用
+            slow_call_threshold: 窗口内慢调用比例达到该值时熔断
+            window_size: 统计窗口（最近N次调用）
+            min_calls: 窗口内至少有这么多次调用才判断是否熔断
+            open_seconds: 熔断后的冷却时间
+            half_open_max_calls: 半开状态下同时允许的探测请求数
+        """
+        self.failure_threshold = failure_threshold
+        self.latency_threshold_ms = latency_threshold_ms
+        self.slow_call_threshold = slow_call_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._outcomes = deque(maxlen=window_size)  # (是否失败, 是否慢调用)
+        self._lock = threading.Lock()
+
+        self.trips = 0
+        self.rejected = 0
+        self.last_trip_reason = ""
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self._state
+
+    def _maybe_half_open(self, now: float):
+        if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+
+    def _trip(self, reason: str):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probes_in_flight = 0
+        self._outcomes.clear()
+        self.trips += 1
+        self.last_trip_reason = reason
+        print(f"⚡ 熔断器打开: {reason}")
+
+    def allow_request(self) -> bool:
+        """判断是否允许发起远程调用；返回True后必须调用record_success/record_failure/release之一"""
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._probes_in_flight < self.half_open_max_calls:
+                self._probes_in_flight += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """放弃一次已获准但没有真正发出的调用（例如被限流）"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def record_success(self, latency_ms: float):
+        """记录一次成功调用"""
+        slow = latency_ms >= self.latency_threshold_ms
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                if slow:
+                    self._trip(f"探测请求过慢 ({latency_ms:.0f}ms)")
+                else:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    print("✅ 熔断器恢复: 探测请求成功")
+                return
+            self._outcomes.append((False, slow))
+            self._evaluate()
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trip("探测请求失败")
+                return
+            self._outcomes.append((True, False))
+            self._evaluate()
+
+    def _evaluate(self):
+        total = len(self._outcomes)
+        if total < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._outcomes if failed)
+        slow_calls = sum(1 for _, slow in self._outcomes if slow)
+        if failures / total >= self.failure_threshold:
+            self._trip(f"失败率 {failures}/{total}")
+        elif slow_calls / total >= self.slow_call_threshold:
+            self._trip(f"慢调用比例 {slow_calls}/{total}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """熔断器指标"""
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            total = len(self._outcomes)
+            return {
+                "state": self._state,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "last_trip_reason": self.last_trip_reason,
+                "window_calls": total,
+                "window_failures": sum(1 for failed, _ in self._outcomes if failed),
+                "window_slow_calls": sum(1 for _, slow in self._outcomes if slow)
+            }
+
+
+# 测试函数
+def test_resilience():
+    """测试限流器和熔断器"""
+    print("🧪 测试限流器和熔断器")
+    print("=" * 60)
+
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire(), "令牌耗尽后应立即拒绝"
+    print(f"   🪣 限流器: {bucket.get_metrics()}")
+
+    breaker = CircuitBreaker(window_size=4, min_calls=4, open_seconds=0.05, latency_threshold_ms=100)
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record_success(10)
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request(), "熔断期间应直接拒绝"
+
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request(), "半开状态只放行一个探测请求"
+    breaker.record_success(10)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    for _ in range(4):
+        breaker.allow_request()
+        breaker.record_success(500)
+    assert breaker.state == CircuitBreaker.OPEN, "慢调用比例过高也应熔断"
+    print(f"   ⚡ 熔断器: {breaker.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 限流器和熔断器测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_resilience()
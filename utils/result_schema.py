@@ -0,0 +1,326 @@
+"""
+result_schema.py - 分析结果的统一结构
+版本化的结果结构定义、编译后的校验器，以及用默认值补全缺失部分的修复流程
+"""
+
+import copy
+import json
+import time
+import hashlib
+from typing import Dict, Any, List, Callable, Optional
+
+SCHEMA_VERSION = 1
+
+# 结构定义：type 为 str / bool / list[str] / list[dict] / dict，
+# default 在调用方提供的默认分析里也缺少该字段时使用
+RESULT_SCHEMA = {
+    "type": "dict",
+    "fields": {
+        "task_analysis": {
+            "type": "dict",
+            "fields": {
+                "task_type": {"type": "str", "default": "其他"},
+                "difficulty_level": {"type": "str", "default": "中"},
+                "estimated_time": {"type": "str", "default": "约30分钟"},
+                "key_insight": {"type": "str", "default": ""},
+                "mental_blocks": {"type": "list[str]", "default": []}
+            }
+        },
+        "micro_steps": {
+            "type": "list[dict]",
+            "min_items": 1,
+            "item": {
+                "step": {"type": "str", "required": True},
+                "time": {"type": "str", "default": ""},
+                "tip": {"type": "str", "default": ""}
+            }
+        },
+        "strategy": {
+            "type": "dict",
+            "fields": {
+                "name": {"type": "str", "default": "微步骤启动法"},
+                "description": {"type": "str", "default": ""},
+                "key_principle": {"type": "str", "default": "完成比完美重要"}
+            }
+        },
+        "encouragement": {"type": "str", "default": "你可以做到的！"},
+        "personalized_suggestions": {"type": "list[str]", "default": []},
+        "adhd_specific": {
+            "type": "dict",
+            "fields": {
+                "focus_tips": {"type": "list[str]", "default": []},
+                "environment_tips": {"type": "list[str]", "default": []},
+                "reward_ideas": {"type": "list[str]", "default": []},
+                "accountability_ideas": {"type": "list[str]", "default": []}
+            }
+        },
+        "_meta": {
+            "type": "dict",
+            "fields": {
+                "ai_model": {"type": "str", "default": "TaskSpark AI"},
+                "offline_mode": {"type": "bool", "default": True}
+            }
+        }
+    }
+}
+
+_MISSING = object()
+
+
+class _RepairContext:
+    """一次校验的上下文：记录问题路径，按需（只在需要修复时）生成默认分析"""
+
+    __slots__ = ("problems", "_defaults_factory", "_defaults")
+
+    def __init__(self, defaults_factory: Optional[Callable[[], Dict[str, Any]]]):
+        self.problems: List[str] = []
+        self._defaults_factory = defaults_factory
+        self._defaults = None
+
+    def default(self, path: tuple):
+        """取默认分析中同一路径的值，默认分析里没有时返回_MISSING"""
+        if self._defaults is None:
+            self._defaults = self._defaults_factory() if self._defaults_factory else {}
+        node = self._defaults
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                return _MISSING
+            node = node[key]
+        return copy.deepcopy(node)
+
+
+def _fill(spec: Dict[str, Any], path: tuple, ctx: _RepairContext, check: Callable):
+    """为缺失或无法修复的字段取默认值：优先用调用方的默认分析，其次用结构定义里的default"""
+    value = ctx.default(path)
+    if value is not _MISSING:
+        return value
+    if "default" in spec:
+        return copy.deepcopy(spec["default"])
+    if spec["type"] == "dict":
+        # 整段缺失时逐字段补默认值，问题只记在这一段上
+        recorded = len(ctx.problems)
+        value = check({}, ctx)
+        del ctx.problems[recorded:]
+        return value
+    return []
+
+
+def _compile(spec: Dict[str, Any], path: tuple) -> Callable:
+    """把一段结构定义编译成检查函数 check(value, ctx) -> 修复后的值"""
+    kind = spec["type"]
+    label = ".".join(path) or "<root>"
+
+    if kind == "str":
+        def check(value, ctx):
+            if type(value) is str:
+                return value
+            ctx.problems.append(label)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return str(value)
+            return _fill(spec, path, ctx, check)
+        return check
+
+    if kind == "bool":
+        def check(value, ctx):
+            if type(value) is bool:
+                return value
+            ctx.problems.append(label)
+            return _fill(spec, path, ctx, check)
+        return check
+
+    if kind == "list[str]":
+        def check(value, ctx):
+            if type(value) is list and all(type(item) is str for item in value):
+                return value
+            ctx.problems.append(label)
+            if isinstance(value, list):
+                return [str(item) for item in value if isinstance(item, (str, int, float))]
+            return _fill(spec, path, ctx, check)
+        return check
+
+    if kind == "dict":
+        children = [(key, child, _compile(child, path + (key,))) for key, child in spec["fields"].items()]
+
+        def check(value, ctx):
+            if not isinstance(value, dict):
+                ctx.problems.append(label)
+                value = {}
+            # 保留结构定义之外的字段（例如task_icon、first_step）
+            out = dict(value)
+            for key, child_spec, child_check in children:
+                child_value = value.get(key, _MISSING)
+                if child_value is _MISSING:
+                    ctx.problems.append(f"{label}.{key}" if path else key)
+                    out[key] = _fill(child_spec, path + (key,), ctx, child_check)
+                    continue
+                out[key] = child_check(child_value, ctx)
+            return out
+        return check
+
+    if kind == "list[dict]":
+        item_fields = [(key, _compile(child, path + (key,)), child.get("required", False))
+                       for key, child in spec["item"].items()]
+        min_items = spec.get("min_items", 0)
+
+        def check(value, ctx):
+            items = []
+            if isinstance(value, list):
+                for item in value:
+                    if not isinstance(item, dict):
+                        continue
+                    out = dict(item)
+                    valid = True
+                    for key, child_check, required in item_fields:
+                        child_value = item.get(key, _MISSING)
+                        if child_value is _MISSING or (required and not child_value):
+                            if required:
+                                valid = False
+                                break
+                            out[key] = spec["item"][key].get("default")
+                            continue
+                        out[key] = child_check(child_value, ctx)
+                    if valid:
+                        items.append(out)
+            if not isinstance(value, list) or len(items) != len(value):
+                ctx.problems.append(label)
+            if len(items) < min_items:
+                return _fill(spec, path, ctx, check)
+            return items
+        return check
+
+    raise ValueError(f"未知的结构类型: {kind}")
+
+
+class ResultValidator:
+    """
+    分析结果校验器
+
+    结构定义在构造时编译成一组嵌套的检查函数，每次校验只执行这些函数，
+    不再逐字段解释结构定义。
+    """
+
+    def __init__(self, schema: Dict[str, Any] = RESULT_SCHEMA, version: int = SCHEMA_VERSION):
+        self.version = version
+        self._check = _compile(schema, ())
+
+        self.validated = 0
+        self.repaired = 0
+        self.total_time_ms = 0.0
+
+    def validate(self, result: Any, defaults_factory: Optional[Callable[[], Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        校验并修复分析结果
+
+        Args:
+            result: 任意后端返回的分析结果
+            defaults_factory: 生成同一输入默认分析的函数，只有需要修复时才会调用
+
+        Returns:
+            符合当前结构版本的结果，_meta中带有schema_version和修复记录
+        """
+        start_time = time.perf_counter()
+
+        if isinstance(result, dict) and "meta" in result:
+            # 兼容旧版模拟器和远程模型的meta字段
+            result = dict(result)
+            legacy_meta = result.pop("meta")
+            if isinstance(legacy_meta, dict):
+                result["_meta"] = {**legacy_meta, **result.get("_meta", {})}
+
+        ctx = _RepairContext(defaults_factory)
+        validated = self._check(result, ctx)
+        validated["_meta"]["schema_version"] = self.version
+        if ctx.problems:
+            validated["_meta"]["repaired_fields"] = ctx.problems
+            self.repaired += 1
+
+        self.validated += 1
+        self.total_time_ms += (time.perf_counter() - start_time) * 1000
+        return validated
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """校验器统计"""
+        return {
+            "schema_version": self.version,
+            "validated": self.validated,
+            "repaired": self.repaired,
+            "avg_validation_us": round(self.total_time_ms * 1000 / self.validated, 2) if self.validated else 0.0
+        }
+
+
+def fingerprint(result: Dict[str, Any]) -> str:
+    """
+    分析结果的内容标识
+
+    只取页面会显示的内容：_meta中的耗时、用量等每次都不同的记录不参与计算，
+    内容相同的结果（例如同一预设的多个副本）得到相同的标识。
+    """
+    meta = result.get("_meta", {})
+    content = {key: value for key, value in result.items() if key != "_meta"}
+    content["_display"] = [meta.get("ai_model"), meta.get("offline_mode")]
+    return hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+# 性能测试
+def benchmark_validator(rounds: int = 2000):
+    """测量每个结果的校验耗时（完整结果 / 需要修复的结果）"""
+    from .ai_simulator import AISimulator
+
+    print("⏱️ 校验器性能测试")
+    print("=" * 60)
+
+    simulator = AISimulator()
+    sample = simulator.analyze_task("躺在床上刷抖音", "复习期末考试", "procrastinating", 8)
+    broken = {"task_analysis": {"task_type": 3}, "micro_steps": [{"time": "2分钟"}], "meta": {"ai_model": "remote"}}
+    defaults = lambda: copy.deepcopy(sample)
+
+    validator = ResultValidator()
+    for name, result in (("完整结果", sample), ("需要修复的结果", broken)):
+        start_time = time.perf_counter()
+        for _ in range(rounds):
+            validator.validate(result, defaults)
+        per_result_us = (time.perf_counter() - start_time) * 1_000_000 / rounds
+        print(f"   {name}: {per_result_us:.1f}µs/个")
+
+    print(f"   📊 {validator.get_metrics()}")
+    return validator.get_metrics()
+
+
+# 测试函数
+def test_result_schema():
+    """测试结果校验和修复"""
+    from .ai_simulator import AISimulator
+
+    print("🧪 测试结果校验器")
+    print("=" * 60)
+
+    validator = ResultValidator()
+    sample = AISimulator().analyze_task("坐在桌前发呆", "写工作报告", "anxious", 7)
+
+    result = validator.validate(sample)
+    assert "meta" not in result and result["_meta"]["schema_version"] == SCHEMA_VERSION
+    assert "repaired_fields" not in result["_meta"], result["_meta"].get("repaired_fields")
+
+    repaired = validator.validate(
+        {"micro_steps": [{"time": 5}], "encouragement": 1},
+        lambda: {"micro_steps": [{"step": "从最小的一步开始执行", "time": "10分钟", "tip": "建立动力"}]}
+    )
+    assert repaired["micro_steps"][0]["step"] == "从最小的一步开始执行"
+    assert repaired["encouragement"] == "1"
+    assert repaired["_meta"]["offline_mode"] is True
+    print(f"   🔧 修复字段: {repaired['_meta']['repaired_fields']}")
+
+    copied = copy.deepcopy(result)
+    copied["_meta"]["usage"] = {"total_ms": 1.0}
+    assert fingerprint(copied) == fingerprint(result), "_meta中的记录不应影响内容标识"
+    copied["micro_steps"][0]["step"] += "！"
+    assert fingerprint(copied) != fingerprint(result)
+
+    print("\n" + "=" * 60)
+    print("✅ 结果校验器测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_result_schema()
+    benchmark_validator()
@@ -0,0 +1,238 @@
+"""
+result_store.py - 按内容寻址的分析结果存储
+每份分析结果以内容标识（result_schema.fingerprint）为键只保存一份：SQLite中存一份JSON，
+进程内用LRU缓存解析好的结果，所有会话共享。会话状态和历史记录只保存标识。
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from .result_schema import fingerprint
+from .sqlite_store import SQLiteStore, DB_PATH
+
+
+class ResultStore(SQLiteStore):
+    """
+    分析结果存储
+
+    get() 返回的结果在所有会话间共享，调用方只能读取不能修改；
+    内容相同的结果只保留第一次写入的那份（_meta中的耗时、用量等记录以它为准）。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS results (
+        hash TEXT PRIMARY KEY,
+        body TEXT NOT NULL,
+        created_at REAL NOT NULL  -- 最近一次保存的时间（维护任务只清理很久没有保存过且无人引用的结果）
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str = DB_PATH, max_cached: int = 1000):
+        """
+        Args:
+            path: 数据库文件路径
+            max_cached: 进程内最多缓存的结果数，超出时淘汰最久未使用的
+        """
+        super().__init__(path)
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+        self.puts = 0
+        self.deduplicated = 0
+        self.hits = 0
+        self.loads = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _cache_result(self, result_hash: str, result: Dict[str, Any]):
+        """放入LRU缓存（调用方持有锁）"""
+        self._cache[result_hash] = result
+        self._cache.move_to_end(result_hash)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, result: Dict[str, Any]) -> str:
+        """保存分析结果，返回内容标识；已有相同内容时不重复保存"""
+        result_hash = fingerprint(result)
+        now = time.time()
+        with self._lock:
+            self.puts += 1
+            cached = result_hash in self._cache
+            if cached:
+                self._cache.move_to_end(result_hash)
+
+        conn = self._connect()
+        # 已有相同内容时只刷新保存时间；缓存中有、数据库中已被清理时重新写入
+        if cached and conn.execute("UPDATE results SET created_at = ? WHERE hash = ?", (now, result_hash)).rowcount:
+            with self._lock:
+                self.deduplicated += 1
+            return result_hash
+
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO results (hash, body, created_at) VALUES (?, ?, ?)",
+            (result_hash, json.dumps(result, ensure_ascii=False), now)
+        ).rowcount
+        if not inserted:
+            conn.execute("UPDATE results SET created_at = ? WHERE hash = ?", (now, result_hash))
+        with self._lock:
+            if not inserted:
+                self.deduplicated += 1
+            self._cache_result(result_hash, result)
+        return result_hash
+
+    def get(self, result_hash: Optional[str]) -> Optional[Dict[str, Any]]:
+        """按内容标识读取结果（只读），不存在时返回None"""
+        if not result_hash:
+            return None
+        with self._lock:
+            result = self._cache.get(result_hash)
+            if result is not None:
+                self._cache.move_to_end(result_hash)
+                self.hits += 1
+                return result
+
+        row = self._connect().execute("SELECT body FROM results WHERE hash = ?", (result_hash,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.loads += 1
+            result = self._cache.get(result_hash)
+            if result is None:
+                result = json.loads(row[0])
+                self._cache_result(result_hash, result)
+            return result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """去重和缓存命中情况"""
+        with self._lock:
+            lookups = self.hits + self.loads + self.misses
+            return {
+                "cached": len(self._cache),
+                "max_cached": self.max_cached,
+                "puts": self.puts,
+                "deduplicated": self.deduplicated,
+                "hits": self.hits,
+                "loads": self.loads,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "stored": self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0],
+                "db_bytes": self.db_bytes()
+            }
+
+
+# 单例实例（整个进程共享）
+_store_instance = None
+_store_lock = threading.Lock()
+
+def get_result_store() -> ResultStore:
+    """获取分析结果存储（单例模式）"""
+    global _store_instance
+    instance = _store_instance
+    if instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                _store_instance = ResultStore()
+            instance = _store_instance
+    return instance
+
+
+# 性能测试
+def benchmark_session_memory(sessions: int = 1000, unique_ratio: float = 0.2):
+    """
+    每1000个会话的分析结果内存：每个会话各持有一份结果 vs 会话只持有标识
+
+    大部分会话使用快捷启动预设（结果相同），unique_ratio的会话输入各不相同。
+    分析结果先生成好，两种方式都从各自的副本开始计量，只比较会话状态和共享存储占用的内存。
+    """
+    import os
+    import io
+    import copy
+    import random
+    import tempfile
+    import tracemalloc
+    from contextlib import redirect_stdout
+    from .ai_engine import TaskAnalyzer
+    from .presets import preset_variants
+
+    print("🧠 每1000个会话的分析结果内存")
+    print("=" * 60)
+
+    with redirect_stdout(io.StringIO()):
+        analyzer = TaskAnalyzer()
+        analyzer.refresh_presets()
+        variants = preset_variants()
+        rng = random.Random(42)
+        results = [
+            analyzer.analyze_task("躺在床上刷抖音", f"复习第{i}章", "tired", 5)
+            if rng.random() < unique_ratio else analyzer.analyze_task(**rng.choice(variants))
+            for i in range(sessions)
+        ]
+
+    def measure(build):
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        used = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        return used, kept
+
+    # 之前：每个会话的session state保存一份完整结果
+    before_bytes, _ = measure(lambda: [{"task_analysis": copy.deepcopy(r)} for r in results])
+
+    # 之后：会话只保存标识，结果在共享存储中只有一份
+    store = ResultStore(os.path.join(tempfile.mkdtemp(), "results.db"), max_cached=sessions)
+    after_bytes, _ = measure(lambda: [{"analysis_id": store.put(copy.deepcopy(r))} for r in results])
+
+    print(f"   之前: {before_bytes / 1024:.0f}KB · 之后: {after_bytes / 1024:.0f}KB（{before_bytes / after_bytes:.1f}倍）")
+    print(f"   📊 {store.get_metrics()}")
+    return {"before_bytes": before_bytes, "after_bytes": after_bytes}
+
+
+# 测试函数
+def test_result_store():
+    """测试去重、LRU淘汰和从数据库重新加载"""
+    import os
+    import copy
+    import tempfile
+    from .ai_simulator import AISimulator
+
+    print("🧪 测试分析结果存储")
+    print("=" * 60)
+
+    path = os.path.join(tempfile.mkdtemp(), "results.db")
+    store = ResultStore(path, max_cached=2)
+    ai = AISimulator()
+    first = ai.analyze_task("躺在床上刷抖音", "复习期末考试", "procrastinating", 8)
+    second = ai.analyze_task("坐在桌前发呆", "写工作报告", "anxious", 7)
+    third = ai.analyze_task("刚睡醒躺在床上", "整理房间", "tired", 6)
+
+    copied = copy.deepcopy(first)
+    copied["_meta"]["processing_time_ms"] = 999
+    first_hash = store.put(first)
+    assert store.put(copied) == first_hash, "内容相同的结果应得到同一个标识"
+    assert store.get(first_hash) is first
+
+    store.put(second)
+    store.put(third)
+    assert store.get_metrics()["evictions"] == 1 and store.get_metrics()["stored"] == 3
+    assert store.get(first_hash)["micro_steps"] == first["micro_steps"], "被淘汰的结果应从数据库重新加载"
+    assert store.get("missing") is None and store.get(None) is None
+
+    # 重新打开（相当于重启服务）
+    assert ResultStore(path).get(first_hash)["encouragement"] == first["encouragement"]
+    print(f"   📊 {store.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 分析结果存储测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_result_store()
+    benchmark_session_memory()
@@ -0,0 +1,232 @@
+"""
+resume_store.py - 执行进度的恢复令牌
+执行页把"哪份分析结果、做到第几步、是哪一次执行"保存为一个很小的快照，URL中的resume参数就是快照的令牌。
+刷新页面或在另一台设备上打开同一个链接时，按令牌查一次主键就能恢复，分析结果直接从result_store读取，不重新分析。
+"""
+
+import secrets
+import struct
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+from .sqlite_store import SQLiteStore, DB_PATH
+
+# 快照格式：版本(1字节) + 分析结果标识(sha1, 20字节) + 当前步骤(2字节) + 执行标识(8字节，0表示没有)
+SNAPSHOT_FORMAT = ">B20sHQ"
+SNAPSHOT_VERSION = 2
+
+# URL中的参数名
+RESUME_PARAM = "resume"
+
+
+def encode_snapshot(analysis_id: str, current_step: int, run_id: int = 0) -> bytes:
+    """执行进度编码为31字节的快照"""
+    return struct.pack(SNAPSHOT_FORMAT, SNAPSHOT_VERSION, bytes.fromhex(analysis_id), current_step, run_id)
+
+
+def decode_snapshot(snapshot: bytes) -> Optional[Tuple[str, int, int]]:
+    """快照解码为 (分析结果标识, 当前步骤, 执行标识)，格式不对时返回None"""
+    if len(snapshot) != struct.calcsize(SNAPSHOT_FORMAT):
+        return None
+    version, digest, current_step, run_id = struct.unpack(SNAPSHOT_FORMAT, snapshot)
+    if version != SNAPSHOT_VERSION:
+        return None
+    return digest.hex(), current_step, run_id
+
+
+class ResumeStore(SQLiteStore):
+    """恢复令牌 → 执行进度快照"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS resume_points (
+        token TEXT PRIMARY KEY,
+        snapshot BLOB NOT NULL,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        """
+        Args:
+            path: 数据库文件路径
+        """
+        super().__init__(path)
+
+        self.creates = 0
+        self.updates = 0
+        self.restores = 0
+        self.misses = 0
+
+    def create(self, analysis_id: str, current_step: int, run_id: int = 0) -> str:
+        """保存一个新的进度快照，返回令牌（11个字符，可直接放进URL）"""
+        token = secrets.token_urlsafe(8)
+        self._connect().execute(
+            "INSERT INTO resume_points (token, snapshot, updated_at) VALUES (?, ?, ?)",
+            (token, encode_snapshot(analysis_id, current_step, run_id), time.time())
+        )
+        with self._lock:
+            self.creates += 1
+        return token
+
+    def update(self, token: str, analysis_id: str, current_step: int, run_id: int = 0):
+        """更新令牌对应的进度"""
+        self._connect().execute(
+            "UPDATE resume_points SET snapshot = ?, updated_at = ? WHERE token = ?",
+            (encode_snapshot(analysis_id, current_step, run_id), time.time(), token)
+        )
+        with self._lock:
+            self.updates += 1
+
+    def load(self, token: str) -> Optional[Tuple[str, int, int]]:
+        """按令牌读取 (分析结果标识, 当前步骤, 执行标识)，不存在时返回None"""
+        row = self._connect().execute("SELECT snapshot FROM resume_points WHERE token = ?", (token,)).fetchone()
+        point = decode_snapshot(row[0]) if row else None
+        with self._lock:
+            if point is None:
+                self.misses += 1
+            else:
+                self.restores += 1
+        return point
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """创建、更新和恢复次数"""
+        with self._lock:
+            return {
+                "creates": self.creates,
+                "updates": self.updates,
+                "restores": self.restores,
+                "misses": self.misses,
+                "stored": self._connect().execute("SELECT COUNT(*) FROM resume_points").fetchone()[0]
+            }
+
+
+# 单例实例（整个进程共享）
+_store_instance = None
+_store_lock = threading.Lock()
+
+def get_resume_store() -> ResumeStore:
+    """获取恢复令牌存储（单例模式）"""
+    global _store_instance
+    instance = _store_instance
+    if instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                _store_instance = ResumeStore()
+            instance = _store_instance
+    return instance
+
+
+def restore_resume_point() -> bool:
+    """
+    URL中带有resume参数且不是当前会话的令牌时，恢复它指向的分析结果和执行进度
+
+    Returns:
+        是否恢复了进度
+    """
+    import streamlit as st
+    token = st.query_params.get(RESUME_PARAM)
+    resume_point = st.session_state.get('resume_point')
+    if not token or (resume_point and resume_point['token'] == token):
+        return False
+
+    point = get_resume_store().load(token)
+    if point is None:
+        return False
+    analysis_id, current_step, run_id = point
+    st.session_state.analysis_id = analysis_id
+    st.session_state.current_step = current_step
+    st.session_state.resume_point = {'token': token, 'analysis_id': analysis_id, 'step': current_step, 'run_id': run_id}
+    # 继续快照中的那一次执行（不算新开始一个任务），由执行页取走
+    if run_id:
+        st.session_state.resume_run_id = run_id
+    return True
+
+
+def save_resume_point(analysis_id: str, current_step: int, run_id: int = 0) -> str:
+    """记录当前进度（只在分析结果、步骤或执行变化时写入），并把令牌写到URL中"""
+    import streamlit as st
+    resume_point = st.session_state.get('resume_point')
+    store = get_resume_store()
+    if not resume_point or resume_point['analysis_id'] != analysis_id:
+        resume_point = {'token': store.create(analysis_id, current_step, run_id), 'analysis_id': analysis_id,
+                        'step': current_step, 'run_id': run_id}
+        st.session_state.resume_point = resume_point
+    elif resume_point['step'] != current_step or resume_point.get('run_id') != run_id:
+        store.update(resume_point['token'], analysis_id, current_step, run_id)
+        resume_point['step'] = current_step
+        resume_point['run_id'] = run_id
+
+    if st.query_params.get(RESUME_PARAM) != resume_point['token']:
+        st.query_params[RESUME_PARAM] = resume_point['token']
+    return resume_point['token']
+
+
+# 性能测试
+def benchmark_resume(rounds: int = 1000):
+    """按令牌恢复进度的耗时：查一次主键 + 从结果存储读取分析结果（进程内缓存命中 / 从数据库加载）"""
+    import os
+    import json
+    import tempfile
+    from .ai_simulator import AISimulator
+    from .result_store import ResultStore
+
+    print("⏱️ 恢复令牌性能测试")
+    print("=" * 60)
+
+    path = os.path.join(tempfile.mkdtemp(), "resume.db")
+    store = ResumeStore(path)
+    results = ResultStore(path)
+    analysis = AISimulator().analyze_task("躺在床上刷抖音", "复习期末考试", "procrastinating", 8)
+    analysis_id = results.put(analysis)
+    tokens = [store.create(analysis_id, i % 6) for i in range(rounds)]
+
+    snapshot_bytes = len(encode_snapshot(analysis_id, 3))
+    json_bytes = len(json.dumps({"analysis_id": analysis_id, "current_step": 3}))
+    print(f"   📦 快照 {snapshot_bytes} 字节（JSON {json_bytes} 字节）· 令牌 {len(tokens[0])} 个字符")
+
+    def timed(load_result):
+        start_time = time.perf_counter()
+        for token in tokens:
+            restored_id, _, _ = store.load(token)
+            assert load_result(restored_id) is not None
+        return (time.perf_counter() - start_time) * 1000 / rounds
+
+    warm_ms = timed(results.get)
+    # 另一个副本：进程内没有缓存，结果从数据库加载
+    cold_ms = timed(ResultStore(path, max_cached=0).get)
+    print(f"   ⏱️ 恢复耗时: 缓存命中 {warm_ms:.3f}ms · 从数据库加载 {cold_ms:.3f}ms")
+    print(f"   📊 {store.get_metrics()}")
+    return {"snapshot_bytes": snapshot_bytes, "warm_ms": warm_ms, "cold_ms": cold_ms}
+
+
+# 测试函数
+def test_resume_store():
+    """测试快照编码、令牌的创建、更新和恢复"""
+    import os
+    import tempfile
+
+    print("🧪 测试恢复令牌")
+    print("=" * 60)
+
+    analysis_id = "0123456789abcdef0123456789abcdef01234567"
+    assert decode_snapshot(encode_snapshot(analysis_id, 5, 2 ** 62)) == (analysis_id, 5, 2 ** 62)
+    assert decode_snapshot(b"bad") is None
+
+    path = os.path.join(tempfile.mkdtemp(), "resume.db")
+    store = ResumeStore(path)
+    token = store.create(analysis_id, 0)
+    assert len(token) == 11 and store.load(token) == (analysis_id, 0, 0)
+    store.update(token, analysis_id, 3, 42)
+    assert ResumeStore(path).load(token) == (analysis_id, 3, 42), "另一个进程应读到最新进度"
+    assert store.load("missing") is None
+    print(f"   📊 {store.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 恢复令牌测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_resume_store()
+    benchmark_resume()
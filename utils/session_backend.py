@@ -0,0 +1,386 @@
+"""
+session_backend.py - 会话状态的外部存储
+用户进度（表单内容、当前分析、执行到第几步、这一次执行和步骤计时、已完成的任务）在每次交互后写到外部存储，
+任何一个副本上的新会话都按Cookie中的用户标识恢复，不再依赖粘性会话，副本重启也不会丢失进度。
+只写入有变化的key；后端可替换：SQLite（多个副本共享同一个数据库文件）或进程内存储（单进程/测试用）。
+
+同一浏览器的多个标签页共用一个用户标识，也就共用后端里的一份记录，以最后写入的为准：
+打开着的标签页各自使用会话中的状态，互不影响；新会话恢复时拿到的是最后写入的那个标签页的进度。
+执行进度的几个key（PROGRESS_KEYS）总是整组写入和恢复，不会出现A标签页的分析结果配上B标签页的步骤。
+"""
+
+import os
+import json
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+from .sqlite_store import SQLiteStore, DB_PATH
+
+# 需要持久化的会话状态key（step_run/step_timer 也要恢复：刷新或换副本后仍是同一次执行，不会重复记开始）
+PERSISTED_KEYS = ("user_state", "analysis_id", "current_step", "step_run", "step_timer", "completed_tasks")
+
+# 执行进度：一组key互相对应（第几步、哪一次执行属于哪个分析结果），整组写入、整组恢复
+PROGRESS_KEYS = ("analysis_id", "current_step", "step_run", "step_timer")
+
+# 会话中记录各key上次写入时内容的位置（判断哪些key有变化）
+SNAPSHOT_KEY = "_persisted_snapshot"
+
+
+def serialize(value: Any) -> str:
+    """会话状态值序列化为JSON（deque等可迭代对象按列表保存）"""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=list)
+
+
+class SessionBackend:
+    """
+    会话状态后端接口
+
+    值都是 serialize() 之后的JSON文本，后端只负责按 (user_id, key) 存取。
+    """
+
+    name = "base"
+
+    def load(self, user_id: str) -> Dict[str, str]:
+        """读取一个用户保存的全部key"""
+        raise NotImplementedError
+
+    def save(self, user_id: str, changed: Dict[str, str], deleted: List[str]):
+        """写入有变化的key，删除已从会话中移除的key（同一次调用内原子完成）"""
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionBackend):
+    """进程内的替身实现：只在单个进程内共享，进程重启后丢失"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, user_id: str) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._data.get(user_id, {}))
+
+    def save(self, user_id: str, changed: Dict[str, str], deleted: List[str]):
+        with self._lock:
+            values = self._data.setdefault(user_id, {})
+            values.update(changed)
+            for key in deleted:
+                values.pop(key, None)
+
+
+class SQLiteSessionBackend(SQLiteStore, SessionBackend):
+    """SQLite实现：多个副本指向同一个数据库文件即可共享会话状态"""
+
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS session_state (
+        user_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (user_id, key)
+    ) WITHOUT ROWID;
+    """
+
+    def load(self, user_id: str) -> Dict[str, str]:
+        rows = self._connect().execute("SELECT key, value FROM session_state WHERE user_id = ?", (user_id,)).fetchall()
+        return dict(rows)
+
+    def save(self, user_id: str, changed: Dict[str, str], deleted: List[str]):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO session_state (user_id, key, value, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                [(user_id, key, value, now) for key, value in changed.items()]
+            )
+            conn.executemany("DELETE FROM session_state WHERE user_id = ? AND key = ?",
+                             [(user_id, key) for key in deleted])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+# 可选的后端（环境变量 SESSION_BACKEND 选择，off 表示不持久化）
+BACKENDS = {
+    "sqlite": lambda: SQLiteSessionBackend(DB_PATH),
+    "memory": MemorySessionBackend
+}
+
+
+class SessionSync:
+    """
+    会话状态与后端之间的同步
+
+    sync() 在页面运行（以及片段单独重新运行）开始和结束时各调用一次：
+    - 新会话（没有快照）先从后端恢复，会话中已有的key以会话为准
+    - 之后比较各key序列化后的内容与上次写入时是否相同，只写入有变化的key
+    - 同一组的key有一个变化时整组写入（会话中没有的从后端删除），恢复时整组恢复或整组不恢复
+    """
+
+    def __init__(self, backend: SessionBackend, keys=PERSISTED_KEYS, groups=(PROGRESS_KEYS,)):
+        """
+        Args:
+            backend: 会话状态后端
+            keys: 需要持久化的key
+            groups: 需要整组写入和恢复的key
+        """
+        self.backend = backend
+        self.keys = tuple(keys)
+        self.groups = [tuple(group) for group in groups]
+        self._lock = threading.Lock()
+
+        self.restores = 0
+        self.restored_keys = 0
+        self.syncs = 0
+        self.writes = 0
+        self.keys_written = 0
+        self.keys_deleted = 0
+        self.write_ms = 0.0
+
+    def sync(self, state, user_id: str) -> Dict[str, Any]:
+        """
+        同步一个会话
+
+        Returns:
+            {"restored": 从后端恢复的key, "changed": 写入的key, "deleted": 删除的key}
+        """
+        snapshot: Optional[Dict[str, int]] = state.get(SNAPSHOT_KEY)
+        restored = []
+        if snapshot is None:
+            snapshot = {}
+            # 会话中已经有一组里的某个key时，这一组都以会话为准
+            skipped = {key for group in self.groups if any(key in state for key in group) for key in group}
+            for key, text in self.backend.load(user_id).items():
+                if key in self.keys and key not in state and key not in skipped:
+                    state[key] = json.loads(text)
+                    snapshot[key] = hash(text)
+                    restored.append(key)
+
+        # 快照只保存内容的哈希值，会话中多占的内存可以忽略
+        changed = {}
+        for key in self.keys:
+            if key in state:
+                text = serialize(state[key])
+                digest = hash(text)
+                if snapshot.get(key) != digest:
+                    changed[key] = text
+                    snapshot[key] = digest
+        deleted = [key for key in snapshot if key not in state]
+        for key in deleted:
+            del snapshot[key]
+        for group in self.groups:
+            if any(key in changed or key in deleted for key in group):
+                for key in group:
+                    if key in state:
+                        changed.setdefault(key, serialize(state[key]))
+                    elif key not in deleted:
+                        deleted.append(key)
+
+        elapsed_ms = 0.0
+        if changed or deleted:
+            start_time = time.perf_counter()
+            self.backend.save(user_id, changed, deleted)
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+        state[SNAPSHOT_KEY] = snapshot
+
+        with self._lock:
+            self.syncs += 1
+            if restored:
+                self.restores += 1
+                self.restored_keys += len(restored)
+            if changed or deleted:
+                self.writes += 1
+                self.keys_written += len(changed)
+                self.keys_deleted += len(deleted)
+                self.write_ms += elapsed_ms
+        return {"restored": restored, "changed": list(changed), "deleted": deleted}
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """恢复和写入次数"""
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "syncs": self.syncs,
+                "restores": self.restores,
+                "restored_keys": self.restored_keys,
+                "writes": self.writes,
+                "keys_written": self.keys_written,
+                "keys_deleted": self.keys_deleted,
+                "clean_syncs": self.syncs - self.writes,
+                "avg_write_ms": round(self.write_ms / self.writes, 3) if self.writes else None
+            }
+
+
+# 单例实例（整个进程共享）
+_sync_instance = None
+_sync_lock = threading.Lock()
+
+def get_session_sync() -> Optional[SessionSync]:
+    """获取会话状态同步器（单例模式），SESSION_BACKEND=off 时返回None"""
+    global _sync_instance
+    instance = _sync_instance
+    if instance is None:
+        with _sync_lock:
+            if _sync_instance is None:
+                backend_name = os.getenv("SESSION_BACKEND", "sqlite").lower()
+                _sync_instance = SessionSync(BACKENDS[backend_name]()) if backend_name in BACKENDS else False
+            instance = _sync_instance
+    return instance or None
+
+
+@contextmanager
+def session_state_synced():
+    """
+    包住页面的main()：开始时恢复会话并写入回调中的修改，
+    结束时（包括st.switch_page、st.rerun提前结束的情况）写入本次运行中的修改
+    """
+    import streamlit as st
+    sync = get_session_sync()
+    if sync is None:
+        yield
+        return
+
+    user_id = st.session_state.get('user_id', '')
+    sync.sync(st.session_state, user_id)
+    try:
+        yield
+    finally:
+        sync.sync(st.session_state, user_id)
+
+
+def synced_fragment(func):
+    """
+    片段函数的装饰器（放在 @st.fragment 下面）
+
+    片段单独重新运行时不经过页面main()外面的 session_state_synced，片段里的修改（结束休息、表单提交）也要写回；
+    整页运行时片段内多做的一次比较只是几十微秒。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with session_state_synced():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# 性能测试
+def benchmark_session_sync(rounds: int = 2000):
+    """每次同步的耗时：没有变化时只做比较，有变化时写入一个key"""
+    import tempfile
+    from collections import deque
+
+    print("⏱️ 会话状态同步耗时")
+    print("=" * 60)
+
+    backends = {
+        "memory": MemorySessionBackend(),
+        "sqlite": SQLiteSessionBackend(os.path.join(tempfile.mkdtemp(), "session.db"))
+    }
+    results = {}
+    for name, backend in backends.items():
+        sync = SessionSync(backend)
+        state = {
+            'user_id': "0" * 32,
+            'user_state': {'current_activity': "躺在床上刷抖音", 'target_task': "复习期末考试",
+                           'mood': "procrastinating", 'difficulty': 8},
+            'analysis_id': "f" * 40,
+            'current_step': 0,
+            'completed_tasks': deque([{'task': "学习任务", 'time': "2026-01-01 20:00", 'steps': 6}] * 20, maxlen=20)
+        }
+        sync.sync(state, state['user_id'])
+
+        start_time = time.perf_counter()
+        for _ in range(rounds):
+            sync.sync(state, state['user_id'])
+        clean_us = (time.perf_counter() - start_time) * 1_000_000 / rounds
+
+        start_time = time.perf_counter()
+        for i in range(rounds):
+            state['current_step'] = i
+            sync.sync(state, state['user_id'])
+        dirty_us = (time.perf_counter() - start_time) * 1_000_000 / rounds
+
+        results[name] = {"clean_us": round(clean_us, 1), "dirty_us": round(dirty_us, 1)}
+        print(f"   {name}: 无变化 {clean_us:.1f}µs · 写入current_step {dirty_us:.1f}µs")
+        print(f"   📊 {sync.get_metrics()}")
+    return results
+
+
+# 测试函数
+def test_session_backend():
+    """测试只写入有变化的key、删除和在另一个副本上恢复"""
+    import tempfile
+    from collections import deque
+
+    print("🧪 测试会话状态后端")
+    print("=" * 60)
+
+    path = os.path.join(tempfile.mkdtemp(), "session.db")
+    for backend_factory in (MemorySessionBackend, lambda: SQLiteSessionBackend(path)):
+        backend = backend_factory()
+        replica_a = SessionSync(backend)
+        state = {'user_id': "a" * 32, 'user_state': {'target_task': "复习", 'difficulty': 5},
+                 'analysis_id': "hash-1", 'current_step': 0, 'form_target_task': "不持久化"}
+
+        report = replica_a.sync(state, "alice")
+        assert sorted(report["changed"]) == ["analysis_id", "current_step", "user_state"], report
+        assert replica_a.sync(state, "alice")["changed"] == [], "没有变化时不应写入"
+
+        state['current_step'] = 3
+        state['completed_tasks'] = deque([{'task': "学习"}], maxlen=20)
+        state['user_state']['difficulty'] = 7
+        report = replica_a.sync(state, "alice")
+        assert sorted(report["changed"]) == ["analysis_id", "completed_tasks", "current_step", "user_state"], report
+
+        del state['analysis_id']
+        assert replica_a.sync(state, "alice")["deleted"] == ["analysis_id", "step_run", "step_timer"]
+
+        # 另一个副本上的新会话：按用户标识恢复
+        replica_b = SessionSync(backend_factory() if backend.name == "sqlite" else backend)
+        restored_state = {'user_id': "a" * 32}
+        report = replica_b.sync(restored_state, "alice")
+        assert sorted(report["restored"]) == ["completed_tasks", "current_step", "user_state"], report
+        assert report["changed"] == [], "刚恢复的key不需要写回"
+        assert restored_state['current_step'] == 3 and restored_state['user_state']['difficulty'] == 7
+        assert restored_state['completed_tasks'] == [{'task': "学习"}]
+        assert 'analysis_id' not in restored_state and 'form_target_task' not in restored_state
+        assert replica_b.sync({}, "bob")["restored"] == [], "不能恢复其他用户的状态"
+
+        # 同一用户的两个标签页：执行进度整组写入，新会话恢复的是最后写入的那个标签页的完整进度
+        tab_a = {'analysis_id': "hash-a", 'current_step': 4, 'step_run': {'id': 1}, 'step_timer': {'step': 4}}
+        tab_b = {'analysis_id': "hash-b", 'current_step': 0, 'step_run': {'id': 2}}
+        replica_a.sync(tab_a, "carol")
+        replica_b.sync(tab_b, "carol")
+        tab_a['current_step'] = 5
+        assert sorted(replica_a.sync(tab_a, "carol")["changed"]) == sorted(PROGRESS_KEYS), "一组中有变化时整组写入"
+        assert tab_b == {'analysis_id': "hash-b", 'current_step': 0, 'step_run': {'id': 2}, SNAPSHOT_KEY: tab_b[SNAPSHOT_KEY]}, \
+            "打开着的标签页不受另一个标签页写入的影响"
+        tab_b['current_step'] = 1
+        report = replica_b.sync(tab_b, "carol")
+        assert report["deleted"] == ["step_timer"], "整组写入时删除本标签页没有的key"
+        refreshed = {}
+        replica_a.sync(refreshed, "carol")
+        assert {key: refreshed.get(key) for key in PROGRESS_KEYS} == \
+            {'analysis_id': "hash-b", 'current_step': 1, 'step_run': {'id': 2}, 'step_timer': None}, refreshed
+        partial = {'analysis_id': "hash-c"}
+        replica_a.sync(partial, "carol")
+        assert 'step_run' not in partial and 'current_step' not in partial, "会话中已有进度时不混入后端的进度"
+        print(f"   {backend.name}: {replica_a.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 会话状态后端测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_session_backend()
+    benchmark_session_sync()
@@ -0,0 +1,349 @@
+"""
+session_budget.py - 会话状态的大小统计和淘汰策略
+每次页面运行时估算当前会话状态占用的字节数，并汇总所有会话的占用情况；
+只增不减的列表（如已完成的任务记录）用有界的环形缓冲保存，
+会话超出字节预算时把最旧的条目转存到SQLite，会话中只保留最近的部分。
+"""
+
+import os
+import sys
+import json
+import pickle
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+from .sqlite_store import SQLiteStore, DB_PATH
+
+# 每个会话的字节预算
+SESSION_BUDGET_BYTES = int(os.getenv("SESSION_BUDGET_BYTES", "32768"))
+
+# 只增不减的列表，以及会话中最多保留的条数（超出时最旧的条目转存到数据库）
+RING_BUFFER_SIZES = {
+    "completed_tasks": int(os.getenv("COMPLETED_TASKS_MAX", "20"))
+}
+
+# 超过这个时间没有运行的会话计为闲置（已被放弃但服务端还没有过期清理）
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "600"))
+
+# 超过这个时间没有运行的会话不再统计
+SESSION_FORGET_SECONDS = float(os.getenv("SESSION_FORGET_SECONDS", "86400"))
+
+
+def value_bytes(value: Any) -> int:
+    """一个值序列化后的字节数（近似它在会话中占用的内存）"""
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class SpillStore(SQLiteStore):
+    """从会话中移出的旧条目，按用户和会话状态的key保存"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS session_spill (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        payload TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_session_spill_user_key ON session_spill (user_id, key, id DESC);
+    """
+
+    def spill(self, user_id: str, key: str, items: List[Any]):
+        """写入移出的条目（按原来的先后顺序）"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO session_spill (user_id, key, created_at, payload) VALUES (?, ?, ?, ?)",
+            [(user_id, key, now, json.dumps(item, ensure_ascii=False, default=str)) for item in items]
+        )
+        conn.execute("COMMIT")
+
+    def load(self, user_id: str, key: str, limit: int = 50) -> List[Any]:
+        """读取最近移出的条目，按从新到旧的顺序"""
+        rows = self._connect().execute(
+            "SELECT payload FROM session_spill WHERE user_id = ? AND key = ? ORDER BY id DESC LIMIT ?",
+            (user_id, key, limit)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self, user_id: str, key: str) -> int:
+        """某个用户某个key移出的条目数"""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM session_spill WHERE user_id = ? AND key = ?", (user_id, key)
+        ).fetchone()[0]
+
+
+class SessionBudget:
+    """
+    会话状态预算管理
+
+    enforce() 在每次页面运行开始时调用：
+    1. 环形缓冲的key统一转换为有长度上限的deque（旧版本的list也会被截断）
+    2. 按key统计会话状态的字节数
+    3. 超出预算时按 ring_sizes 中的顺序从环形缓冲里移出最旧的条目，直到回到预算以内
+    移出的条目都会转存到 SpillStore，不会丢失。
+    """
+
+    def __init__(self, budget_bytes: int = SESSION_BUDGET_BYTES, ring_sizes: Dict[str, int] = None,
+                 spill_store: Optional[SpillStore] = None, idle_seconds: float = SESSION_IDLE_SECONDS,
+                 forget_seconds: float = SESSION_FORGET_SECONDS):
+        """
+        Args:
+            budget_bytes: 每个会话的字节预算
+            ring_sizes: 环形缓冲的key及其最大条数
+            spill_store: 移出条目的存储，为空时使用默认数据库（首次移出时才创建）
+            idle_seconds: 超过多久没有运行的会话计为闲置
+            forget_seconds: 超过多久没有运行的会话不再统计
+        """
+        self.budget_bytes = budget_bytes
+        self.ring_sizes = dict(RING_BUFFER_SIZES if ring_sizes is None else ring_sizes)
+        self.idle_seconds = idle_seconds
+        self.forget_seconds = forget_seconds
+        self._spill_store = spill_store
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+        self.measurements = 0
+        self.over_budget = 0
+        self.trimmed = 0
+        self.evicted = 0
+        self.spilled = 0
+
+    @property
+    def spill_store(self) -> SpillStore:
+        if self._spill_store is None:
+            self._spill_store = SpillStore(DB_PATH)
+        return self._spill_store
+
+    def _spill(self, user_id: str, key: str, items: List[Any]):
+        if not items:
+            return
+        self.spill_store.spill(user_id, key, items)
+        with self._lock:
+            self.spilled += len(items)
+
+    # ==================== 环形缓冲 ====================
+    def ring(self, state, key: str, user_id: str = "") -> deque:
+        """会话中key对应的环形缓冲，不存在时创建；超出上限的旧条目转存到数据库"""
+        maxlen = self.ring_sizes[key]
+        buffer = state.get(key)
+        if isinstance(buffer, deque) and buffer.maxlen == maxlen:
+            return buffer
+
+        items = list(buffer or [])
+        overflow = items[:-maxlen] if len(items) > maxlen else []
+        self._spill(user_id, key, overflow)
+        with self._lock:
+            self.trimmed += len(overflow)
+        buffer = deque(items[len(overflow):], maxlen=maxlen)
+        state[key] = buffer
+        return buffer
+
+    def append(self, state, key: str, item: Any, user_id: str = "") -> deque:
+        """向环形缓冲追加一条，缓冲已满时最旧的一条先转存到数据库"""
+        buffer = self.ring(state, key, user_id)
+        if len(buffer) == buffer.maxlen:
+            self._spill(user_id, key, [buffer[0]])
+            with self._lock:
+                self.trimmed += 1
+        buffer.append(item)
+        return buffer
+
+    # ==================== 统计与淘汰 ====================
+    def enforce(self, session_id: str, state, user_id: str = "") -> Dict[str, Any]:
+        """
+        统计一个会话的占用，超出预算时移出环形缓冲中最旧的条目
+
+        Returns:
+            {"bytes": 会话总字节数, "keys": 各key的字节数, "evicted": 本次移出的条目数}
+        """
+        for key in self.ring_sizes:
+            if key in state:
+                self.ring(state, key, user_id)
+
+        sizes = {key: value_bytes(value) for key, value in state.items()}
+        total = sum(sizes.values())
+
+        evicted = 0
+        if total > self.budget_bytes:
+            with self._lock:
+                self.over_budget += 1
+            for key in self.ring_sizes:
+                buffer = state.get(key)
+                if not buffer:
+                    continue
+                removed = []
+                while buffer and total > self.budget_bytes:
+                    item = buffer.popleft()
+                    total -= value_bytes(item)
+                    removed.append(item)
+                self._spill(user_id, key, removed)
+                evicted += len(removed)
+                sizes[key] = value_bytes(buffer)
+                total = sum(sizes.values())
+                if total <= self.budget_bytes:
+                    break
+
+        now = time.time()
+        with self._lock:
+            self.measurements += 1
+            self.evicted += evicted
+            self._sessions[session_id] = {"bytes": total, "keys": sizes, "last_seen": now}
+            if self.measurements % 256 == 0:
+                self._forget_stale(now)
+
+        return {"bytes": total, "keys": sizes, "evicted": evicted}
+
+    def _forget_stale(self, now: float):
+        """清理长时间没有运行的会话（调用方持有锁）"""
+        for stale_id in [sid for sid, s in self._sessions.items() if now - s["last_seen"] > self.forget_seconds]:
+            del self._sessions[stale_id]
+
+    def forget(self, session_id: str):
+        """会话结束后不再统计"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """所有会话的占用汇总"""
+        now = time.time()
+        with self._lock:
+            self._forget_stale(now)
+            sessions = list(self._sessions.values())
+            by_key: Dict[str, int] = {}
+            for session in sessions:
+                for key, size in session["keys"].items():
+                    by_key[key] = by_key.get(key, 0) + size
+            idle = [s for s in sessions if now - s["last_seen"] > self.idle_seconds]
+            total_bytes = sum(s["bytes"] for s in sessions)
+            return {
+                "sessions": len(sessions),
+                "idle_sessions": len(idle),
+                "total_bytes": total_bytes,
+                "idle_bytes": sum(s["bytes"] for s in idle),
+                "avg_bytes": round(total_bytes / len(sessions)) if sessions else 0,
+                "max_bytes": max((s["bytes"] for s in sessions), default=0),
+                "budget_bytes": self.budget_bytes,
+                "largest_keys": dict(sorted(by_key.items(), key=lambda kv: kv[1], reverse=True)[:5]),
+                "measurements": self.measurements,
+                "over_budget": self.over_budget,
+                "trimmed": self.trimmed,
+                "evicted": self.evicted,
+                "spilled": self.spilled
+            }
+
+
+# 单例实例（整个进程共享）
+_budget_instance = None
+_budget_lock = threading.Lock()
+
+def get_session_budget() -> SessionBudget:
+    """获取会话预算管理器（单例模式）"""
+    global _budget_instance
+    instance = _budget_instance
+    if instance is None:
+        with _budget_lock:
+            if _budget_instance is None:
+                _budget_instance = SessionBudget()
+            instance = _budget_instance
+    return instance
+
+
+def enforce_session_budget() -> Dict[str, Any]:
+    """统计当前Streamlit会话的状态大小并执行淘汰策略（每个页面开始时调用一次）"""
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    session_id = ctx.session_id if ctx is not None else "local"
+    return get_session_budget().enforce(session_id, st.session_state, st.session_state.get('user_id', ''))
+
+
+# 性能测试
+def benchmark_session_budget(saves: int = 1000, sessions: int = 1000):
+    """
+    反复保存记录时会话状态的大小，以及每次页面运行执行预算检查的耗时
+
+    之前每次点击"保存记录"都在会话的列表里追加一条，会话状态随点击次数线性增长。
+    """
+    import tempfile
+
+    print("🧮 会话状态预算")
+    print("=" * 60)
+
+    budget = SessionBudget(spill_store=SpillStore(os.path.join(tempfile.mkdtemp(), "spill.db")))
+    record = {'task': "学习任务", 'time': "2026-01-01 20:00", 'steps': 6}
+    base_state = {
+        'user_id': "0" * 32,
+        'user_state': {'current_activity': "躺在床上刷抖音", 'target_task': "复习期末考试",
+                       'mood': "procrastinating", 'difficulty': 8},
+        'analysis_id': "f" * 40,
+        'current_step': 6
+    }
+
+    unbounded = dict(base_state, completed_tasks=[])
+    bounded = dict(base_state)
+    for _ in range(saves):
+        unbounded['completed_tasks'].append(dict(record))
+        budget.append(bounded, 'completed_tasks', dict(record), base_state['user_id'])
+    print(f"   💾 保存{saves}次: 无上限列表 {value_bytes(unbounded)} 字节 · 环形缓冲 {value_bytes(bounded)} 字节")
+
+    rounds = 2000
+    start_time = time.perf_counter()
+    for i in range(rounds):
+        budget.enforce(f"session-{i % sessions}", bounded, base_state['user_id'])
+    enforce_us = (time.perf_counter() - start_time) * 1_000_000 / rounds
+    print(f"   ⏱️ 每次页面运行的预算检查: {enforce_us:.1f}µs")
+    print(f"   📊 {budget.get_metrics()}")
+    return {"unbounded_bytes": value_bytes(unbounded), "bounded_bytes": value_bytes(bounded), "enforce_us": enforce_us}
+
+
+# 测试函数
+def test_session_budget():
+    """测试环形缓冲、超出预算时的淘汰和转存"""
+    import tempfile
+
+    print("🧪 测试会话状态预算")
+    print("=" * 60)
+
+    spill_store = SpillStore(os.path.join(tempfile.mkdtemp(), "spill.db"))
+    budget = SessionBudget(budget_bytes=2048, ring_sizes={"completed_tasks": 5}, spill_store=spill_store)
+
+    # 旧版本会话中的list：转换为环形缓冲，超出的部分转存
+    state = {'completed_tasks': [{'task': f"任务{i}"} for i in range(8)]}
+    report = budget.enforce("s1", state, "alice")
+    assert isinstance(state['completed_tasks'], deque) and len(state['completed_tasks']) == 5
+    assert [item['task'] for item in state['completed_tasks']] == [f"任务{i}" for i in range(3, 8)]
+    assert spill_store.count("alice", "completed_tasks") == 3 and report['evicted'] == 0
+
+    # 缓冲已满时追加：最旧的一条转存
+    budget.append(state, 'completed_tasks', {'task': "任务8"}, "alice")
+    assert state['completed_tasks'][0]['task'] == "任务4"
+    assert spill_store.load("alice", "completed_tasks", limit=1) == [{'task': "任务3"}]
+
+    # 超出预算：移出最旧的条目直到回到预算以内
+    state = {'big': "x" * 1500, 'completed_tasks': deque([{'note': str(i) * 200} for i in range(5)], maxlen=5)}
+    report = budget.enforce("s2", state, "bob")
+    assert report['bytes'] <= budget.budget_bytes and report['evicted'] > 0, report
+    assert spill_store.count("bob", "completed_tasks") == report['evicted']
+
+    metrics = budget.get_metrics()
+    assert metrics['sessions'] == 2 and metrics['over_budget'] == 1
+    assert metrics['total_bytes'] == sum(s['bytes'] for s in budget._sessions.values())
+    budget.forget("s2")
+    assert budget.get_metrics()['sessions'] == 1
+    print(f"   📊 {metrics}")
+
+    print("\n" + "=" * 60)
+    print("✅ 会话状态预算测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_session_budget()
+    benchmark_session_budget()
@@ -0,0 +1,212 @@
+"""
+shadow.py - 影子模式
+用户始终拿到本地模拟器的结果；按采样比例把同一请求异步发给远程后端，
+记录远程结果的耗时、有效性以及与模拟器结果的结构差异，用于上线前评估
+"""
+
+import os
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+DATA_DIR = os.getenv("TASKSPARK_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+
+
+def _structure(result: Dict[str, Any]) -> Dict[str, Any]:
+    """提取用于对比的结构特征"""
+    task_analysis = result.get("task_analysis", {})
+    return {
+        "task_type": task_analysis.get("task_type"),
+        "step_count": len(result.get("micro_steps", [])),
+        "estimated_time": task_analysis.get("estimated_time")
+    }
+
+
+class ShadowRunner:
+    """
+    影子请求执行器
+
+    影子请求在固定大小的后台线程池中执行，排队数量有上限，
+    池子满了直接丢弃新的影子请求，前台路径只多一次采样判断和入队。
+    """
+
+    def __init__(self, backend, validator, sample_rate: float = 0.1, max_workers: int = 2,
+                 max_pending: int = 8, log_path: Optional[str] = None):
+        """
+        Args:
+            backend: 被评估的远程后端
+            validator: 结果校验器（与前台使用的校验器分开统计）
+            sample_rate: 进入影子评估的请求比例（0-1）
+            max_workers: 后台线程数
+            max_pending: 同时在途（执行中+排队）的影子请求上限
+            log_path: 评估记录文件（JSON Lines），默认 data/shadow_log.jsonl
+        """
+        self.backend = backend
+        self.validator = validator
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.log_path = log_path or os.path.join(DATA_DIR, "shadow_log.jsonl")
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shadow")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+
+        # 由分析器注入的用量账本，影子调用同样记账
+        self.ledger = None
+
+    def submit(self, inputs: Dict[str, Any], primary_result: Dict[str, Any]) -> bool:
+        """按采样比例提交影子请求，不会阻塞调用方；返回是否真正提交"""
+        if random.random() >= self.sample_rate:
+            return False
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending += 1
+            self.submitted += 1
+
+        self._executor.submit(self._run, dict(inputs), _structure(primary_result), time.perf_counter())
+        return True
+
+    def _run(self, inputs: Dict[str, Any], primary: Dict[str, Any], submitted_at: float):
+        """在后台线程中执行一次影子请求并写入评估记录"""
+        usage = None
+        record = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "backend": self.backend.name,
+            "inputs": inputs,
+            "primary": primary
+        }
+        start_time = time.perf_counter()
+        try:
+            result = self.backend.analyze_task(**inputs)
+            record["latency_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
+            usage = result.get("_meta", {}).get("usage")
+
+            validated = self.validator.validate(result)
+            shadow = _structure(validated)
+            record["shadow"] = shadow
+            record["valid"] = "repaired_fields" not in validated["_meta"]
+            record["repaired_fields"] = validated["_meta"].get("repaired_fields", [])
+            record["diff"] = {key: [primary[key], shadow[key]] for key in primary if primary[key] != shadow[key]}
+        except Exception as e:
+            record["latency_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
+            record["valid"] = False
+            record["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.completed += 1
+
+        if self.ledger is not None and usage is not None:
+            usage = dict(usage, backend=f"shadow:{usage['backend']}")
+            usage["queue_ms"] = round((start_time - submitted_at) * 1000, 2)
+            usage["total_ms"] = round(usage["queue_ms"] + record["latency_ms"], 2)
+            self.ledger.record(usage)
+        self._append(record)
+
+    def _append(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """影子执行器的运行指标"""
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "dropped": self.dropped,
+                "pending": self._pending
+            }
+
+    def summarize(self) -> Dict[str, Any]:
+        """汇总评估记录：有效率、耗时分位数、各结构字段的一致率"""
+        if not os.path.exists(self.log_path):
+            return {"records": 0}
+
+        with open(self.log_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        if not records:
+            return {"records": 0}
+
+        latencies = sorted(r["latency_ms"] for r in records)
+        compared = [r for r in records if "diff" in r]
+
+        def percentile(p):
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+
+        return {
+            "records": len(records),
+            "valid_rate": round(sum(1 for r in records if r.get("valid")) / len(records), 3),
+            "error_rate": round(sum(1 for r in records if "error" in r) / len(records), 3),
+            "latency_p50_ms": percentile(0.5),
+            "latency_p95_ms": percentile(0.95),
+            "match_rate": {
+                key: round(sum(1 for r in compared if key not in r["diff"]) / len(compared), 3) if compared else None
+                for key in ("task_type", "step_count", "estimated_time")
+            }
+        }
+
+    def shutdown(self, wait: bool = True):
+        """关闭后台线程池"""
+        self._executor.shutdown(wait=wait)
+
+
+# 测试函数
+def test_shadow_runner():
+    """测试影子模式不会拖慢前台路径"""
+    import tempfile
+    from .ai_simulator import AISimulator
+    from .result_schema import ResultValidator
+
+    print("🧪 测试影子模式")
+    print("=" * 60)
+
+    class SlowBackend:
+        name = "remote:slow"
+
+        def __init__(self):
+            self.ai = AISimulator()
+
+        def analyze_task(self, **inputs):
+            time.sleep(0.2)
+            return self.ai.analyze_task(**inputs)
+
+    log_path = os.path.join(tempfile.mkdtemp(), "shadow_log.jsonl")
+    runner = ShadowRunner(SlowBackend(), ResultValidator(), sample_rate=1.0, max_workers=1, max_pending=2, log_path=log_path)
+
+    inputs = {"current_state": "躺在床上刷抖音", "target_task": "复习期末考试", "mood": "tired", "difficulty": 5}
+    primary = AISimulator().analyze_task(**inputs)
+
+    start_time = time.perf_counter()
+    accepted = [runner.submit(inputs, primary) for _ in range(5)]
+    submit_ms = (time.perf_counter() - start_time) * 1000
+    assert submit_ms < 50, f"提交影子请求不应阻塞: {submit_ms:.1f}ms"
+    assert accepted.count(True) == 2 and runner.dropped == 3, "超过在途上限的影子请求应被丢弃"
+
+    runner.shutdown()
+    summary = runner.summarize()
+    assert summary["records"] == 2 and summary["valid_rate"] == 1.0
+    print(f"   ⏱️ 提交5个影子请求耗时: {submit_ms:.2f}ms")
+    print(f"   📊 {summary}")
+
+    print("\n" + "=" * 60)
+    print("✅ 影子模式测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_shadow_runner()
@@ -0,0 +1,238 @@
+"""
+speculation.py - 推测执行
+首页输入齐全后先在后台开始分析，用户点击“开始分析”时大多可以直接拿到结果。
+每个会话只保留一份推测任务，以输入内容为键；输入变化后旧任务被取消或丢弃，并计入浪费的计算量。
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from typing import Dict, Any, Optional, Callable
+
+
+class SpeculativeExecutor:
+    """
+    推测执行器
+
+    speculate() 先等待一个防抖时间，期间输入再次变化只会重新计时，不会真正开始计算；
+    take() 取走与当前输入一致的结果，还在计算中时等待其完成，不一致时算作未命中。
+    """
+
+    def __init__(self, analyze_fn: Callable[..., Dict[str, Any]], max_workers: int = 2,
+                 debounce_seconds: float = 0.3, ttl_seconds: float = 300, max_sessions: int = 1000):
+        """
+        Args:
+            analyze_fn: 分析函数，参数与 TaskAnalyzer.analyze_task 相同
+            max_workers: 后台线程数
+            debounce_seconds: 输入稳定多久后才开始计算（秒）
+            ttl_seconds: 推测结果的有效期（秒），过期未取走的结果被丢弃
+            max_sessions: 最多同时保留推测结果的会话数，超出时丢弃最早的
+        """
+        self.analyze_fn = analyze_fn
+        self.debounce_seconds = debounce_seconds
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculate")
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+
+        self.scheduled = 0
+        self.debounced = 0
+        self.launched = 0
+        self.cancelled = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+        self.wasted_compute_ms = 0.0
+        self.used_compute_ms = 0.0
+        self.hit_wait_ms = 0.0
+
+    @staticmethod
+    def make_key(inputs: Dict[str, Any]) -> str:
+        """输入内容的键"""
+        return json.dumps(inputs, sort_keys=True, ensure_ascii=False)
+
+    def speculate(self, session_id: str, inputs: Dict[str, Any]) -> bool:
+        """为会话安排一次推测分析；输入与当前推测相同时什么也不做，返回是否新安排了任务"""
+        key = self.make_key(inputs)
+        with self._lock:
+            self._sweep()
+            entry = self._entries.get(session_id)
+            if entry is not None and entry["key"] == key:
+                return False
+            if entry is not None:
+                self._discard(entry)
+
+            entry = {
+                "key": key,
+                "inputs": dict(inputs),
+                "created_at": time.monotonic(),
+                "timer": None,
+                "future": None,
+                "compute_ms": None,
+                "discarded": False
+            }
+            entry["timer"] = threading.Timer(self.debounce_seconds, self._launch, args=(session_id, entry))
+            entry["timer"].daemon = True
+            self._entries[session_id] = entry
+            self.scheduled += 1
+        entry["timer"].start()
+        return True
+
+    def _launch(self, session_id: str, entry: Dict[str, Any]):
+        """防抖时间结束，输入没有再变化时提交给线程池"""
+        with self._lock:
+            if self._entries.get(session_id) is not entry:
+                return
+            entry["timer"] = None
+            entry["future"] = self._executor.submit(self._run, entry)
+            self.launched += 1
+
+    def _run(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        start_time = time.perf_counter()
+        try:
+            return self.analyze_fn(**entry["inputs"])
+        finally:
+            with self._lock:
+                entry["compute_ms"] = (time.perf_counter() - start_time) * 1000
+                # 计算期间已被丢弃的任务，结束时才知道浪费了多少
+                if entry["discarded"]:
+                    self.wasted += 1
+                    self.wasted_compute_ms += entry["compute_ms"]
+
+    def _discard(self, entry: Dict[str, Any]):
+        """丢弃一份推测任务（调用方持有锁）"""
+        entry["discarded"] = True
+        if entry["timer"] is not None:
+            entry["timer"].cancel()
+            self.debounced += 1
+        elif entry["future"].cancel():
+            self.cancelled += 1
+        elif entry["compute_ms"] is not None:
+            self.wasted += 1
+            self.wasted_compute_ms += entry["compute_ms"]
+
+    def _sweep(self):
+        """丢弃过期的结果，并把会话数控制在上限内（调用方持有锁）"""
+        now = time.monotonic()
+        for session_id in [sid for sid, e in self._entries.items() if now - e["created_at"] > self.ttl_seconds]:
+            self._discard(self._entries.pop(session_id))
+        while len(self._entries) >= self.max_sessions:
+            oldest = min(self._entries, key=lambda sid: self._entries[sid]["created_at"])
+            self._discard(self._entries.pop(oldest))
+
+    def take(self, session_id: str, inputs: Dict[str, Any], timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        取走与输入一致的推测结果
+
+        还在计算中时最多等待timeout秒；没有对应结果、还在防抖、计算失败或超时都返回None，
+        由调用方直接分析。
+        """
+        key = self.make_key(inputs)
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None or entry["key"] != key or entry["future"] is None:
+                if entry is not None:
+                    self._discard(entry)
+                self.misses += 1
+                return None
+            future = entry["future"]
+
+        wait_start = time.perf_counter()
+        try:
+            result = future.result(timeout=timeout)
+        except (CancelledError, Exception):
+            with self._lock:
+                entry["discarded"] = True
+                if entry["compute_ms"] is not None:
+                    self.wasted += 1
+                    self.wasted_compute_ms += entry["compute_ms"]
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.used_compute_ms += entry["compute_ms"]
+            self.hit_wait_ms += (time.perf_counter() - wait_start) * 1000
+        return result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """命中率和浪费的计算量"""
+        with self._lock:
+            taken = self.hits + self.misses
+            total_compute = self.used_compute_ms + self.wasted_compute_ms
+            return {
+                "scheduled": self.scheduled,
+                "debounced": self.debounced,
+                "launched": self.launched,
+                "cancelled": self.cancelled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / taken, 3) if taken else None,
+                "wasted": self.wasted,
+                "wasted_compute_ms": round(self.wasted_compute_ms, 2),
+                "wasted_compute_ratio": round(self.wasted_compute_ms / total_compute, 3) if total_compute else None,
+                "avg_hit_wait_ms": round(self.hit_wait_ms / self.hits, 2) if self.hits else None,
+                "pending_sessions": len(self._entries)
+            }
+
+    def shutdown(self, wait: bool = True):
+        """关闭后台线程池"""
+        self._executor.shutdown(wait=wait)
+
+
+# 测试函数
+def test_speculative_executor():
+    """用一个耗时300ms的模拟远程后端测试推测执行"""
+    print("🧪 测试推测执行")
+    print("=" * 60)
+
+    def slow_analyze(current_state, target_task, mood, difficulty):
+        time.sleep(0.3)
+        return {"inputs": [current_state, target_task, mood, difficulty]}
+
+    executor = SpeculativeExecutor(slow_analyze, debounce_seconds=0.05)
+    inputs = {"current_state": "躺在床上刷抖音", "target_task": "复习期末考试", "mood": "tired", "difficulty": 5}
+
+    # 1. 输入齐全后过一会儿才点击：直接拿到结果
+    executor.speculate("a", inputs)
+    time.sleep(0.5)
+    start_time = time.perf_counter()
+    assert executor.take("a", inputs) is not None
+    print(f"   ⚡ 命中：点击后 {(time.perf_counter() - start_time) * 1000:.1f}ms 拿到结果（直接分析需要300ms）")
+
+    # 2. 防抖期间输入变化：旧任务不会开始计算
+    executor.speculate("b", inputs)
+    executor.speculate("b", dict(inputs, difficulty=6))
+    time.sleep(0.5)
+    assert executor.take("b", dict(inputs, difficulty=6)) is not None
+
+    # 3. 计算完成后输入又变了：旧结果被丢弃，计入浪费
+    executor.speculate("c", inputs)
+    time.sleep(0.5)
+    executor.speculate("c", dict(inputs, mood="anxious"))
+    time.sleep(0.1)
+
+    # 4. 点击时推测还在计算中：等待它完成而不是重新开始
+    start_time = time.perf_counter()
+    assert executor.take("c", dict(inputs, mood="anxious")) is not None
+    print(f"   ⏳ 命中（等待中的推测）：{(time.perf_counter() - start_time) * 1000:.1f}ms")
+
+    # 5. 点击时的输入和推测的不一致：未命中
+    executor.speculate("d", inputs)
+    assert executor.take("d", dict(inputs, target_task="写报告")) is None
+
+    executor.shutdown()
+    metrics = executor.get_metrics()
+    assert metrics["hits"] == 3 and metrics["misses"] == 1 and metrics["debounced"] == 2 and metrics["wasted"] == 1
+    print(f"   📊 {metrics}")
+
+    print("\n" + "=" * 60)
+    print("✅ 推测执行测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_speculative_executor()
@@ -0,0 +1,82 @@
+"""
+sqlite_store.py - SQLite存储的公共部分
+所有持久化数据默认放在同一个数据库文件中（WAL模式），每个线程使用自己的连接。
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+
+DATA_DIR = os.getenv("TASKSPARK_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+DB_PATH = os.getenv("TASKSPARK_DB_PATH", os.path.join(DATA_DIR, "taskspark.db"))
+
+# 每个存储最多保留的空闲连接数
+MAX_IDLE_CONNECTIONS = 8
+
+
+class _Lease:
+    """线程持有的连接；线程结束时放回空闲池，由下一次运行的线程直接复用"""
+
+    __slots__ = ("conn", "idle")
+
+    def __init__(self, conn: sqlite3.Connection, idle: queue.Queue):
+        self.conn = conn
+        self.idle = idle
+
+    def __del__(self):
+        # 事务没有结束的连接不再复用
+        if self.conn.in_transaction:
+            self.conn.close()
+            return
+        try:
+            self.idle.put_nowait(self.conn)
+        except queue.Full:
+            self.conn.close()
+
+
+class SQLiteStore:
+    """
+    SQLite存储基类
+
+    Streamlit每次运行脚本都在新的线程中，连接按线程分配：
+    线程结束后连接回到空闲池，下一次运行不必重新打开数据库；
+    WAL模式下读取不会被写入阻塞。
+    """
+
+    # 子类的建表语句
+    SCHEMA = ""
+
+    def __init__(self, path: str = DB_PATH):
+        """
+        Args:
+            path: 数据库文件路径
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._idle: queue.Queue = queue.Queue(maxsize=MAX_IDLE_CONNECTIONS)
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """当前线程的连接：优先复用空闲池中的连接，没有时新建"""
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+                # 只对新建的数据库生效（必须在建表和切换WAL之前），之后维护任务可以分步回收空闲页
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                with self._lock:
+                    self.connections_opened += 1
+            lease = self._local.lease = _Lease(conn, self._idle)
+        return lease.conn
+
+    def db_bytes(self) -> int:
+        """数据库文件大小（不含WAL文件）"""
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
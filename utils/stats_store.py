@@ -0,0 +1,369 @@
+"""
+stats_store.py - 统计页的汇总表
+每次开始一个任务、完成一步时，直接在汇总表上累加（按天、按任务类型/心情/难度各一行），
+统计页只读取汇总行：行数只和天数、分类数有关，记录增长到几百万条时打开统计页的耗时也不变。
+每一次执行在 stats_runs 中有一行：刷新页面、按恢复链接继续或重复点击时，同一次执行只计一次开始、每一步只计一次完成。
+"""
+
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from .event_log import TASK_TYPES, encode_task_type
+from .sqlite_store import SQLiteStore, DB_PATH
+from .write_behind import WriteBehind, WRITE_BEHIND_ENABLED
+
+# 汇总的计数列
+COUNTERS = ("tasks_started", "tasks_completed", "steps_completed", "completed_task_steps")
+
+# 分类维度
+DIMENSIONS = ("task_type", "mood", "difficulty")
+
+# 统计页显示的天数
+STATS_DAYS = 30
+
+
+def day_of(ts: float) -> str:
+    """时间戳所在的日期（本地时间）"""
+    return time.strftime("%Y-%m-%d", time.localtime(ts))
+
+
+def rates(counts: Dict[str, int]) -> Dict[str, Any]:
+    """计数加上完成率和平均步骤数"""
+    started, completed = counts["tasks_started"], counts["tasks_completed"]
+    return dict(counts,
+                completion_rate=round(completed / started, 3) if started else None,
+                avg_steps_per_task=round(counts["completed_task_steps"] / completed, 1) if completed else None)
+
+
+class StatsStore(SQLiteStore):
+    """
+    按用户维护的统计汇总
+
+    - stats_daily: 每个用户每天一行
+    - stats_breakdown: 每个用户每个分类（任务类型、心情、难度）一行
+    - stats_runs: 每个用户每次执行一行（已完成到第几步、是否做完），保证重复的记录不会重复累加
+    记录放进后台写入队列，一批记录合并后在一个事务中累加所有相关的行。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        user_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        tasks_started INTEGER NOT NULL DEFAULT 0,
+        tasks_completed INTEGER NOT NULL DEFAULT 0,
+        steps_completed INTEGER NOT NULL DEFAULT 0,
+        completed_task_steps INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stats_breakdown (
+        user_id TEXT NOT NULL,
+        dimension TEXT NOT NULL,
+        value TEXT NOT NULL,
+        tasks_started INTEGER NOT NULL DEFAULT 0,
+        tasks_completed INTEGER NOT NULL DEFAULT 0,
+        steps_completed INTEGER NOT NULL DEFAULT 0,
+        completed_task_steps INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, dimension, value)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stats_runs (
+        user_id TEXT NOT NULL,
+        run_id INTEGER NOT NULL,
+        started_at REAL NOT NULL,
+        steps_done INTEGER NOT NULL DEFAULT 0,
+        finished INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, run_id)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str = DB_PATH, write_behind: bool = WRITE_BEHIND_ENABLED):
+        """
+        Args:
+            path: 数据库文件路径
+            write_behind: 是否后台批量写入（False时每次记录同步写入）
+        """
+        super().__init__(path)
+        self.writer = WriteBehind("stats", self._write_batch) if write_behind else None
+
+        self.records = 0
+        self.duplicates = 0
+        self.record_ms = 0.0
+        self.summary_reads = 0
+
+    @staticmethod
+    def dimensions_of(run: Dict[str, Any]) -> Dict[str, str]:
+        """一次执行所属的分类（任务类型按事件日志的编码归类，不认识的归为"其他"）"""
+        return {
+            "task_type": TASK_TYPES[encode_task_type(run.get('task_type', ''))],
+            "mood": run.get('mood') or '',
+            "difficulty": str(int(run.get('difficulty') or 0))
+        }
+
+    @staticmethod
+    def _first_time(conn, user_id: str, run_id: Optional[int], now: float, steps_done: int = 0,
+                    finished: bool = False) -> bool:
+        """
+        这次执行是第一次记到这一步吗（调用方在事务中）
+
+        开始：执行还没有记录过；完成一步：这一步之前没有记过、执行也还没做完。
+        没有执行标识的记录（批量导入、性能测试）不做检查。
+        """
+        if not run_id:
+            return True
+        if steps_done == 0:
+            return conn.execute("INSERT OR IGNORE INTO stats_runs (user_id, run_id, started_at) VALUES (?, ?, ?)",
+                                (user_id, run_id, now)).rowcount == 1
+        return conn.execute(
+            "INSERT INTO stats_runs (user_id, run_id, started_at, steps_done, finished) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id, run_id) DO UPDATE SET steps_done = excluded.steps_done, finished = excluded.finished "
+            "WHERE steps_done < excluded.steps_done AND finished = 0",
+            (user_id, run_id, now, steps_done, int(finished))
+        ).rowcount == 1
+
+    def _write_batch(self, items: List[Tuple[str, str, Dict[str, str], Dict[str, int], Optional[int], float]]):
+        """
+        一批累加在一个事务中写入
+
+        先按 stats_runs 去掉同一次执行重复的记录，同一行的多次累加再在内存中合并，一批记录只更新涉及的行各一次。
+        """
+        start_time = time.perf_counter()
+        daily: Dict[Tuple[str, str], List[int]] = {}
+        breakdown: Dict[Tuple[str, str, str], List[int]] = {}
+        columns = ", ".join(COUNTERS)
+        placeholders = ", ".join("?" for _ in COUNTERS)
+        updates = ", ".join(f"{name} = {name} + excluded.{name}" for name in COUNTERS)
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            skipped = 0
+            for user_id, day, dimensions, deltas, run_id, now in items:
+                if not self._first_time(conn, user_id, run_id, now, deltas.get("step", 0),
+                                        deltas.get("tasks_completed", 0) > 0):
+                    skipped += 1
+                    continue
+                increments = [deltas.get(name, 0) for name in COUNTERS]
+                for key, rows in [((user_id, day), daily)] + [((user_id, dimension, value), breakdown)
+                                                               for dimension, value in dimensions.items()]:
+                    row = rows.setdefault(key, [0] * len(COUNTERS))
+                    for i, increment in enumerate(increments):
+                        row[i] += increment
+
+            conn.executemany(
+                f"INSERT INTO stats_daily (user_id, day, {columns}) VALUES (?, ?, {placeholders}) "
+                f"ON CONFLICT (user_id, day) DO UPDATE SET {updates}",
+                [key + tuple(row) for key, row in daily.items()]
+            )
+            conn.executemany(
+                f"INSERT INTO stats_breakdown (user_id, dimension, value, {columns}) VALUES (?, ?, ?, {placeholders}) "
+                f"ON CONFLICT (user_id, dimension, value) DO UPDATE SET {updates}",
+                [key + tuple(row) for key, row in breakdown.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._lock:
+            self.records += len(items)
+            self.duplicates += skipped
+            self.record_ms += (time.perf_counter() - start_time) * 1000
+
+    def _increment(self, user_id: str, run: Dict[str, Any], deltas: Dict[str, int], now: Optional[float] = None):
+        """在当天的行和各分类的行上累加计数（后台批量写入，或立即写入）"""
+        now = now or time.time()
+        item = (user_id, day_of(now), self.dimensions_of(run), deltas, run.get('id'), now)
+        if self.writer is not None:
+            self.writer.submit(item)
+        else:
+            self._write_batch([item])
+
+    def flush(self):
+        """等待排队中的累加写入完成"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def record_started(self, user_id: str, run: Dict[str, Any], now: Optional[float] = None):
+        """开始一次执行（一个任务）；同一次执行（run['id']）重复记录时只计一次"""
+        self._increment(user_id, run, {"tasks_started": 1}, now)
+
+    def record_step_completed(self, user_id: str, run: Dict[str, Any], step_index: int, now: Optional[float] = None):
+        """完成一步；完成最后一步时同时记为完成一个任务。同一步重复记录、执行已做完时不再累加"""
+        deltas = {"steps_completed": 1, "step": step_index + 1}
+        if step_index + 1 >= run['total_steps']:
+            deltas.update(tasks_completed=1, completed_task_steps=run['total_steps'])
+        self._increment(user_id, run, deltas, now)
+
+    def summary(self, user_id: str, days: int = STATS_DAYS, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        统计页需要的全部数据（只读取汇总行）
+
+        Returns:
+            totals: 全部时间的计数、完成率和平均步骤数
+            daily: 最近days天中有记录的日期及其计数（按日期排序）
+            task_type / mood / difficulty: 各分类的计数和完成率
+        """
+        now = now or time.time()
+        # 先写完排队中的累加（通常为空，立即返回），刚完成的任务马上能看到
+        self.flush()
+        conn = self._connect()
+        daily = conn.execute(
+            f"SELECT day, {', '.join(COUNTERS)} FROM stats_daily WHERE user_id = ? AND day > ? ORDER BY day",
+            (user_id, day_of(now - days * 86400))
+        ).fetchall()
+        breakdown = conn.execute(
+            f"SELECT dimension, value, {', '.join(COUNTERS)} FROM stats_breakdown WHERE user_id = ?", (user_id,)
+        ).fetchall()
+        with self._lock:
+            self.summary_reads += 1
+
+        result: Dict[str, Any] = {dimension: {} for dimension in DIMENSIONS}
+        for dimension, value, *counts in breakdown:
+            result[dimension][value] = rates(dict(zip(COUNTERS, counts)))
+        # 每个任务在每个维度下都恰好计入一行，任一维度的合计就是总数
+        totals = {name: sum(row[name] for row in result["task_type"].values()) for name in COUNTERS}
+        result["totals"] = rates(totals)
+        result["daily"] = [dict(zip(("day",) + COUNTERS, row)) for row in daily]
+        return result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """记录次数、平均每条的写入耗时和汇总表行数"""
+        self.flush()
+        conn = self._connect()
+        with self._lock:
+            return {
+                "records": self.records,
+                "avg_record_ms": round(self.record_ms / self.records, 4) if self.records else None,
+                "duplicates": self.duplicates,
+                "summary_reads": self.summary_reads,
+                "daily_rows": conn.execute("SELECT COUNT(*) FROM stats_daily").fetchone()[0],
+                "breakdown_rows": conn.execute("SELECT COUNT(*) FROM stats_breakdown").fetchone()[0]
+            }
+
+
+# 单例实例（整个进程共享）
+_store_instance = None
+_store_lock = threading.Lock()
+
+def get_stats_store() -> StatsStore:
+    """获取统计汇总存储（单例模式）"""
+    global _store_instance
+    instance = _store_instance
+    if instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                _store_instance = StatsStore()
+            instance = _store_instance
+    return instance
+
+
+def simulate_user(store: StatsStore, user_id: str, tasks: int, start_ts: float, seed: int = 7) -> Dict[str, int]:
+    """模拟一个用户在一年内开始、完成任务（性能测试用），返回写入的记录数"""
+    import random
+
+    rng = random.Random(seed)
+    written = 0
+    for i in range(tasks):
+        now = start_ts + i * 365 * 86400 / tasks
+        run = {'task_type': rng.choice(TASK_TYPES[1:]), 'mood': rng.choice(("tired", "anxious", "neutral")),
+               'difficulty': rng.randint(1, 10), 'total_steps': rng.randint(4, 8)}
+        store.record_started(user_id, run, now)
+        done = run['total_steps'] if rng.random() < 0.7 else rng.randint(0, run['total_steps'] - 1)
+        for step in range(done):
+            store.record_step_completed(user_id, run, step, now)
+        written += 1 + done
+    return {"records": written}
+
+
+# 性能测试
+def benchmark_stats_summary(task_counts=(100, 10000, 100000)):
+    """统计页读取汇总的耗时：记录数增长时保持不变"""
+    import os
+    import tempfile
+
+    print("⏱️ 统计汇总性能测试")
+    print("=" * 60)
+
+    store = StatsStore(os.path.join(tempfile.mkdtemp(), "stats.db"))
+    start_ts = time.time() - 365 * 86400
+    results = {}
+    recorded = 0
+    for i, tasks in enumerate(task_counts):
+        user_id = f"user-{i}"
+        recorded += simulate_user(store, user_id, tasks, start_ts)["records"]
+
+        store.summary(user_id)
+        rounds = 200
+        start_time = time.perf_counter()
+        for _ in range(rounds):
+            summary = store.summary(user_id)
+        summary_ms = (time.perf_counter() - start_time) * 1000 / rounds
+        results[tasks] = {"summary_ms": round(summary_ms, 3), "tasks_started": summary["totals"]["tasks_started"]}
+        print(f"   {tasks:>6}个任务: 读取汇总 {summary_ms:.3f}ms · 完成率 {summary['totals']['completion_rate']}"
+              f" · 平均 {summary['totals']['avg_steps_per_task']} 步/任务")
+
+    metrics = store.get_metrics()
+    print(f"   ✍️ 每次记录 {metrics['avg_record_ms']}ms（共{recorded}次）")
+    print(f"   📊 {metrics}")
+    return results
+
+
+# 测试函数
+def test_stats_store():
+    """测试累加、完成率、平均步骤数和按天统计"""
+    import os
+    import tempfile
+
+    print("🧪 测试统计汇总")
+    print("=" * 60)
+
+    store = StatsStore(os.path.join(tempfile.mkdtemp(), "stats.db"))
+    now = time.time()
+    study = {'task_type': "学习", 'mood': "tired", 'difficulty': 7, 'total_steps': 3}
+    work = {'task_type': "工作任务", 'mood': "anxious", 'difficulty': 4, 'total_steps': 5}
+
+    store.record_started("alice", study, now - 86400)
+    for step in range(3):
+        store.record_step_completed("alice", study, step, now - 86400)
+    store.record_started("alice", work, now)
+    store.record_step_completed("alice", work, 0, now)
+    store.record_started("bob", study, now)
+
+    summary = store.summary("alice", now=now)
+    assert summary["totals"]["tasks_started"] == 2 and summary["totals"]["tasks_completed"] == 1
+    assert summary["totals"]["completion_rate"] == 0.5 and summary["totals"]["avg_steps_per_task"] == 3.0
+    assert summary["task_type"]["学习"]["completion_rate"] == 1.0
+    assert summary["task_type"]["其他"]["tasks_started"] == 1, "不认识的任务类型归为其他"
+    assert summary["mood"]["anxious"]["completion_rate"] == 0.0 and summary["difficulty"]["7"]["steps_completed"] == 3
+    assert [row["tasks_completed"] for row in summary["daily"]] == [1, 0]
+    assert store.summary("alice", days=0, now=now)["daily"] == []
+    assert store.summary("bob", now=now)["totals"]["tasks_started"] == 1, "各用户的统计互不影响"
+    assert store.summary("nobody", now=now)["totals"]["completion_rate"] is None
+
+    # 同一次执行：刷新、恢复链接重新记开始，最后一步连点两次，都只计一次
+    run = {'id': 42, 'task_type': "家务", 'mood': "tired", 'difficulty': 3, 'total_steps': 2}
+    for _ in range(3):
+        store.record_started("carol", run, now)
+    store.record_step_completed("carol", run, 0, now)
+    store.record_step_completed("carol", run, 0, now)
+    store.record_started("carol", run, now)
+    store.record_step_completed("carol", run, 1, now)
+    store.record_step_completed("carol", run, 1, now)
+    store.flush()
+    totals = store.summary("carol", now=now)["totals"]
+    assert (totals["tasks_started"], totals["steps_completed"], totals["tasks_completed"]) == (1, 2, 1), totals
+    store.record_started("carol", dict(run, id=43), now)
+    store.record_started("dave", run, now)
+    store.flush()
+    assert store.summary("carol", now=now)["totals"]["tasks_started"] == 2, "新的执行重新计数"
+    assert store.summary("dave", now=now)["totals"]["tasks_started"] == 1, "执行标识按用户区分"
+    assert store.get_metrics()["duplicates"] == 5
+    print(f"   📊 {store.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 统计汇总测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_stats_store()
+    benchmark_stats_summary()
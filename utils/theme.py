@@ -0,0 +1,225 @@
+"""
+theme.py - 全局主题样式
+所有页面共用 static/taskspark.css。构建时（python utils/theme.py build）压缩成带内容哈希的静态文件并提交，
+页面每次重新运行只发送一个<link>标签，样式本身由浏览器下载一次后缓存；运行时只读，不写源码目录。
+Inter字体使用 static/fonts/ 下的自托管子集（每个字重一个文件，本机已安装Inter时优先使用），不请求外部地址。
+"""
+
+import os
+import re
+import sys
+import hashlib
+import threading
+from typing import Dict, Any
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(ROOT_DIR, "static")
+THEME_SOURCE = os.path.join(STATIC_DIR, "taskspark.css")
+FONT_DIR = os.path.join(STATIC_DIR, "fonts")
+
+# 样式中用到的字重及对应的子集文件（Inter按字重分成单独的字体文件）
+FONT_WEIGHTS = {
+    400: "Regular",
+    500: "Medium",
+    600: "SemiBold",
+    700: "Bold"
+}
+FONT_FILES = {weight: f"inter-latin-{weight}.woff2" for weight in FONT_WEIGHTS}
+
+# 子集保留的字符：基本拉丁字母、拉丁补充和常用标点。中文由系统字体显示，不放进子集
+FONT_SUBSET_UNICODES = "U+0020-007E,U+00A0-00FF,U+2010-2027,U+2030-203A,U+20AC"
+
+# Streamlit开启静态文件服务后，static/目录下的文件在 app/static/ 路径下提供
+STATIC_URL = "app/static"
+
+_stylesheet = None
+_stylesheet_lock = threading.Lock()
+
+
+def minify_css(css: str) -> str:
+    """去掉注释和多余空白"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    # 冒号前的空格在选择器里有含义（如 "a :hover"），只去掉冒号后的
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    css = css.replace(";}", "}")
+    return css.strip()
+
+
+def font_face_css() -> str:
+    """
+    Inter字体的@font-face声明（每个字重一条）
+
+    优先使用本机安装的Inter；static/fonts/下有自托管子集时作为后备，
+    URL带上文件哈希，字体更新后浏览器会重新下载。font-display: swap保证字体未就绪时先用系统字体显示文字。
+    """
+    rules = []
+    for weight, style in FONT_WEIGHTS.items():
+        sources = [f"local('Inter {style}')", f"local('Inter-{style}')"]
+        if weight == 400:
+            sources.insert(0, "local('Inter')")
+        font_path = os.path.join(FONT_DIR, FONT_FILES[weight])
+        if os.path.exists(font_path):
+            with open(font_path, "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()[:10]
+            # 相对于样式文件（app/static/）解析
+            sources.append(f"url('fonts/{FONT_FILES[weight]}?v={digest}') format('woff2')")
+        rules.append(
+            f"@font-face{{font-family:'Inter';font-style:normal;font-weight:{weight};font-display:swap;"
+            f"src:{','.join(sources)};unicode-range:{FONT_SUBSET_UNICODES}}}"
+        )
+    return "".join(rules)
+
+
+def subset_font(source_path: str, output_path: str = None) -> Dict[str, Any]:
+    """
+    从完整的Inter字体文件生成woff2子集，按字体的字重写到 static/fonts/inter-latin-<字重>.woff2
+
+    需要 fonttools 和 brotli（pip install -r requirements-dev.txt），只在更新字体时手动运行：
+        python utils/theme.py subset-font path/to/Inter-Regular.woff2 path/to/Inter-Bold.woff2 ...
+    之后运行 python utils/theme.py build 重新生成样式文件（字体哈希在样式中）。
+    """
+    try:
+        from fontTools import subset
+    except ImportError:
+        raise RuntimeError("生成字体子集需要安装 fonttools 和 brotli: pip install -r requirements-dev.txt")
+
+    options = subset.Options()
+    options.flavor = "woff2"
+    options.hinting = False
+    options.desubroutinize = True
+    options.name_IDs = ["*"]
+
+    font = subset.load_font(source_path, options)
+    weight = font["OS/2"].usWeightClass
+    if output_path is None:
+        if weight not in FONT_FILES:
+            raise ValueError(f"样式中没有用到字重 {weight}: {source_path}")
+        output_path = os.path.join(FONT_DIR, FONT_FILES[weight])
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=subset.parse_unicodes(FONT_SUBSET_UNICODES))
+    subsetter.subset(font)
+    subset.save_font(font, output_path, options)
+
+    result = {
+        "output": output_path,
+        "weight": weight,
+        "source_bytes": os.path.getsize(source_path),
+        "subset_bytes": os.path.getsize(output_path)
+    }
+    print(f"✅ 字体子集已生成: {output_path} ({result['source_bytes']} → {result['subset_bytes']} 字节)")
+    return result
+
+
+def build_stylesheet() -> Dict[str, Any]:
+    """
+    压缩主题样式并计算内容哈希，进程内只执行一次（运行时不写文件）
+
+    文件名包含内容哈希，样式改动后URL随之改变，浏览器不会用到旧缓存。
+    对应的静态文件由 write_stylesheet() 在构建时生成；不存在时（样式改了还没重新构建）file为None，
+    由apply_theme退回内联方式。
+    """
+    global _stylesheet
+    if _stylesheet is not None:
+        return _stylesheet
+
+    with _stylesheet_lock:
+        if _stylesheet is None:
+            with open(THEME_SOURCE, encoding="utf-8") as f:
+                source = f.read()
+            css = font_face_css() + minify_css(source)
+            digest = hashlib.sha1(css.encode("utf-8")).hexdigest()[:10]
+            filename = f"taskspark.{digest}.min.css"
+
+            _stylesheet = {
+                "css": css,
+                "file": filename if os.path.exists(os.path.join(STATIC_DIR, filename)) else None,
+                "expected_file": filename,
+                "source_bytes": len(source.encode("utf-8")),
+                "minified_bytes": len(css.encode("utf-8"))
+            }
+    return _stylesheet
+
+
+def write_stylesheet() -> str:
+    """
+    构建时生成压缩样式文件，并删除旧哈希的文件（修改 taskspark.css 或字体后运行）：
+        python utils/theme.py build
+    """
+    global _stylesheet
+    with _stylesheet_lock:
+        _stylesheet = None
+    filename = build_stylesheet()["expected_file"]
+    with open(os.path.join(STATIC_DIR, filename), "w", encoding="utf-8") as f:
+        f.write(build_stylesheet()["css"])
+
+    for name in os.listdir(STATIC_DIR):
+        if re.fullmatch(r"taskspark\.[0-9a-f]+\.min\.css", name) and name != filename:
+            os.remove(os.path.join(STATIC_DIR, name))
+            print(f"🗑️ 已删除旧的样式文件: {name}")
+
+    with _stylesheet_lock:
+        _stylesheet = None
+    print(f"✅ 样式文件已生成: static/{filename}")
+    return filename
+
+
+def _static_serving_enabled() -> bool:
+    import streamlit as st
+    try:
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
+        return False
+
+
+def theme_tag() -> str:
+    """当前页面需要发送的样式标签"""
+    stylesheet = build_stylesheet()
+    if stylesheet["file"] and _static_serving_enabled():
+        return f"<link rel='stylesheet' href='{STATIC_URL}/{stylesheet['file']}'>"
+    return f"<style>{stylesheet['css']}</style>"
+
+
+def apply_theme():
+    """在页面顶部调用，应用全局主题"""
+    import streamlit as st
+    st.markdown(theme_tag(), unsafe_allow_html=True)
+
+
+# 测试函数
+def test_theme():
+    """测试样式压缩和静态文件生成"""
+    print("🧪 测试主题样式")
+    print("=" * 60)
+
+    assert minify_css("a :hover { color : red ; }") == "a :hover{color :red}", "选择器中冒号前的空格应保留"
+    assert minify_css("/* 注释 */ .a > .b , .c { margin: 0 auto; }") == ".a>.b,.c{margin:0 auto}"
+
+    stylesheet = build_stylesheet()
+    assert stylesheet["file"], f"样式文件不是最新的，请运行 python utils/theme.py build 生成 {stylesheet['expected_file']}"
+    assert [name for name in os.listdir(STATIC_DIR) if name.endswith(".min.css")] == [stylesheet["file"]], "应只保留当前哈希的样式文件"
+    assert "/*" not in stylesheet["css"]
+    assert "font-display:swap" in stylesheet["css"]
+    for weight, filename in FONT_FILES.items():
+        assert os.path.exists(os.path.join(FONT_DIR, filename)), f"缺少自托管字体子集: static/fonts/{filename}"
+        assert f"font-weight:{weight};" in stylesheet["css"] and f"url('fonts/{filename}?v=" in stylesheet["css"]
+    assert not re.search(r"https?://|url\(\s*['\"]?//", stylesheet["css"]), "主题样式不应引用外部地址"
+    print(f"   📦 {stylesheet['file']}: {stylesheet['source_bytes']} → {stylesheet['minified_bytes']} 字节")
+    print(f"   🔗 {theme_tag()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 主题样式测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "subset-font":
+        for source in sys.argv[2:]:
+            subset_font(source)
+    elif len(sys.argv) >= 2 and sys.argv[1] == "build":
+        write_stylesheet()
+    else:
+        test_theme()
@@ -0,0 +1,186 @@
+"""
+view_model.py - 分析页和执行页的视图模型
+每份分析结果的卡片、步骤列表等HTML/Markdown片段只构建一次，页面重新运行时直接取用。
+按结果的内容标识（result_schema.fingerprint）缓存，重复出现的列表合并成一段HTML，元素数量不再随步骤数增长。
+"""
+
+import re
+import html
+import time
+from typing import Dict, Any, List, Optional
+
+# 分析结果没有微步骤时执行页使用的备用步骤
+FALLBACK_STEPS = [
+    {"step": "准备好必要的工具", "time": "2分钟", "tip": "只是准备，不需要开始"},
+    {"step": "设置5分钟倒计时", "time": "1分钟", "tip": "告诉自己只需坚持5分钟"},
+    {"step": "从最简单的部分开始", "time": "5分钟", "tip": "完成后可以随时停止"},
+    {"step": "完成后给自己奖励", "time": "2分钟", "tip": "庆祝小成就"}
+]
+
+ENERGY_MESSAGES = {
+    "低": "这个步骤能量需求低，容易完成",
+    "中": "中等能量需求，保持专注",
+    "高": "这个步骤需要较多能量，完成后可以休息"
+}
+
+
+def _text(value: Any) -> str:
+    """放进HTML片段的文字需要转义"""
+    return html.escape(str(value), quote=False)
+
+
+def _bullets(items: List[str], prefix: str) -> Optional[str]:
+    """多行列表合并成一段Markdown"""
+    if not items:
+        return None
+    return "\n".join(f"- {prefix} {item}" for item in items)
+
+
+def parse_step_seconds(time_text: str, default_minutes: int = 5) -> int:
+    """把步骤的预计时间（如"3分钟"）转换成秒数"""
+    match = re.search(r"(\d+)", time_text or "")
+    minutes = int(match.group(1)) if match else default_minutes
+    return max(minutes, 1) * 60
+
+
+# ==================== 分析页 ====================
+def _step_row(index: int, step_info: Dict[str, Any]) -> str:
+    """分步执行计划中的一行：编号 / 步骤和提示 / 时间和能量"""
+    body = f"<strong>{_text(step_info.get('step', '步骤'))}</strong>"
+    if step_info.get('tip'):
+        body += f"<small>💡 {_text(step_info['tip'])}</small>"
+
+    meta = f"⏱️ {_text(step_info.get('time', ''))}"
+    energy = step_info.get('energy', '')
+    if energy:
+        energy_emoji = "⚡" if energy == "高" else "🔋"
+        meta += f"<small>{energy_emoji} {_text(energy)}能量</small>"
+
+    return (
+        f"<div class='step-row'><div class='step-row-index'>{index}</div>"
+        f"<div>{body}</div><div>{meta}</div></div>"
+    )
+
+
+def build_analysis_view(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """分析页需要的全部片段"""
+    meta = analysis.get('_meta', {})
+    task = analysis.get('task_analysis', {})
+    strategy = analysis.get('strategy', {})
+    adhd_tips = analysis.get('adhd_specific', {})
+    micro_steps = analysis.get('micro_steps', [])
+    suggestions = analysis.get('personalized_suggestions', [])
+
+    strategy_html = (
+        "<div class='ins-card'>"
+        f"<h3 style='color: var(--primary); margin-top: 0;'>{_text(strategy.get('name', '微步骤启动法'))}</h3>"
+        f"<p>{_text(strategy.get('description', ''))}</p>"
+        "<div style='background: rgba(255, 154, 139, 0.1); padding: 1rem; border-radius: var(--radius-md); margin-top: 1rem;'>"
+        f"<strong>✨ 关键原则:</strong> {_text(strategy.get('key_principle', '完成比完美重要'))}"
+        "</div></div>"
+    )
+
+    env_tips = adhd_tips.get('environment_tips', [])[:3]
+    return {
+        "caption": f"🤖 {meta.get('ai_model', '智能AI')} · {'完全离线运行' if meta.get('offline_mode', True) else '在线模式'}",
+        "metrics": [
+            ("任务类型", task.get('task_type', '未知')),
+            ("难度级别", task.get('difficulty_level', '未知')),
+            ("预计时间", task.get('estimated_time', '未知')),
+            ("步骤数量", f"{len(micro_steps)}个")
+        ],
+        "strategy_html": strategy_html,
+        "key_insight": f"✨ {task.get('key_insight', '')}",
+        "mental_blocks_md": _bullets(task.get('mental_blocks', []), "🔍"),
+        "encouragement": f"💖 {analysis.get('encouragement', '你可以做到的！')}",
+        "rewards_md": _bullets(adhd_tips.get('reward_ideas', [])[:3], "🎁"),
+        "steps_html": "".join(_step_row(i, step) for i, step in enumerate(micro_steps, 1)) or None,
+        # 两列交替排列，每列一段Markdown
+        "suggestion_columns": [_bullets(suggestions[0::2], "✅"), _bullets(suggestions[1::2], "✅")] if suggestions else None,
+        "has_adhd_tips": bool(adhd_tips),
+        "focus_tips_md": _bullets(adhd_tips.get('focus_tips', [])[:3], "🎯"),
+        "env_tips_md": "\n\n".join(f"🏠 {tip}" for tip in env_tips) if env_tips else None
+    }
+
+
+# ==================== 执行页 ====================
+def build_execution_view(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    执行页需要的全部片段
+
+    steps[i] 包含第i步作为当前步骤时的卡片、计时秒数和能量提示，以及完成后在列表中显示的HTML；
+    已完成列表由页面把前几步的HTML拼接后一次输出。
+    """
+    micro_steps = analysis.get('micro_steps', []) or FALLBACK_STEPS
+    total_steps = len(micro_steps)
+
+    steps = []
+    for i, step_info in enumerate(micro_steps):
+        tip = step_info.get('tip')
+        card_html = (
+            "<div class='current-step-card fade-in'>"
+            f"<h2>当前步骤: {i + 1}/{total_steps}</h2>"
+            f"<h3 style='margin: 1rem 0;'>📌 {_text(step_info.get('step', '步骤'))}</h3>"
+            f"<p style='font-size: 1.2rem;'>⏱️ 预计时间: {_text(step_info.get('time', ''))}</p>"
+            + (f"<p style='margin-top: 1rem; opacity: 0.9;'>💡 {_text(tip)}</p>" if tip else "")
+            + "</div>"
+        )
+        completed_html = (
+            "<div class='completed-step'>"
+            f"<strong>步骤 {i + 1}:</strong> {_text(step_info.get('step', ''))}"
+            "<div style='font-size: 0.9rem; color: var(--text-secondary);'>"
+            f"⏱️ {_text(step_info.get('time', ''))} · ✅ 已完成</div></div>"
+        )
+        energy_message = ENERGY_MESSAGES.get(step_info.get('energy', ''))
+        steps.append({
+            "card_html": card_html,
+            "seconds": parse_step_seconds(step_info.get('time', '')),
+            "energy_info": f"⚡ 能量提示: {energy_message}" if energy_message else None,
+            "completed_html": completed_html
+        })
+
+    return {
+        "total_steps": total_steps,
+        "steps": steps,
+        "task_type": analysis.get('task_analysis', {}).get('task_type', '任务'),
+        "encouragement": f"### 💬 {analysis.get('encouragement', '你太棒了！')}",
+        "rewards_md": _bullets(analysis.get('adhd_specific', {}).get('reward_ideas', [])[:3], "🎁")
+    }
+
+
+def completed_steps_html(view: Dict[str, Any], count: int) -> str:
+    """前count步的已完成列表，合并成一段HTML"""
+    return "".join(step["completed_html"] for step in view["steps"][:count])
+
+
+# 测试函数
+def test_view_model():
+    """测试视图模型的构建和内容标识"""
+    from .ai_simulator import AISimulator
+    from .result_schema import fingerprint
+
+    print("🧪 测试视图模型")
+    print("=" * 60)
+
+    analysis = AISimulator().analyze_task("躺在床上刷抖音", "复习期末考试", "procrastinating", 8)
+    analysis["micro_steps"][0]["step"] = "打开<课本>"
+
+    start_time = time.perf_counter()
+    analysis_view = build_analysis_view(analysis)
+    execution_view = build_execution_view(analysis)
+    print(f"   🧱 构建耗时 {(time.perf_counter() - start_time) * 1000:.3f}ms（{len(analysis['micro_steps'])}个步骤）")
+
+    assert analysis_view["steps_html"].count("class='step-row'") == len(analysis["micro_steps"])
+    assert "&lt;课本&gt;" in analysis_view["steps_html"], "步骤文字应转义后放进HTML"
+    assert execution_view["total_steps"] == len(analysis["micro_steps"])
+    assert completed_steps_html(execution_view, 2).count("completed-step") == 2
+    assert build_execution_view({})["total_steps"] == len(FALLBACK_STEPS)
+    print(f"   🔑 内容标识: {fingerprint(analysis)[:12]}")
+
+    print("\n" + "=" * 60)
+    print("✅ 视图模型测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_view_model()
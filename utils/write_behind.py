@@ -0,0 +1,338 @@
+"""
+write_behind.py - 后台批量写入
+页面运行中产生的记录（历史、统计、步骤事件）先放进队列，调用立即返回；
+后台线程攒够一批（数量）或等到最长延迟（时间）后，在一个事务中一起写入（group commit）。
+队列有上限，写满时调用方等待（背压）；进程正常退出时把队列中的记录全部写完。
+"""
+
+import os
+import atexit
+import queue
+import threading
+import time
+from typing import Dict, Any, List, Callable, Optional
+
+# 是否启用后台写入（off时每条记录同步写入）
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND", "on").lower() != "off"
+
+# 每批最多写入的记录数、攒批的最长等待时间（毫秒）、队列上限
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "256"))
+WRITE_BEHIND_DELAY_MS = float(os.getenv("WRITE_BEHIND_DELAY_MS", "50"))
+WRITE_BEHIND_QUEUE = int(os.getenv("WRITE_BEHIND_QUEUE", "10000"))
+
+# 队列写满时调用方最多等待的时间（秒），超时后改为同步写入，记录不会丢失
+BACKPRESSURE_TIMEOUT = float(os.getenv("WRITE_BEHIND_BLOCK_SECONDS", "5"))
+
+# 队列中的控制标记
+_STOP = object()
+
+
+class _Flush:
+    """flush() 放进队列的标记：写到这里时，之前提交的记录都已写入"""
+
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class WriteBehind:
+    """
+    一个存储的后台写入队列
+
+    write_batch(items) 负责把一批记录在一个事务中写入；
+    读取方需要看到自己刚提交的记录时先调用 flush()（队列为空时立即返回）。
+    """
+
+    def __init__(self, name: str, write_batch: Callable[[List[Any]], None], batch_size: int = WRITE_BEHIND_BATCH,
+                 max_delay_ms: float = WRITE_BEHIND_DELAY_MS, max_pending: int = WRITE_BEHIND_QUEUE):
+        """
+        Args:
+            name: 名称（日志和统计用）
+            write_batch: 写入一批记录的函数
+            batch_size: 每批最多写入的记录数
+            max_delay_ms: 第一条记录进入队列后最多等待多久就写入
+            max_pending: 队列上限，写满时调用方等待
+        """
+        self.name = name
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pending = 0
+
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.backpressure_waits = 0
+        self.blocked_ms = 0.0
+        self.sync_writes = 0
+        self.write_ms = 0.0
+        self.max_queued = 0
+
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{name}", daemon=True)
+        self._thread.start()
+        _register(self)
+
+    # ==================== 提交 ====================
+    def submit(self, item: Any):
+        """提交一条记录：通常立即返回；队列写满时等待后台写入腾出空间"""
+        if self._closed:
+            self._write_now([item])
+            return
+        with self._lock:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            start_time = time.perf_counter()
+            try:
+                self._queue.put(item, timeout=BACKPRESSURE_TIMEOUT)
+            except queue.Full:
+                # 后台写入长时间跟不上，改为同步写入
+                with self._lock:
+                    self._pending -= 1
+                self._write_now([item])
+                return
+            finally:
+                with self._lock:
+                    self.backpressure_waits += 1
+                    self.blocked_ms += (time.perf_counter() - start_time) * 1000
+        with self._lock:
+            self.submitted += 1
+            self.max_queued = max(self.max_queued, self._queue.qsize())
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前提交的记录全部写入；没有待写入的记录时立即返回"""
+        with self._lock:
+            if self._pending == 0 or self._closed:
+                return True
+        marker = _Flush()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout: float = 30):
+        """写完队列中的记录并停止后台线程（之后提交的记录同步写入）"""
+        if self._closed:
+            return
+        # 先标记关闭：之后提交的记录同步写入，不会排在停止标记之后
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # ==================== 后台线程 ====================
+    def _write_now(self, items: List[Any]):
+        """写入一批记录并记录耗时；写入失败时打印错误，不影响后续批次"""
+        start_time = time.perf_counter()
+        try:
+            self.write_batch(items)
+        except Exception as e:
+            print(f"❌ 后台写入失败（{self.name}，{len(items)}条）: {e}")
+            with self._lock:
+                self.failed += len(items)
+            return
+        with self._lock:
+            self.write_ms += (time.perf_counter() - start_time) * 1000
+            if threading.current_thread() is self._thread:
+                self.written += len(items)
+                self.batches += 1
+            else:
+                self.sync_writes += len(items)
+
+    def _run(self):
+        """取出第一条记录后继续攒批，直到数量够了、等待超时或遇到flush/停止标记"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch, markers = [], []
+            deadline = time.monotonic() + self.max_delay
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, _Flush):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                if stopping or markers or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if stopping:
+                # 停止前取出队列中剩下的记录一起写入
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, _Flush):
+                        markers.append(item)
+                    elif item is not _STOP:
+                        batch.append(item)
+
+            for offset in range(0, len(batch), self.batch_size):
+                self._write_now(batch[offset:offset + self.batch_size])
+            with self._lock:
+                self._pending -= len(batch)
+            for marker in markers:
+                marker.done.set()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """提交、写入、批次和背压情况"""
+        with self._lock:
+            return {
+                "name": self.name,
+                "submitted": self.submitted,
+                "written": self.written,
+                "pending": self._pending,
+                "batches": self.batches,
+                "avg_batch": round(self.written / self.batches, 1) if self.batches else None,
+                "avg_batch_ms": round(self.write_ms / max(self.batches + self.sync_writes, 1), 3),
+                "failed": self.failed,
+                "backpressure_waits": self.backpressure_waits,
+                "blocked_ms": round(self.blocked_ms, 1),
+                "sync_writes": self.sync_writes,
+                "max_queued": self.max_queued
+            }
+
+
+# ==================== 进程退出时写完 ====================
+_writers: List[WriteBehind] = []
+_writers_lock = threading.Lock()
+
+def _register(writer: WriteBehind):
+    with _writers_lock:
+        _writers.append(writer)
+
+def close_all():
+    """写完所有队列中的记录（进程正常退出时自动调用）"""
+    with _writers_lock:
+        writers = list(_writers)
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+atexit.register(close_all)
+
+
+# 性能测试
+def benchmark_write_behind(threads: int = 8, reruns: int = 300):
+    """
+    写入密集的负载：多个会话同时运行，每次运行写入一条历史记录、一次统计和两条步骤事件，
+    比较同步写入和后台批量写入时每次运行的耗时分布（p50 / p99）
+    """
+    import tempfile
+    from .event_log import EventLog
+    from .history_store import HistoryStore
+    from .stats_store import StatsStore
+
+    print("⏱️ 后台批量写入 vs 同步写入（写入密集负载）")
+    print("=" * 60)
+
+    results = {}
+    for mode in (False, True):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "load.db")
+        history = HistoryStore(path, write_behind=mode)
+        stats = StatsStore(path, write_behind=mode)
+        events = EventLog(os.path.join(directory, "events"), write_behind=mode)
+        samples: List[float] = []
+        samples_lock = threading.Lock()
+
+        def session(index: int):
+            user_id = f"{index:032x}"
+            run = {'task_type': "学习", 'mood': "tired", 'difficulty': 7, 'total_steps': 6}
+            local = []
+            for i in range(reruns):
+                start_time = time.perf_counter()
+                history.enqueue(user_id, {'from': "刷手机", 'to': f"任务{i}", 'mood': "tired", 'difficulty': 7}, "0" * 40)
+                stats.record_step_completed(user_id, run, i % 6)
+                events.append("completed", i % 6, 6, "学习", "tired", 7, index, 60.0)
+                events.append("started", (i + 1) % 6, 6, "学习", "tired", 7, index)
+                local.append((time.perf_counter() - start_time) * 1000)
+            with samples_lock:
+                samples.extend(local)
+
+        start_time = time.perf_counter()
+        workers = [threading.Thread(target=session, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        submit_s = time.perf_counter() - start_time
+        for store in (history, stats, events):
+            store.flush()
+        total_s = time.perf_counter() - start_time
+
+        assert history.count(f"{0:032x}") == reruns
+        assert stats.summary(f"{0:032x}")["totals"]["steps_completed"] == reruns
+        assert events.aggregate()["events"]["completed"] == threads * reruns
+
+        samples.sort()
+        name = "后台批量写入" if mode else "同步写入"
+        results[name] = {
+            "p50_ms": round(samples[len(samples) // 2], 3),
+            "p99_ms": round(samples[int(len(samples) * 0.99)], 3),
+            "max_ms": round(samples[-1], 3),
+            "total_s": round(total_s, 2)
+        }
+        print(f"   {name}: {results[name]}（提交用时 {submit_s:.2f}s）")
+        if mode:
+            for store in (history, stats, events):
+                print(f"   📊 {store.writer.get_metrics()}")
+                store.writer.close()
+    return results
+
+
+# 测试函数
+def test_write_behind():
+    """测试攒批、flush、背压和关闭时写完"""
+    print("🧪 测试后台批量写入")
+    print("=" * 60)
+
+    written: List[List[int]] = []
+    gate = threading.Event()
+
+    def write_batch(items):
+        gate.wait()
+        written.append(list(items))
+
+    writer = WriteBehind("test", write_batch, batch_size=4, max_delay_ms=20, max_pending=3)
+    gate.set()
+    for i in range(10):
+        writer.submit(i)
+    assert writer.flush(timeout=5)
+    assert [item for batch in written for item in batch] == list(range(10)), "按提交顺序写入"
+    assert all(len(batch) <= 4 for batch in written) and len(written) < 10, "应合并成批写入"
+
+    # 写入阻塞时队列写满：调用方等待（背压），写入恢复后继续
+    gate.clear()
+    threading.Timer(0.1, gate.set).start()
+    for i in range(10, 20):
+        writer.submit(i)
+    metrics = writer.get_metrics()
+    assert metrics["backpressure_waits"] > 0 and metrics["blocked_ms"] > 0, metrics
+
+    # 关闭时写完队列中的记录，之后提交的记录同步写入
+    writer.close()
+    assert [item for batch in written for item in batch] == list(range(20))
+    writer.submit(20)
+    assert written[-1] == [20] and writer.get_metrics()["sync_writes"] == 1
+    print(f"   📊 {writer.get_metrics()}")
+
+    print("\n" + "=" * 60)
+    print("✅ 后台批量写入测试完成！")
+    return True
+
+
+if __name__ == "__main__":
+    test_write_behind()
+    benchmark_write_behind()